@@ -0,0 +1,106 @@
+import logging
+import time
+
+import pandas as pd
+
+from query_cache import cached_read_sql
+
+# Named row filters; each takes the summary frame and returns a boolean mask
+FILTERS = {
+    # The rows visualanalysis.py keeps after removing the inconsistent values
+    'consistent': lambda df: (df['GrossProfit'] > 0) & (df['ProfitMargin'] > 0) & (df['TotalSalesQuantity'] > 0),
+}
+
+
+def compact_dtypes(df, category_ratio = 0.5):
+    """Downcasts integer columns and turns repetitive text columns into categoricals
+
+    Floats keep float64 so the KPIs are not rounded.
+    """
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_integer_dtype(values.dtype):
+            df[col] = pd.to_numeric(values, downcast = 'integer')
+        elif pd.api.types.is_string_dtype(values.dtype) or values.dtype == object:
+            if values.nunique() <= category_ratio * max(len(values), 1):
+                df[col] = values.astype('category')
+    return df
+
+
+class AnalysisContext:
+    """The summary table loaded once, with filtered views as masks and memoized rollups
+
+    Filters are boolean masks over the one frame instead of filtered copies, and every
+    (filter, keys, column, aggregation) result is computed once per context, so repeated
+    vendor and brand rollups are free after the first.
+    """
+
+    def __init__(self, conn, table_name = 'final_summary_table', filters = None):
+        start = time.time()
+        self.df = compact_dtypes(cached_read_sql(f'SELECT * FROM {table_name}', conn))
+        self.filters = dict(FILTERS, **(filters or {}))
+        self._masks = {}
+        self._memo = {}
+        logging.info(f'Analysis context: {len(self.df)} rows of {table_name} loaded '
+                     f'({self.df.memory_usage(deep = True).sum() / 2**20:.1f} MiB) in {time.time() - start:.2f} seconds')
+
+    def add_filter(self, name, function):
+        self.filters[name] = function
+        self._masks.pop(name, None)
+        self._memo = {key: value for key, value in self._memo.items() if key[0] != name}
+
+    def add_column(self, name, values):
+        """Adds a derived column (aligned on the index, so values for the rows of a filter leave the
+        other rows NaN); replacing an existing column forgets every memoized result"""
+        if name in self.df.columns:
+            self._masks.clear()
+            self._memo = {}
+        self.df[name] = values
+
+    def mask(self, name = None):
+        """Boolean mask of a named filter (None for all rows)"""
+        if name is None:
+            return None
+        if name not in self._masks:
+            self._masks[name] = self.filters[name](self.df).to_numpy()
+        return self._masks[name]
+
+    def view(self, name = None, columns = None):
+        """The rows of a filter, restricted to columns; only what is asked for is copied"""
+        columns = slice(None) if columns is None else columns
+        mask = self.mask(name)
+        return self.df.loc[:, columns] if mask is None else self.df.loc[mask, columns]
+
+    def column(self, col, name = None):
+        return self.view(name, col)
+
+    def _memoized(self, key, compute):
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def groupby(self, keys, agg, name = None):
+        """Grouped aggregation of the rows of a filter, e.g. groupby('VendorName', {'TotalSalesDollars': 'sum'})
+
+        agg maps each column to one aggregation. Every column is computed (and memoized) on its
+        own, so a rollup shares its columns with any earlier rollup over the same keys.
+        """
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        parts = [self._memoized((name, tuple(keys), col, func), lambda col = col, func = func: self._aggregate(keys, col, func, name))
+                 for col, func in agg.items()]
+        return pd.concat(parts, axis = 1)
+
+    def _aggregate(self, keys, col, func, name):
+        frame = self.view(name, keys + [col])
+        result = frame.groupby(keys, observed = True, sort = True)[col].agg(func)
+        # Categorical keys are turned back into plain labels, as with the text columns they came from
+        if isinstance(result.index, pd.CategoricalIndex):
+            result.index = result.index.astype(result.index.categories.dtype)
+        return result
+
+    def value_counts(self, col, name = None):
+        return self._memoized((name, (col,), col, 'value_counts'),
+                              lambda: self.column(col, name).value_counts().loc[lambda counts: counts > 0])
+
+    def quantile(self, col, q, name = None):
+        return self._memoized((name, (), col, ('quantile', q)), lambda: self.column(col, name).quantile(q))
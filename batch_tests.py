@@ -0,0 +1,124 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from db_connection import reader_connection
+
+# The rows visualanalysis.py analyses
+CONSISTENT_ROWS = 'GrossProfit > 0 AND ProfitMargin > 0 AND TotalSalesQuantity > 0'
+
+CORRECTIONS = ('holm', 'bonferroni', 'fdr_bh', 'none')
+
+
+def group_statistics(conn, group_col = 'VendorName', value_col = 'ProfitMargin', table_name = 'final_summary_table',
+                     where = CONSISTENT_ROWS):
+    """Count, sum and sum of squares of value_col per group, in one SQL GROUP BY
+
+    The values are centred on their overall mean inside the query, which keeps the sums of
+    squares from cancelling catastrophically when the variance is small next to the mean.
+    Returns the statistics frame and the centre.
+    """
+    where = f'WHERE {value_col} IS NOT NULL' + (f' AND ({where})' if where else '')
+    df = pd.read_sql_query(f"""
+        WITH centre AS (SELECT AVG({value_col}) AS c FROM {table_name} {where})
+        SELECT {group_col}, COUNT(*) AS n, SUM({value_col} - c) AS s, SUM(({value_col} - c) * ({value_col} - c)) AS ss, c
+        FROM {table_name}, centre {where}
+        GROUP BY {group_col}""", conn)
+    centre = df['c'].iloc[0] if len(df) else 0.0
+    return df.drop(columns = 'c'), centre
+
+
+def welch_from_stats(n1, s1, ss1, n2, s2, ss2):
+    """Welch t statistics, degrees of freedom and two-sided p-values from counts, sums and sums of
+    squares (all array-like); groups with fewer than two values give NaN"""
+    n1, s1, ss1, n2, s2, ss2 = (np.asarray(x, dtype = 'float64') for x in (n1, s1, ss1, n2, s2, ss2))
+    with np.errstate(all = 'ignore'):
+        mean1, mean2 = s1 / n1, s2 / n2
+        var1 = np.clip(ss1 - s1 * mean1, 0, None) / (n1 - 1)
+        var2 = np.clip(ss2 - s2 * mean2, 0, None) / (n2 - 1)
+        se1, se2 = var1 / n1, var2 / n2
+        t = (mean1 - mean2) / np.sqrt(se1 + se2)
+        dof = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+    invalid = (n1 < 2) | (n2 < 2)
+    t[invalid] = np.nan
+    dof[invalid] = np.nan
+    p = 2 * stats.t.sf(np.abs(t), dof)
+    return t, dof, p
+
+
+def adjust_p_values(p, method = 'holm'):
+    """Multiple-comparison adjusted p-values (Holm, Bonferroni or Benjamini-Hochberg); NaNs are left out"""
+    p = np.asarray(p, dtype = 'float64')
+    adjusted = np.full_like(p, np.nan)
+    valid = ~np.isnan(p)
+    m = valid.sum()
+    if method == 'none' or m == 0:
+        adjusted[valid] = p[valid]
+        return adjusted
+    values = p[valid]
+    if method == 'bonferroni':
+        result = np.minimum(values * m, 1)
+    else:
+        order = np.argsort(values)
+        ranked = values[order]
+        if method == 'holm':
+            stepped = np.maximum.accumulate(ranked * (m - np.arange(m)))
+        elif method == 'fdr_bh':
+            stepped = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+        else:
+            raise ValueError(f'Unknown correction {method!r}, expected one of {CORRECTIONS}')
+        result = np.empty(m)
+        result[order] = np.minimum(stepped, 1)
+    adjusted[valid] = result
+    return adjusted
+
+
+def compare_groups_vs_rest(conn, group_col = 'VendorName', value_col = 'ProfitMargin', table_name = 'final_summary_table',
+                           where = CONSISTENT_ROWS, correction = 'holm', alpha = 0.05):
+    """Welch t-test of every group's value_col against all the other rows, thousands of tests at once
+
+    Only the per-group sufficient statistics leave SQLite; the rest-of-market statistics are the
+    totals minus the group's. Returns one row per group with the t statistic, the degrees of
+    freedom, the p-value, the adjusted p-value and whether H0 is rejected at alpha.
+    """
+    start = time.time()
+    groups, centre = group_statistics(conn, group_col, value_col, table_name, where)
+    n, s, ss = groups['n'].to_numpy('float64'), groups['s'].to_numpy('float64'), groups['ss'].to_numpy('float64')
+    t, dof, p = welch_from_stats(n, s, ss, n.sum() - n, s.sum() - s, ss.sum() - ss)
+    adjusted = adjust_p_values(p, correction)
+
+    with np.errstate(all = 'ignore'):
+        result = pd.DataFrame({
+            group_col: groups[group_col],
+            'Count': groups['n'],
+            'Mean': centre + s / n,
+            'RestMean': centre + (s.sum() - s) / (n.sum() - n),
+            'TStatistic': t,
+            'DegreesOfFreedom': dof,
+            'PValue': p,
+            'AdjustedPValue': adjusted,
+            'Reject': adjusted < alpha,
+        })
+    logging.info(f'{len(result)} Welch t-tests of {value_col} by {group_col} in {time.time() - start:.2f} seconds '
+                 f'({int(result["Reject"].sum())} rejected after {correction} correction)')
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Test every vendor or brand against the rest of the market')
+    parser.add_argument('--db', default = None, help = 'database path, by default the configured one')
+    parser.add_argument('--table', default = 'final_summary_table')
+    parser.add_argument('--by', default = 'VendorName', choices = ['VendorName', 'Description'])
+    parser.add_argument('--value', default = 'ProfitMargin')
+    parser.add_argument('--correction', default = 'holm', choices = CORRECTIONS)
+    parser.add_argument('--alpha', type = float, default = 0.05)
+    args = parser.parse_args()
+
+    conn = reader_connection(args.db)
+    results = compare_groups_vs_rest(conn, args.by, args.value, args.table, correction = args.correction, alpha = args.alpha)
+    print(results.sort_values('PValue').to_string(index = False))
+    conn.close()
@@ -0,0 +1,80 @@
+"""Micro-benchmark of clean_data against clean_data_vectorized on a synthetic summary frame.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_clean_data --rows 10000000
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from get_summary_table import clean_data, clean_data_vectorized
+
+
+def synthetic_summary(rows, seed = 0):
+    """A frame shaped like the create_vendor_summary result, with NULL sales/freight and zero denominators"""
+    rng = np.random.default_rng(seed)
+    vendors = np.array([f' VENDOR {i}  ' for i in range(200)], dtype = object)
+    brands = np.array([f'Brand {i} ' for i in range(5000)], dtype = object)
+    purchase_quantity = rng.integers(0, 5000, rows)
+    sales_dollars = rng.gamma(2.0, 5000.0, rows).round(2)
+    sales_dollars[rng.random(rows) < 0.02] = 0.0
+    df = pd.DataFrame({
+        'VendorNumber': rng.integers(1, 20000, rows),
+        'VendorName': vendors[rng.integers(0, len(vendors), rows)],
+        'Brand': rng.integers(1, 90000, rows),
+        'Description': brands[rng.integers(0, len(brands), rows)],
+        'PurchasePrice': rng.gamma(2.0, 12.0, rows).round(2),
+        'ActualPrice': rng.gamma(2.0, 18.0, rows).round(2),
+        'Volume': rng.choice(['750', '1000', '1750', '375'], rows).astype(object),
+        'TotalPurchaseQuantity': purchase_quantity,
+        'TotalPurchaseDollars': (purchase_quantity * rng.gamma(2.0, 12.0, rows)).round(2),
+        'TotalSalesQuantity': rng.integers(0, 5000, rows).astype('float64'),
+        'TotalSalesDollars': sales_dollars,
+        'TotalSalesPrice': rng.gamma(2.0, 100.0, rows).round(2),
+        'TotalExciseTax': rng.gamma(2.0, 50.0, rows).round(2),
+        'FreightCost': rng.gamma(2.0, 20000.0, rows).round(2),
+    })
+    missing_sales = rng.random(rows) < 0.05
+    for col in ['TotalSalesQuantity', 'TotalSalesDollars', 'TotalSalesPrice', 'TotalExciseTax']:
+        df.loc[missing_sales, col] = np.nan
+    return df
+
+
+def measure(function, df, repeat):
+    """Best wall time of function over fresh copies of df, plus the peak traced allocation of one
+    extra run (tracing is kept out of the timed runs, it slows allocation-heavy code down a lot)"""
+    best_time = float('inf')
+    for _ in range(repeat):
+        frame = df.copy()
+        start = time.perf_counter()
+        function(frame)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    frame = df.copy()
+    tracemalloc.start()
+    function(frame)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best_time, peak
+
+
+def main(rows, repeat):
+    df = synthetic_summary(rows)
+    print(f'{rows:,} rows, best of {repeat}')
+    results = {'clean_data': measure(clean_data, df, repeat),
+               'clean_data_vectorized': measure(clean_data_vectorized, df, repeat)}
+    for name, (seconds, peak) in results.items():
+        print(f'{name:>22}: {seconds:8.3f} s   peak allocations {peak / 2**20:9.1f} MiB')
+    print(f'{"speed-up":>22}: {results["clean_data"][0] / results["clean_data_vectorized"][0]:8.2f}x')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--rows', type = int, default = 10_000_000)
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
@@ -0,0 +1,236 @@
+"""End-to-end benchmark of ingestion, the vendor summary and the analysis at several data scales.
+
+For every scale a synthetic dataset is generated (see synthetic_data.py, reused across runs)
+and the steps are timed in a fresh process against their own database. Results are appended
+to benchmarks/results.jsonl and compared with benchmarks/baseline.json.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --scales 10000 100000 1000000
+    python -m benchmarks.bench_pipeline --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_FILE = os.path.join(BENCH_DIR, 'results.jsonl')
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+DEFAULT_WORK_DIR = 'bench_work'
+
+# Above this many sales rows the csvs are streamed in chunks instead of being read whole
+STREAM_THRESHOLD = 5_000_000
+STREAM_CHUNKSIZE = 1_000_000
+
+# ingest_db is timed on at most this many sales rows, which have to fit in memory at once
+INGEST_DB_MAX_ROWS = 5_000_000
+
+# A step is a regression when it is this much slower than the baseline, and by more than the noise floor
+DEFAULT_TOLERANCE = 0.25
+NOISE_FLOOR_SECONDS = 0.05
+
+
+
+def analysis_computations(conn, writer, table_name = 'vendor_summary'):
+    """The computations of visualanalysis.py without the plotting"""
+    import numpy as np
+    import pandas as pd
+    from scipy import stats
+
+    from analysis_context import AnalysisContext
+    from rollups import brand_margin_vs_sales, ensure_rollups, low_turnover_vendors, purchase_contribution, top_n
+
+    ctx = AnalysisContext(conn, table_name)
+    df = ctx.df
+    ensure_rollups(writer, table_name)
+    df.describe()
+    numerical_columns = df.select_dtypes(include = np.number).columns
+    for col in ['VendorName', 'Description']:
+        ctx.value_counts(col, 'consistent')
+    ctx.view('consistent', numerical_columns).corr()
+    brand_margin_vs_sales(conn, 'consistent', table_name)
+    top_n(conn, 'vendor', 'TotalSalesDollarsSum', 10, 'consistent', source = table_name)
+    top_n(conn, 'brand', 'TotalSalesDollarsSum', 10, 'consistent', source = table_name)
+    purchase_contribution(conn, 10, 'consistent', table_name)
+    ctx.add_column('UnitPrice', df['TotalPurchaseDollars'] / df['TotalPurchaseQuantity'])
+    ctx.add_column('OrderSize', pd.qcut(ctx.column('TotalPurchaseQuantity', 'consistent'), q = 3,
+                                        labels = ['Small', 'Medium', 'Large'], duplicates = 'drop'))
+    ctx.groupby('OrderSize', {'UnitPrice': 'mean'}, 'consistent')
+    low_turnover_vendors(conn, 10, 'consistent', table_name)
+    ctx.add_column('UnsoldInventoryValue', (df['TotalPurchaseQuantity'] - df['TotalSalesQuantity']) * df['PurchasePrice'])
+    ctx.column('UnsoldInventoryValue', 'consistent').sum()
+    top_n(conn, 'vendor', 'UnsoldInventoryValueSum', None, 'consistent', source = table_name)
+    top_threshold = ctx.quantile('TotalSalesDollars', 0.75, 'consistent')
+    bottom_threshold = ctx.quantile('TotalSalesDollars', 0.25, 'consistent')
+    sales, margin = ctx.column('TotalSalesDollars', 'consistent'), ctx.column('ProfitMargin', 'consistent')
+    top, bottom = margin[sales >= top_threshold].dropna(), margin[sales <= bottom_threshold].dropna()
+    for values in (top, bottom):
+        stats.t.interval(0.95, len(values) - 1, loc = np.mean(values), scale = stats.sem(values))
+    stats.ttest_ind(top, bottom, equal_var = False)
+    return len(df)
+
+
+def run_scale(sales_rows, repeat):
+    """Times every step at one scale; runs inside the scale's work directory, in its own process"""
+    os.makedirs('logs', exist_ok = True)
+    os.environ['INVENTORY_DB'] = os.path.abspath('bench.db')
+    # Imported after INVENTORY_DB is set: ingestion_DB opens its engine on import
+    from bulk_insert import bulk_insert
+    from db_connection import read_connection, writer_connection
+    from db_indexes import build_indexes
+    from get_summary_table import clean_data_vectorized, create_vendor_summary, summary_column_types
+    from ingestion_DB import engine, ingest_db, load_raw_data, read_csv
+    from instrumentation import measure
+    from query_cache import clear_cache
+    # Imported before the clock starts, so that the analysis timing leaves out import time
+    import analysis_context, rollups, scipy.stats
+
+    streaming = sales_rows > STREAM_THRESHOLD
+    results = {}
+
+    def timed(step, func, rows_in = None):
+        """Best of repeat runs of func, which returns the rows it produced"""
+        best = None
+        for _ in range(repeat):
+            with measure('benchmark', step, writer_connection(), rows_in = rows_in) as record:
+                record['rows_out'] = func()
+            if best is None or record['wall_seconds'] < best['wall_seconds']:
+                best = record
+        results[step] = best
+        print(f'{sales_rows:>12,} {step:<22} {best["wall_seconds"]:9.3f} s', file = sys.stderr)
+
+    def ingest_all():
+        load_raw_data(chunksize = STREAM_CHUNKSIZE if streaming else None)
+        return writer_connection().execute('SELECT COUNT(*) FROM sales').fetchone()[0]
+
+    sales, _ = read_csv('data/sales.csv', nrows = INGEST_DB_MAX_ROWS)
+    summary = {}
+
+    def ingest_sales():
+        ingest_db(sales, 'bench_ingest', engine)
+        return len(sales)
+
+    def vendor_summary():
+        summary['raw'] = create_vendor_summary(writer_connection())
+        return len(summary['raw'])
+
+    def clean():
+        summary['clean'] = clean_data_vectorized(summary['raw'].copy())
+        return len(summary['clean'])
+
+    def analysis():
+        clear_cache()
+        with read_connection() as conn:
+            return analysis_computations(conn, writer_connection())
+
+    timed('load_raw_data', ingest_all)
+    timed('ingest_db', ingest_sales, rows_in = len(sales))
+    del sales
+    writer_connection().execute('DROP TABLE IF EXISTS bench_ingest')
+    timed('build_indexes', lambda: build_indexes(writer_connection()))
+    timed('create_vendor_summary', vendor_summary)
+    timed('clean_data', clean, rows_in = len(summary['raw']))
+    bulk_insert(summary['clean'], 'vendor_summary', writer_connection(),
+                column_types = summary_column_types(summary['clean'].columns))
+    timed('visualanalysis', analysis)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = REPO_DIR, capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_scale(sales_rows, work_dir, repeat, seed):
+    """Generates (or reuses) the dataset of a scale and runs its steps in a child process"""
+    from benchmarks.synthetic_data import generate_dataset
+
+    scale_dir = os.path.abspath(os.path.join(work_dir, str(sales_rows)))
+    generate_dataset(os.path.join(scale_dir, 'data'), sales_rows, seed)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(os.path.join(scale_dir, 'bench.db' + suffix)):
+            os.remove(os.path.join(scale_dir, 'bench.db' + suffix))
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    child = subprocess.run([sys.executable, '-m', 'benchmarks.bench_pipeline', '--run-scale', str(sales_rows),
+                            '--repeat', str(repeat)], cwd = scale_dir, env = env, stdout = subprocess.PIPE, text = True)
+    if child.returncode != 0:
+        raise RuntimeError(f'Benchmark at {sales_rows:,} sales rows failed (exit code {child.returncode})')
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance = DEFAULT_TOLERANCE):
+    """(scale, step, baseline seconds, seconds, ratio) of every step slower than the baseline allows"""
+    regressions = []
+    for key, record in results.items():
+        if key in baseline:
+            before, now = baseline[key], record['wall_seconds']
+            if now > before * (1 + tolerance) and now - before > NOISE_FLOOR_SECONDS:
+                scale, step = key.split('/')
+                regressions.append((int(scale), step, before, now, now / before))
+    return regressions
+
+
+def main(scales, work_dir, repeat, seed, save_baseline, tolerance):
+    run = {'ts': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'python': platform.python_version(),
+           'machine': platform.platform(), 'cpus': os.cpu_count()}
+    results = {}
+    with open(RESULTS_FILE, 'a') as f:
+        for sales_rows in scales:
+            for step, record in benchmark_scale(sales_rows, work_dir, repeat, seed).items():
+                results[f'{sales_rows}/{step}'] = record
+                f.write(json.dumps({**run, 'scale': sales_rows, 'step': step, **record}, default = str) + '\n')
+
+    print(f'{"scale":>12} {"step":<22} {"seconds":>9} {"cpu":>9} {"rows/s":>12} {"peak MiB":>9}')
+    for key, record in results.items():
+        scale, step = key.split('/')
+        rate = record['rows_per_second']
+        print(f'{int(scale):>12,} {step:<22} {record["wall_seconds"]:9.3f} {record["cpu_seconds"]:9.3f} '
+              f'{rate if rate is not None else float("nan"):12,.0f} {record["peak_rss_delta_bytes"] / 2**20:9.1f}')
+
+    if save_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as f:
+                baseline = json.load(f)
+        baseline.update({key: record['wall_seconds'] for key, record in results.items()})
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent = 2, sort_keys = True)
+        print(f'Baseline saved to {BASELINE_FILE}')
+        return 0
+    if not os.path.exists(BASELINE_FILE):
+        print('No baseline yet, save one with --save-baseline')
+        return 0
+    with open(BASELINE_FILE) as f:
+        regressions = compare(results, json.load(f), tolerance)
+    for scale, step, before, now, ratio in regressions:
+        print(f'REGRESSION {step} at {scale:,} sales rows: {before:.3f} s -> {now:.3f} s ({ratio:.2f}x)')
+    if not regressions:
+        print(f'No regressions against the baseline (tolerance {tolerance:.0%})')
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--scales', type = int, nargs = '+', default = DEFAULT_SCALES, help = 'numbers of sales rows')
+    parser.add_argument('--work-dir', default = DEFAULT_WORK_DIR, help = 'where the datasets and databases go')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'runs per step, the best one counts')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'store this run as the baseline')
+    parser.add_argument('--tolerance', type = float, default = DEFAULT_TOLERANCE)
+    parser.add_argument('--run-scale', type = int, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        print(json.dumps(run_scale(args.run_scale, args.repeat), default = str))
+    else:
+        sys.exit(main(args.scales, args.work_dir, args.repeat, args.seed, args.save_baseline, args.tolerance))
@@ -0,0 +1,329 @@
+"""Deterministic synthetic versions of the six input CSVs, at any scale.
+
+The real dataset is not redistributable; this writes files with the same columns, in the same
+order, as the code expects. Vendor and brand volumes are Zipf-skewed (a few distributors and
+brands carry most of the sales), brands belong to one vendor, purchase orders tie purchases
+to vendor_invoice, and the other row counts scale with the number of sales rows.
+
+Run from the repository root:
+
+    python -m benchmarks.synthetic_data --sales-rows 1000000 --out-dir bench_work/1000000/data
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Bump when the generated data changes, so that cached datasets are regenerated
+GENERATOR_VERSION = 1
+
+# Rows generated and written at a time; part of the seed, so it fixes the output too
+CHUNK_ROWS = 1_000_000
+
+# Zipf exponents of vendor size, brand popularity and store traffic
+VENDOR_SKEW = 1.1
+BRAND_SKEW = 1.05
+STORE_SKEW = 0.8
+
+SIZES = np.array(['750mL', '1.75L', '1L', '375mL', '50mL', '750mL 2 Pk', '1.5L'])
+SIZE_ML = np.array([750, 1750, 1000, 375, 50, 1500, 1500])
+SIZE_WEIGHTS = np.array([0.45, 0.15, 0.12, 0.12, 0.08, 0.03, 0.05])
+
+# Share of catalog rows whose Volume is 'Unknown', as in the real purchase_prices file
+UNKNOWN_VOLUME_SHARE = 0.001
+
+WORDS = np.array(['ROYAL', 'GOLDEN', 'OLD', 'SILVER', 'RIVER', 'HILL', 'OAK', 'STONE', 'NORTH', 'CROWN',
+                  'EAGLE', 'CASTLE', 'BLUE', 'RED', 'GRAND', 'VALLEY', 'HARBOR', 'MAPLE', 'IRON', 'STAR'])
+KINDS = np.array(['Vodka', 'Whiskey', 'Rum', 'Gin', 'Tequila', 'Brandy', 'Cabernet', 'Chardonnay', 'Merlot',
+                  'Pinot Noir', 'Bourbon', 'Scotch', 'Liqueur', 'Prosecco'])
+SUFFIXES = np.array(['INC', 'CORP', 'CO', 'LLC', 'USA INC', 'COMPANIES', 'IMPORTS LLC', 'WINE & SPIRITS'])
+CITIES = np.array(['HARDERSFIELD', 'PORTERLY', 'EANVERNESS', 'GARIGILL', 'ABERDEEN', 'LARNWICK', 'DONCASTER',
+                   'TAMWORTH', 'BALLYMENA', 'CARDIFF', 'MOUNTMEND', 'PITMERDEN', 'HORNSEY', 'FURNESS'])
+
+TABLE_SEEDS = {'catalog': 0, 'purchase_orders': 1, 'purchases': 2, 'sales': 3, 'inventory': 4}
+
+YEAR_START = np.datetime64('2024-01-01')
+
+
+def scale_dimensions(sales_rows):
+    """Row counts of every file and the sizes of the vendor, brand and store dimensions"""
+    vendors = int(np.clip(sales_rows ** 0.5 / 10, 20, 130))
+    brands = int(np.clip(sales_rows // 1000, 200, 12_000))
+    stores = int(np.clip(sales_rows // 100_000, 10, 80))
+    purchases = max(1000, sales_rows // 5)
+    return {
+        'sales': sales_rows,
+        'purchases': purchases,
+        'purchase_orders': max(vendors, purchases // 400),
+        'inventory': int(min(brands * stores, max(brands, sales_rows // 60))),
+        'vendors': vendors,
+        'brands': brands,
+        'stores': stores,
+    }
+
+
+def zipf_weights(n, skew):
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+
+def zipf_sampler(weights):
+    """Draws indices with the given probabilities in O(log n) each (faster than rng.choice for big draws)"""
+    cdf = np.cumsum(weights)
+    cdf[-1] = 1.0
+    return lambda rng, size: np.searchsorted(cdf, rng.random(size), side = 'right')
+
+
+def _names(rng, n, parts, suffixes):
+    """n distinct names built from random words; a number is appended where two collide"""
+    names = [' '.join(rng.choice(parts, rng.integers(1, 3))) + ' ' + suffix for suffix in rng.choice(suffixes, n)]
+    seen = {}
+    for i, name in enumerate(names):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            names[i] = f'{name} {seen[name]}'
+    return np.array(names, dtype = object)
+
+
+def build_catalog(dims, seed):
+    """Vendors, stores and the brand catalog; brands are owned by vendors with Zipf-skewed counts"""
+    rng = np.random.default_rng([seed, TABLE_SEEDS['catalog']])
+    vendors = np.sort(rng.choice(np.arange(2, 100_000), dims['vendors'], replace = False))
+    # Vendor names carry trailing spaces, as in the real files (the cleaning step strips them)
+    vendor_names = np.array([name + ' ' * int(pad) for name, pad in
+                             zip(_names(rng, dims['vendors'], WORDS, SUFFIXES), rng.integers(0, 4, dims['vendors']))],
+                            dtype = object)
+
+    brands = dims['brands']
+    brand_ids = np.sort(rng.choice(np.arange(58, 100_000), brands, replace = False))
+    # Vendor rank 0 owns the most brands; the popularity rank of a brand is independent of its id
+    vendor_of_brand = zipf_sampler(zipf_weights(dims['vendors'], VENDOR_SKEW))(rng, brands)
+    size = rng.choice(len(SIZES), brands, p = SIZE_WEIGHTS)
+    kind = rng.integers(0, len(KINDS), brands)
+    classification = np.where(np.isin(KINDS[kind], ['Cabernet', 'Chardonnay', 'Merlot', 'Pinot Noir', 'Prosecco']), 2, 1)
+    price = np.round(np.exp(rng.normal(2.9, 0.7, brands)), 2) + 0.99
+    volume = SIZE_ML[size].astype(str).astype(object)
+    volume[rng.random(brands) < UNKNOWN_VOLUME_SHARE] = 'Unknown'
+    catalog = pd.DataFrame({
+        'Brand': brand_ids,
+        'Description': [f'{WORDS[a].title()} {WORDS[b].title()} {KINDS[k]}' for a, b, k in
+                        zip(rng.integers(0, len(WORDS), brands), rng.integers(0, len(WORDS), brands), kind)],
+        'Price': price.round(2),
+        'Size': SIZES[size],
+        'Volume': volume,
+        'Classification': classification,
+        'PurchasePrice': (price * rng.uniform(0.6, 0.8, brands)).round(2),
+        'VendorNumber': vendors[vendor_of_brand],
+        'VendorName': vendor_names[vendor_of_brand],
+    })
+    popularity = zipf_weights(brands, BRAND_SKEW)[rng.permutation(brands)]
+    stores = np.arange(1, dims['stores'] + 1)
+    return {
+        'catalog': catalog,
+        'vendor_of_brand': vendor_of_brand,
+        'vendors': vendors,
+        'vendor_names': vendor_names,
+        'size_ml': SIZE_ML[size],
+        'brand_sampler': zipf_sampler(popularity),
+        'popularity': popularity,
+        'stores': stores,
+        'store_city': CITIES[rng.integers(0, len(CITIES), len(stores))],
+        'store_sampler': zipf_sampler(zipf_weights(len(stores), STORE_SKEW)),
+    }
+
+
+def _inventory_ids(world, store_idx, brand_idx):
+    catalog = world['catalog']
+    return (pd.Series(world['stores'][store_idx].astype(str)) + '_' + world['store_city'][store_idx] + '_'
+            + catalog['Brand'].to_numpy()[brand_idx].astype(str)).to_numpy()
+
+
+def _dates(days):
+    return np.datetime_as_string(YEAR_START + days.astype('timedelta64[D]'), unit = 'D')
+
+
+def _chunks(rows, seed, table):
+    """(chunk index, rows in chunk, random generator) for every chunk of a table"""
+    for index, start in enumerate(range(0, rows, CHUNK_ROWS)):
+        yield index, min(CHUNK_ROWS, rows - start), np.random.default_rng([seed, TABLE_SEEDS[table], index])
+
+
+def _write(df, path, first):
+    df.to_csv(path, mode = 'w' if first else 'a', header = first, index = False)
+
+
+def build_purchase_orders(world, dims, seed):
+    """Purchase orders, at least one per vendor; vendors get orders in proportion to their brands' popularity"""
+    rng = np.random.default_rng([seed, TABLE_SEEDS['purchase_orders']])
+    n_vendors = len(world['vendors'])
+    share = np.bincount(world['vendor_of_brand'], weights = world['popularity'], minlength = n_vendors)
+    counts = 1 + rng.multinomial(dims['purchase_orders'] - n_vendors, share / share.sum())
+    vendor_of_po = np.repeat(np.arange(n_vendors), counts)
+    po_date = rng.integers(-10, 355, len(vendor_of_po))
+    receiving = po_date + rng.integers(5, 16, len(vendor_of_po))
+    invoice = receiving + rng.integers(1, 6, len(vendor_of_po))
+    return {
+        'vendor': vendor_of_po,
+        'number': 8000 + np.arange(len(vendor_of_po)),
+        'offsets': np.concatenate([[0], np.cumsum(counts)[:-1]]),
+        'counts': counts,
+        'po_date': po_date, 'receiving': receiving, 'invoice': invoice,
+        'pay': invoice + rng.integers(20, 46, len(vendor_of_po)),
+    }
+
+
+def write_purchases(world, orders, dims, seed, path):
+    """purchases.csv; returns the total quantity and dollars per purchase order"""
+    catalog = world['catalog']
+    quantity = np.zeros(len(orders['number']))
+    dollars = np.zeros(len(orders['number']))
+    for index, rows, rng in _chunks(dims['purchases'], seed, 'purchases'):
+        brand = world['brand_sampler'](rng, rows)
+        store = world['store_sampler'](rng, rows)
+        vendor = world['vendor_of_brand'][brand]
+        po = orders['offsets'][vendor] + (rng.random(rows) * orders['counts'][vendor]).astype('int64')
+        qty = rng.geometric(1 / 12, rows)
+        price = catalog['PurchasePrice'].to_numpy()[brand]
+        line_dollars = (qty * price).round(2)
+        quantity += np.bincount(po, weights = qty, minlength = len(quantity))
+        dollars += np.bincount(po, weights = line_dollars, minlength = len(dollars))
+        _write(pd.DataFrame({
+            'InventoryId': _inventory_ids(world, store, brand),
+            'Store': world['stores'][store],
+            'Brand': catalog['Brand'].to_numpy()[brand],
+            'Description': catalog['Description'].to_numpy()[brand],
+            'Size': catalog['Size'].to_numpy()[brand],
+            'VendorNumber': world['vendors'][vendor],
+            'VendorName': world['vendor_names'][vendor],
+            'PONumber': orders['number'][po],
+            'PODate': _dates(orders['po_date'][po]),
+            'ReceivingDate': _dates(orders['receiving'][po]),
+            'InvoiceDate': _dates(orders['invoice'][po]),
+            'PayDate': _dates(orders['pay'][po]),
+            'PurchasePrice': price,
+            'Quantity': qty,
+            'Classification': catalog['Classification'].to_numpy()[brand],
+            'Dollars': line_dollars,
+        }), path, index == 0)
+    return quantity, dollars
+
+
+def write_vendor_invoice(world, orders, quantity, dollars, seed, path):
+    rng = np.random.default_rng([seed, TABLE_SEEDS['purchase_orders'], 1])
+    vendor = orders['vendor']
+    approval = np.full(len(vendor), None, dtype = object)
+    approval[rng.random(len(vendor)) < 0.1] = 'Frank Delahunt'
+    pd.DataFrame({
+        'VendorNumber': world['vendors'][vendor],
+        'VendorName': world['vendor_names'][vendor],
+        'InvoiceDate': _dates(orders['invoice']),
+        'PONumber': orders['number'],
+        'PODate': _dates(orders['po_date']),
+        'PayDate': _dates(orders['pay']),
+        'Quantity': quantity.astype('int64'),
+        'Dollars': dollars.round(2),
+        'Freight': (dollars * rng.uniform(0.003, 0.008, len(vendor))).round(2),
+        'Approval': approval,
+    }).to_csv(path, index = False)
+
+
+def write_sales(world, dims, seed, path):
+    catalog = world['catalog']
+    for index, rows, rng in _chunks(dims['sales'], seed, 'sales'):
+        brand = world['brand_sampler'](rng, rows)
+        store = world['store_sampler'](rng, rows)
+        vendor = world['vendor_of_brand'][brand]
+        qty = rng.geometric(0.6, rows)
+        price = catalog['Price'].to_numpy()[brand]
+        classification = catalog['Classification'].to_numpy()[brand]
+        # Excise tax per liter: spirits pay more than wine
+        excise = (qty * world['size_ml'][brand] / 1000 * np.where(classification == 1, 0.79, 0.11)).round(2)
+        _write(pd.DataFrame({
+            'InventoryId': _inventory_ids(world, store, brand),
+            'Store': world['stores'][store],
+            'Brand': catalog['Brand'].to_numpy()[brand],
+            'Description': catalog['Description'].to_numpy()[brand],
+            'Size': catalog['Size'].to_numpy()[brand],
+            'SalesQuantity': qty,
+            'SalesDollars': (qty * price).round(2),
+            'SalesPrice': price,
+            'SalesDate': _dates(rng.integers(0, 366, rows)),
+            'Volume': world['size_ml'][brand],
+            'Classification': classification,
+            'ExciseTax': excise,
+            'VendorNo': world['vendors'][vendor],
+            'VendorName': world['vendor_names'][vendor],
+        }), path, index == 0)
+
+
+def write_inventories(world, dims, seed, begin_path, end_path):
+    """Stock per (store, brand); the end of the year keeps most pairs and adds a few new ones"""
+    rng = np.random.default_rng([seed, TABLE_SEEDS['inventory']])
+    catalog = world['catalog']
+    n_brands, n_stores = len(catalog), len(world['stores'])
+    pairs = np.sort(rng.choice(n_brands * n_stores, dims['inventory'], replace = False))
+    kept = pairs[rng.random(len(pairs)) < 0.95]
+    added = rng.choice(np.setdiff1d(np.arange(n_brands * n_stores), pairs), min(len(pairs) - len(kept),
+                       n_brands * n_stores - len(pairs)), replace = False)
+    for pair_ids, path, date_col, date in ((pairs, begin_path, 'startDate', '2024-01-01'),
+                                           (np.sort(np.concatenate([kept, added])), end_path, 'endDate', '2024-12-31')):
+        store, brand = pair_ids // n_brands, pair_ids % n_brands
+        pd.DataFrame({
+            'InventoryId': _inventory_ids(world, store, brand),
+            'Store': world['stores'][store],
+            'City': world['store_city'][store],
+            'Brand': catalog['Brand'].to_numpy()[brand],
+            'Description': catalog['Description'].to_numpy()[brand],
+            'Size': catalog['Size'].to_numpy()[brand],
+            'onHand': rng.geometric(0.05, len(pair_ids)) - 1,
+            'Price': catalog['Price'].to_numpy()[brand],
+            date_col: date,
+        }).to_csv(path, index = False)
+
+
+def manifest(sales_rows, seed):
+    return {'generator_version': GENERATOR_VERSION, 'sales_rows': sales_rows, 'seed': seed, 'chunk_rows': CHUNK_ROWS}
+
+
+def generate_dataset(out_dir, sales_rows, seed = 0, reuse = True):
+    """Writes the six csvs to out_dir; the same sales_rows and seed always give the same files
+
+    With reuse set, a dataset already generated with the same parameters is kept as it is.
+    Returns the row counts.
+    """
+    dims = scale_dimensions(sales_rows)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    if reuse and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f) == manifest(sales_rows, seed):
+                return dims
+
+    start = time.time()
+    os.makedirs(out_dir, exist_ok = True)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    world = build_catalog(dims, seed)
+    world['catalog'].to_csv(os.path.join(out_dir, 'purchase_prices.csv'), index = False)
+    orders = build_purchase_orders(world, dims, seed)
+    quantity, dollars = write_purchases(world, orders, dims, seed, os.path.join(out_dir, 'purchases.csv'))
+    write_vendor_invoice(world, orders, quantity, dollars, seed, os.path.join(out_dir, 'vendor_invoice.csv'))
+    write_sales(world, dims, seed, os.path.join(out_dir, 'sales.csv'))
+    write_inventories(world, dims, seed, os.path.join(out_dir, 'begin_inventory.csv'),
+                      os.path.join(out_dir, 'end_inventory.csv'))
+    # Written last, so an interrupted run is never mistaken for a complete dataset
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest(sales_rows, seed), f)
+    print(f'Generated {sales_rows:,} sales rows in {out_dir} in {time.time() - start:.1f} s')
+    return dims
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--sales-rows', type = int, default = 100_000)
+    parser.add_argument('--out-dir', default = 'data')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    print(generate_dataset(args.out_dir, args.sales_rows, args.seed, reuse = False))
@@ -0,0 +1,100 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from db_connection import reader_connection
+
+DEFAULT_RESAMPLES = 2000
+
+# Bytes the index matrices of one replicate chunk may take
+DEFAULT_CHUNK_BYTES = 256 * 2**20
+
+# The rows visualanalysis.py analyses
+CONSISTENT_ROWS = 'GrossProfit > 0 AND ProfitMargin > 0 AND TotalSalesQuantity > 0'
+
+
+def _replicate_means(values, starts, sizes, seed, replicates):
+    """Bootstrap means of every segment for a chunk of replicates: a (segments, replicates) array
+
+    Every row is redrawn from its own segment through one (rows, replicates) index matrix, and
+    the resampled segments are summed with np.add.reduceat, so all segments resample together.
+    """
+    rng = np.random.default_rng(seed)
+    segment_of_row = np.repeat(np.arange(len(sizes)), sizes)
+    row_starts = starts[segment_of_row][:, None]
+    row_sizes = sizes[segment_of_row][:, None]
+    index = row_starts + (rng.random((len(values), replicates)) * row_sizes).astype('int64')
+    return np.add.reduceat(values[index], starts, axis = 0) / sizes[:, None]
+
+
+def bootstrap_ci(df, group_col, value_col, n_resamples = DEFAULT_RESAMPLES, confidence = 0.95, seed = 0,
+                 chunk_bytes = DEFAULT_CHUNK_BYTES, workers = 1):
+    """Percentile bootstrap confidence intervals of the mean of value_col for every group_col segment
+
+    The replicates are split in chunks that keep the index matrices under chunk_bytes; each
+    chunk gets its own random stream spawned from seed, so the result is the same for any
+    number of workers. With workers > 1 the chunks run in a process pool. Missing values are
+    dropped. Returns one row per segment: Count, Estimate (the sample mean), Lower and Upper.
+    """
+    start = time.time()
+    data = df[[group_col, value_col]].dropna()
+    data = data[np.isfinite(data[value_col].to_numpy(dtype = 'float64'))]
+    data = data.sort_values(group_col, kind = 'stable')
+    groups, starts, sizes = np.unique(data[group_col].to_numpy(), return_index = True, return_counts = True)
+    values = data[value_col].to_numpy(dtype = 'float64')
+    if not len(values):
+        return pd.DataFrame(columns = [group_col, 'Count', 'Estimate', 'Lower', 'Upper'])
+
+    # Random draws, indices and resampled values take about 24 bytes per row and replicate
+    per_chunk = int(max(1, min(n_resamples, chunk_bytes // (24 * len(values)))))
+    chunks = [min(per_chunk, n_resamples - done) for done in range(0, n_resamples, per_chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    arguments = ([values] * len(chunks), [starts] * len(chunks), [sizes] * len(chunks), seeds, chunks)
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            replicates = list(pool.map(_replicate_means, *arguments))
+    else:
+        replicates = list(map(_replicate_means, *arguments))
+    replicates = np.concatenate(replicates, axis = 1)
+
+    alpha = (1 - confidence) / 2
+    lower, upper = np.percentile(replicates, [100 * alpha, 100 * (1 - alpha)], axis = 1)
+    result = pd.DataFrame({
+        group_col: groups,
+        'Count': sizes,
+        'Estimate': np.add.reduceat(values, starts) / sizes,
+        'Lower': lower,
+        'Upper': upper,
+    })
+    logging.info(f'Bootstrap CIs of {value_col} for {len(groups)} {group_col} segments '
+                 f'({n_resamples} resamples in {len(chunks)} chunks) in {time.time() - start:.2f} seconds')
+    return result
+
+
+def segment_cis(conn, group_col = 'VendorName', value_col = 'ProfitMargin', table_name = 'final_summary_table',
+                where = CONSISTENT_ROWS, **kwargs):
+    """Bootstrap CIs for every segment of a summary table; only the two columns needed are read"""
+    df = pd.read_sql_query(f'SELECT {group_col}, {value_col} FROM {table_name} WHERE {where}', conn)
+    return bootstrap_ci(df, group_col, value_col, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Bootstrap confidence intervals for every vendor or brand')
+    parser.add_argument('--db', default = None, help = 'database path, by default the configured one')
+    parser.add_argument('--table', default = 'final_summary_table')
+    parser.add_argument('--by', default = 'VendorName', choices = ['VendorName', 'Description'])
+    parser.add_argument('--value', default = 'ProfitMargin')
+    parser.add_argument('--resamples', type = int, default = DEFAULT_RESAMPLES)
+    parser.add_argument('--workers', type = int, default = os.cpu_count() or 1)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    conn = reader_connection(args.db)
+    print(segment_cis(conn, args.by, args.value, args.table, n_resamples = args.resamples,
+                      workers = args.workers, seed = args.seed).to_string(index = False))
+    conn.close()
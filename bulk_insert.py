@@ -0,0 +1,152 @@
+import sqlite3
+import logging
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# Rows handed to a single executemany call
+DEFAULT_BATCH_SIZE = 50_000
+
+# Data version per table, bumped by every write that goes through this module
+VERSIONS_TABLE = 'table_versions'
+
+# Pragmas switched on while a table is loaded; the previous values are restored afterwards.
+# cache_size is negative, i.e. given in KiB (256 MiB here).
+LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+}
+
+
+@contextmanager
+def raw_sqlite_connection(con):
+    """Yields the raw sqlite3 connection behind a SQLAlchemy engine, or the sqlite3 connection itself"""
+    if isinstance(con, sqlite3.Connection):
+        yield con
+        return
+
+    raw = con.raw_connection()
+    try:
+        yield getattr(raw, 'driver_connection', None) or raw.connection
+    finally:
+        raw.close()
+
+
+@contextmanager
+def load_pragmas(conn, pragmas = LOAD_PRAGMAS):
+    """Switches on the load-time pragmas for the duration of the block and restores the previous values"""
+    if conn.in_transaction:
+        conn.commit()
+
+    previous = {name: conn.execute(f'PRAGMA {name}').fetchone()[0] for name in pragmas}
+    for name, value in pragmas.items():
+        # A WAL database keeps its journal mode, leaving it requires exclusive access
+        if name == 'journal_mode' and str(previous[name]).lower() == 'wal':
+            continue
+        conn.execute(f'PRAGMA {name} = {value}')
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        for name, value in previous.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+
+
+def quote(identifier):
+    """Quotes a table or column name for SQLite"""
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def sql_type(dtype):
+    """Maps a pandas dtype to the declared SQLite column type"""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def create_table_sql(table_name, column_types, if_not_exists = False):
+    """Builds an explicit CREATE TABLE statement from a {column: declared type} mapping"""
+    columns = ',\n    '.join(f'{quote(col)} {col_type}' for col, col_type in column_types.items())
+    exists = 'IF NOT EXISTS ' if if_not_exists else ''
+    return f'CREATE TABLE {exists}{quote(table_name)} (\n    {columns}\n)'
+
+
+def _column_values(series):
+    """Converts a column to a list of Python values that sqlite3 can bind, with None for missing values"""
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        # Dates without a time of day keep their compact ISO form
+        timestamps = series.dropna()
+        date_only = (timestamps == timestamps.dt.normalize()).all()
+        values = series.dt.strftime('%Y-%m-%d' if date_only else '%Y-%m-%d %H:%M:%S')
+    elif pd.api.types.is_bool_dtype(series.dtype):
+        values = series.astype('Int64')
+    else:
+        values = series
+    if values.hasnans:
+        values = values.astype(object).where(values.notna(), None)
+    return values.tolist()
+
+
+def table_exists(conn, table_name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone() is not None
+
+
+def bump_table_version(conn, table_name):
+    """Increments the data version of a table in the caller's transaction (read by query_cache.py)"""
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (name TEXT PRIMARY KEY, version INTEGER)')
+    conn.execute(f'INSERT INTO {VERSIONS_TABLE} VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET version = version + 1',
+                 (table_name,))
+
+
+def insert_rows(conn, df, table_name, batch_size = DEFAULT_BATCH_SIZE):
+    """Inserts the rows of a DataFrame with batched executemany inside the caller's transaction
+
+    The data version of the table is bumped in the same transaction, so cached query results
+    over it are invalidated when the rows are committed.
+    """
+    insert = (f'INSERT INTO {quote(table_name)} ({", ".join(quote(col) for col in df.columns)}) '
+              f'VALUES ({", ".join("?" for _ in df.columns)})')
+    for begin in range(0, len(df), batch_size):
+        batch = df.iloc[begin:begin + batch_size]
+        columns = [_column_values(batch[col]) for col in batch.columns]
+        conn.executemany(insert, zip(*columns))
+    bump_table_version(conn, table_name)
+
+
+def bulk_insert(df, table_name, con, if_exists = 'replace', batch_size = DEFAULT_BATCH_SIZE, column_types = None):
+    """Loads a DataFrame into a SQLite table in one transaction with batched executemany
+
+    con can be a SQLAlchemy engine or a sqlite3 connection. The table is created with declared
+    column types (derived from the dtypes unless column_types is given). if_exists follows
+    DataFrame.to_sql: 'replace', 'append' or 'fail'. Returns the number of rows written.
+    """
+    column_types = column_types or {col: sql_type(dtype) for col, dtype in df.dtypes.items()}
+
+    start = time.time()
+    with raw_sqlite_connection(con) as conn, load_pragmas(conn):
+        exists = table_exists(conn, table_name)
+        if exists and if_exists == 'fail':
+            raise ValueError(f"Table '{table_name}' already exists.")
+
+        conn.execute('BEGIN')
+        if exists and if_exists == 'replace':
+            conn.execute(f'DROP TABLE {quote(table_name)}')
+        conn.execute(create_table_sql(table_name, column_types, if_not_exists = True))
+
+        insert_rows(conn, df, table_name, batch_size)
+        conn.commit()
+
+    elapsed = time.time() - start
+    rate = len(df) / elapsed if elapsed > 0 else float('inf')
+    logging.debug(f'{table_name}: bulk loaded {len(df)} rows ({rate:,.0f} rows/sec)')
+    return len(df)
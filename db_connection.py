@@ -0,0 +1,181 @@
+import configparser
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+# Where the database path is configured: the environment variable wins over the config file
+DB_PATH_ENV = 'INVENTORY_DB'
+CONFIG_FILE = 'inventory.ini'
+DEFAULT_DB_PATH = 'inventory.db'
+
+# Idle read-only connections kept per database
+READER_POOL_SIZE = 8
+
+# Readers map the file (1 GiB) and keep a large page cache (256 MiB, negative cache_size is in
+# KiB), so repeated analysis queries are served from memory. query_only guards against writes.
+READER_PRAGMAS = {
+    'mmap_size': 2**30,
+    'cache_size': -262144,
+    'temp_store': 'MEMORY',
+    'query_only': 'ON',
+}
+
+# The writer runs in WAL mode, which lets the readers keep reading while it writes
+WRITER_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -262144,
+    'temp_store': 'MEMORY',
+}
+
+# Milliseconds a connection waits for a lock before giving up
+BUSY_TIMEOUT = 30_000
+
+_readers = {}
+_writers = {}
+_lock = threading.Lock()
+
+
+def database_path(path = None):
+    """The configured database path: path, else $INVENTORY_DB, else [database] path in inventory.ini, else inventory.db"""
+    if path:
+        return path
+    if os.environ.get(DB_PATH_ENV):
+        return os.environ[DB_PATH_ENV]
+    if os.path.exists(CONFIG_FILE):
+        config = configparser.ConfigParser()
+        config.read(CONFIG_FILE)
+        if config.has_option('database', 'path'):
+            return config.get('database', 'path')
+    return DEFAULT_DB_PATH
+
+
+def _apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def _is_open(conn):
+    try:
+        conn.total_changes
+        return True
+    except sqlite3.ProgrammingError:
+        return False
+
+
+def is_read_only(conn):
+    """Whether writes through conn are refused, as on the pooled readers"""
+    return bool(conn.execute('PRAGMA query_only').fetchone()[0])
+
+
+def open_reader(path = None):
+    """A new read-only connection with the analysis pragmas
+
+    check_same_thread is off so that pooled connections can move between threads; each one
+    is still used by a single thread at a time.
+    """
+    path = os.path.abspath(database_path(path))
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri = True, timeout = BUSY_TIMEOUT / 1000,
+                           check_same_thread = False)
+    return _apply_pragmas(conn, READER_PRAGMAS)
+
+
+class ReaderPool:
+    """Read-only connections to one database, reused instead of reopened"""
+
+    def __init__(self, path, size = READER_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if _is_open(conn):
+                    return conn
+        return open_reader(self.path)
+
+    def release(self, conn):
+        if not _is_open(conn):
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+def reader_pool(path = None):
+    path = database_path(path)
+    with _lock:
+        if path not in _readers:
+            _readers[path] = ReaderPool(path)
+        return _readers[path]
+
+
+@contextmanager
+def read_connection(path = None):
+    """Borrows a pooled read-only connection for the duration of the block"""
+    pool = reader_pool(path)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def reader_connection(path = None):
+    """A read-only connection from the pool for a whole script run; closing it is allowed"""
+    return reader_pool(path).acquire()
+
+
+def writer_connection(path = None):
+    """The single WAL-mode writer connection of a database, opened on first use
+
+    Every caller in the process gets the same connection, so writes are serialized through it.
+    A writer closed by its caller is reopened on the next call.
+    """
+    path = database_path(path)
+    with _lock:
+        conn = _writers.get(path)
+        if conn is None or not _is_open(conn):
+            conn = sqlite3.connect(path, timeout = BUSY_TIMEOUT / 1000, check_same_thread = False)
+            _apply_pragmas(conn, WRITER_PRAGMAS)
+            logging.info(f'Opened the writer connection to {path}')
+            _writers[path] = conn
+        return conn
+
+
+def writer_engine(path = None):
+    """A SQLAlchemy engine whose only connection is the writer connection"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+
+    path = database_path(path)
+    return create_engine('sqlite://', creator = lambda: writer_connection(path), poolclass = StaticPool)
+
+
+def close_all():
+    """Closes the writers and the idle readers of every database"""
+    with _lock:
+        writers, pools = list(_writers.values()), list(_readers.values())
+        _writers.clear()
+        _readers.clear()
+    for conn in writers:
+        conn.close()
+    for pool in pools:
+        pool.close()
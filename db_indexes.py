@@ -0,0 +1,55 @@
+import logging
+
+from db_connection import writer_connection
+
+
+# Covering composite indexes for the join and group keys of the vendor summary query.
+# Each one leads with the key columns and carries the aggregated columns, so the
+# aggregations read the index alone instead of scanning the table.
+SUMMARY_INDEXES = {
+    'idx_purchases_vendor_brand': ('purchases', ['VendorNumber', 'VendorName', 'Brand', 'Description',
+                                                 'PurchasePrice', 'Quantity', 'Dollars']),
+    'idx_purchase_prices_vendor_brand': ('purchase_prices', ['VendorNumber', 'Brand', 'Price', 'Volume']),
+    'idx_sales_vendor_brand': ('sales', ['VendorNo', 'Brand', 'SalesQuantity', 'SalesDollars',
+                                         'SalesPrice', 'ExciseTax']),
+    'idx_vendor_invoice_vendor': ('vendor_invoice', ['VendorNumber', 'Freight']),
+}
+
+# Rows per index that ANALYZE samples, which keeps it cheap on the large tables
+ANALYSIS_LIMIT = 1000
+
+
+def build_indexes(conn, indexes = SUMMARY_INDEXES):
+    """Creates the missing indexes and refreshes the planner statistics with ANALYZE"""
+    for name, (table, columns) in indexes.items():
+        column_list = ', '.join(f'"{col}"' for col in columns)
+        logging.info(f'Creating index {name} on {table}')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({column_list})')
+    conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    conn.execute('ANALYZE')
+    conn.commit()
+
+
+def query_plan(conn, query):
+    """Returns the EXPLAIN QUERY PLAN details of a query"""
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query)]
+
+
+def check_query_plan(conn, query, indexes = SUMMARY_INDEXES):
+    """Checks that a query uses the given indexes; returns the names of the ones it does not use"""
+    plan = query_plan(conn, query)
+    unused = [name for name in indexes if not any(name in step for step in plan)]
+    for step in plan:
+        logging.debug(f'Query plan: {step}')
+    if unused:
+        logging.warning(f'Query does not use the indexes: {", ".join(unused)}')
+    return unused
+
+
+if __name__ == "__main__":
+    from get_summary_table import VENDOR_SUMMARY_QUERY
+
+    conn = writer_connection()
+    build_indexes(conn)
+    check_query_plan(conn, VENDOR_SUMMARY_QUERY)
+    conn.close()
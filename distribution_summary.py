@@ -0,0 +1,222 @@
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from bulk_insert import create_table_sql, insert_rows, raw_sqlite_connection, sql_type, table_exists
+from db_connection import is_read_only, writer_connection
+from query_cache import cached_read_sql, table_version
+
+SUMMARY_TABLE = 'distribution_summary'
+
+DEFAULT_BINS = 30
+
+# Fewest points the KDE is stored at
+KDE_GRID = 512
+
+# The stored KDE has this many points per bandwidth (so linear interpolation between them stays
+# within about half a percent of the curve), up to KDE_MAX_POINTS
+KDE_POINTS_PER_BANDWIDTH = 5
+KDE_MAX_POINTS = 16384
+
+# Largest binning grid of the KDE; the grid is refined until a bandwidth spans KDE_BINS_PER_BANDWIDTH steps
+KDE_MAX_GRID = 2 ** 16
+KDE_BINS_PER_BANDWIDTH = 8
+
+# The KDE extends this many bandwidths past the data, like seaborn's cut = 3
+KDE_CUT = 3
+
+# Outliers kept per column for drawing; the count covers all of them
+MAX_FLIERS = 1000
+
+# Size of the float64 block of columns summarized at a time. The temporaries of a block are the
+# same size, so peak memory is a small multiple of this rather than of the whole table
+SUMMARY_BLOCK_BYTES = 64 * 2**20
+
+
+def _bin_counts(X, low, high, bins):
+    """Histogram counts of every column of X at once: (columns, bins) counts over [low, high] per column"""
+    columns = X.shape[1]
+    width = np.where(high > low, (high - low) / bins, 1.0)
+    # One scratch matrix the size of X, updated in place
+    index = X - low
+    index /= width
+    np.floor(index, out = index)
+    finite = np.isfinite(index)
+    np.clip(index, 0, bins - 1, out = index)
+    index += np.arange(columns) * bins
+    return np.bincount(index[finite].astype('int64'), minlength = columns * bins).reshape(columns, bins)
+
+
+def fft_kde(X, count, std, low, high, grid = KDE_GRID, cut = KDE_CUT):
+    """Gaussian KDE of every column of X, binned onto a fine grid and convolved with the kernel by FFT
+
+    The bandwidth follows Scott's rule (std * n ** -1/5), as scipy's gaussian_kde and seaborn
+    do. Costs O(n + grid log grid) per column instead of O(n * grid). Returns the points and
+    the densities there, one array per column with at least grid points and
+    KDE_POINTS_PER_BANDWIDTH per bandwidth; columns without spread get NaN densities.
+    """
+    bandwidth = std * np.where(count > 0, count, 1) ** -0.2
+    grid_low = low - cut * bandwidth
+    grid_high = high + cut * bandwidth
+    span = grid_high - grid_low
+    # Long-tailed columns need a fine grid for the binning error to stay well below the bandwidth
+    with np.errstate(all = 'ignore'):
+        needed = np.nanmax(np.where(bandwidth > 0, KDE_BINS_PER_BANDWIDTH * span / bandwidth, 0), initial = grid)
+    fine = int(min(KDE_MAX_GRID, 2 ** int(np.ceil(np.log2(max(needed, grid))))))
+
+    counts = _bin_counts(X, grid_low, grid_high, fine).astype('float64')
+    step = np.where(span > 0, span / fine, 1.0)
+    centers = grid_low[:, None] + (np.arange(fine) + 0.5) * step[:, None]
+
+    # Kernel on the grid offsets, zero-padded to 2 * fine so the convolution does not wrap around
+    offsets = np.concatenate([np.arange(fine), np.arange(-fine, 0)]) * step[:, None]
+    sigma = np.where(bandwidth > 0, bandwidth, 1.0)[:, None]
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))
+    padded = np.concatenate([counts, np.zeros_like(counts)], axis = 1)
+    smoothed = np.fft.irfft(np.fft.rfft(padded, axis = 1) * np.fft.rfft(kernel, axis = 1), n = 2 * fine, axis = 1)[:, :fine]
+    smoothed = np.clip(smoothed, 0, None) / np.where(count > 0, count, 1)[:, None]
+
+    # Long-tailed columns span many bandwidths; a fixed number of points would be too coarse near the mode
+    with np.errstate(all = 'ignore'):
+        points = np.where(bandwidth > 0, np.ceil(KDE_POINTS_PER_BANDWIDTH * span / bandwidth) + 1, grid)
+    points = np.clip(np.nan_to_num(points, nan = grid), grid, KDE_MAX_POINTS).astype('int64')
+    xs, densities = [], []
+    for j in range(len(span)):
+        x = grid_low[j] + np.linspace(0, 1, points[j]) * span[j]
+        if bandwidth[j] > 0 and count[j] >= 2:
+            densities.append(np.interp(x, centers[j], smoothed[j]))
+        else:
+            densities.append(np.full(len(x), np.nan))
+        xs.append(x)
+    return xs, densities
+
+
+def summarize_columns(df, bins = DEFAULT_BINS, grid = KDE_GRID, block_bytes = SUMMARY_BLOCK_BYTES):
+    """Bin counts, five-number summaries, outlier counts and the KDE of every numeric column, vectorized
+
+    The columns are copied and summarized a block of about block_bytes at a time (at least one
+    column). Infinite values are left out, as NaNs are. Returns one row per column.
+    """
+    columns = list(df.select_dtypes(include = np.number).columns)
+    width = max(1, int(block_bytes // max(8 * len(df), 1)))
+    rows = []
+    for begin in range(0, len(columns), width):
+        rows.extend(_summarize_block(df, columns[begin:begin + width], bins, grid))
+    return pd.DataFrame(rows)
+
+
+def _summarize_block(df, columns, bins, grid):
+    """The summary rows of a block of columns, computed on one (rows, columns) float64 matrix"""
+    X = df[columns].to_numpy(dtype = 'float64', na_value = np.nan, copy = True)
+    X[~np.isfinite(X)] = np.nan
+
+    count = np.sum(~np.isnan(X), axis = 0)
+    with np.errstate(all = 'ignore'):
+        mean = np.nanmean(X, axis = 0)
+        std = np.nanstd(X, axis = 0, ddof = 1)
+        low, q1, median, q3, high = np.nanpercentile(X, [0, 25, 50, 75, 100], axis = 0)
+    std = np.nan_to_num(std)
+    iqr = q3 - q1
+    # Whiskers reach the most extreme values within 1.5 IQR of the box, as in matplotlib
+    inside = (X >= q1 - 1.5 * iqr) & (X <= q3 + 1.5 * iqr)
+    whisker_low = np.min(X, axis = 0, where = inside, initial = np.inf)
+    whisker_high = np.max(X, axis = 0, where = inside, initial = -np.inf)
+    outside = ~np.isnan(X) & ~inside
+    del inside
+    outliers = outside.sum(axis = 0)
+
+    # A constant column gets a unit-wide range around its value, as np.histogram does
+    edge_low = np.where(high > low, low, low - 0.5)
+    edge_high = np.where(high > low, high, high + 0.5)
+    counts = _bin_counts(X, edge_low, edge_high, bins)
+    kde_x, kde_density = fft_kde(X, count, std, low, high, grid)
+
+    rows = []
+    for j, col in enumerate(columns):
+        fliers = X[outside[:, j], j]
+        if len(fliers) > MAX_FLIERS:
+            fliers = np.sort(fliers)[np.linspace(0, len(fliers) - 1, MAX_FLIERS).astype('int64')]
+        rows.append({
+            'ColumnName': col, 'Count': int(count[j]), 'Mean': mean[j], 'Std': std[j],
+            'Min': low[j], 'Q1': q1[j], 'Median': median[j], 'Q3': q3[j], 'Max': high[j],
+            'WhiskerLow': whisker_low[j], 'WhiskerHigh': whisker_high[j], 'OutlierCount': int(outliers[j]),
+            'BinEdges': json.dumps(np.linspace(edge_low[j], edge_high[j], bins + 1).tolist()),
+            'BinCounts': json.dumps(counts[j].tolist()),
+            'KdeX': json.dumps(kde_x[j].tolist()),
+            'KdeDensity': json.dumps(kde_density[j].tolist()),
+            'Fliers': json.dumps(fliers.tolist()),
+        })
+    return rows
+
+
+def build_distribution_summary(conn, source = 'vendor_summary', bins = DEFAULT_BINS):
+    """Summarizes the numeric columns of a table and stores the result next to it
+
+    Only the rows of this source are replaced, in one transaction; the summaries of other tables stay.
+    """
+    start = time.time()
+    summary = summarize_columns(cached_read_sql(f'SELECT * FROM {source}', conn), bins)
+    summary.insert(0, 'Source', source)
+    summary['SourceVersion'] = table_version(conn, source)
+    with raw_sqlite_connection(conn) as raw:
+        if raw.in_transaction:
+            raw.commit()
+        raw.execute('BEGIN')
+        try:
+            raw.execute(create_table_sql(SUMMARY_TABLE, {col: sql_type(dtype) for col, dtype in summary.dtypes.items()},
+                                         if_not_exists = True))
+            raw.execute(f'DELETE FROM {SUMMARY_TABLE} WHERE Source = ?', (source,))
+            insert_rows(raw, summary, SUMMARY_TABLE)
+            raw.commit()
+        except BaseException:
+            raw.rollback()
+            raise
+    logging.info(f'Distribution summary of {source} built in {time.time() - start:.2f} seconds')
+    return summary
+
+
+def load_distribution_summary(conn, source = 'vendor_summary', bins = DEFAULT_BINS):
+    """The stored distribution summary of a table, rebuilt first if the table changed since
+
+    Returns {column: summary} where summary holds the histogram ('counts', 'edges'), the
+    KDE ('kde_x', 'kde_density', None when the column has no spread) and the box statistics
+    in the form matplotlib's Axes.bxp takes. On a read-only connection (a pooled reader) a missing
+    or stale summary raises a RuntimeError instead, since only the writer can rebuild it.
+    """
+    stored = None
+    if table_exists(conn, SUMMARY_TABLE):
+        stored = pd.read_sql_query(f'SELECT * FROM {SUMMARY_TABLE} WHERE Source = ?', conn, params = (source,))
+        current = table_version(conn, source)
+        if stored.empty or (stored['SourceVersion'] != current).any() or \
+                len(json.loads(stored['BinCounts'].iloc[0])) != bins:
+            stored = None
+    if stored is None:
+        if is_read_only(conn):
+            raise RuntimeError(f'The distribution summary of {source} is missing or out of date and this connection '
+                               f'is read-only; build it with: python distribution_summary.py --source {source}')
+        stored = build_distribution_summary(conn, source, bins)
+
+    summaries = {}
+    for row in stored.itertuples(index = False):
+        density = np.array(json.loads(row.KdeDensity))
+        summaries[row.ColumnName] = {
+            'n': row.Count, 'mean': row.Mean, 'std': row.Std, 'outliers': row.OutlierCount,
+            'counts': np.array(json.loads(row.BinCounts)), 'edges': np.array(json.loads(row.BinEdges)),
+            'kde_x': np.array(json.loads(row.KdeX)), 'kde_density': None if np.isnan(density).any() else density,
+            'box': {'label': row.ColumnName, 'mean': row.Mean, 'med': row.Median, 'q1': row.Q1, 'q3': row.Q3,
+                    'whislo': row.WhiskerLow, 'whishi': row.WhiskerHigh, 'fliers': np.array(json.loads(row.Fliers))},
+        }
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Stores the distribution summary of a table')
+    parser.add_argument('--source', default = 'vendor_summary')
+    args = parser.parse_args()
+    conn = writer_connection()
+    build_distribution_summary(conn, args.source)
+    conn.close()
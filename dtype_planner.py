@@ -0,0 +1,137 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+# Rows sampled from each csv to build its plan
+DEFAULT_SAMPLE_ROWS = 100_000
+
+# A string column becomes a categorical when at most this share of its sampled values is distinct
+CATEGORY_RATIO = 0.5
+
+# Integer types are picked so that this multiple of the sampled range still fits
+INT_HEADROOM = 4
+
+INT_TYPES = ['int8', 'int16', 'int32', 'int64']
+
+
+def narrowest_int(low, high, nullable = False):
+    """Returns the narrowest integer dtype that holds [low, high]"""
+    for name in INT_TYPES:
+        info = np.iinfo(name)
+        if info.min <= low and high <= info.max:
+            return name.capitalize() if nullable else name
+    return 'Int64' if nullable else 'int64'
+
+
+def _is_date_column(values):
+    """Checks whether every sampled value of a string column parses as a date"""
+    values = values.dropna()
+    if values.empty or pd.api.types.is_numeric_dtype(values):
+        return False
+    parsed = pd.to_datetime(values, format = 'ISO8601', errors = 'coerce')
+    return bool(parsed.notna().all())
+
+
+def plan_dtypes(path, sample_rows = DEFAULT_SAMPLE_ROWS, category_ratio = CATEGORY_RATIO):
+    """Samples a csv once and plans a compact dtype for every column
+
+    Returns {column: kind} where kind is a numpy/pandas dtype name, 'category' or 'date'.
+    Integers get the narrowest type that holds INT_HEADROOM times the sampled range (nullable
+    when the sample has gaps), low-cardinality strings become categoricals and ISO date strings
+    are parsed as dates. Floats stay float64: the dollar columns lose cents in float32.
+    """
+    sample = pd.read_csv(path, nrows = sample_rows)
+    plan = {}
+    for col in sample.columns:
+        values = sample[col]
+        if pd.api.types.is_bool_dtype(values):
+            plan[col] = 'bool'
+        elif pd.api.types.is_integer_dtype(values) or (
+                pd.api.types.is_float_dtype(values) and values.notna().any()
+                and (values.dropna() % 1 == 0).all()):
+            nonnull = values.dropna()
+            low, high = (nonnull.min(), nonnull.max()) if len(nonnull) else (0, 0)
+            plan[col] = narrowest_int(min(low * INT_HEADROOM, low), max(high * INT_HEADROOM, high),
+                                      nullable = values.hasnans)
+        elif pd.api.types.is_float_dtype(values):
+            plan[col] = 'float64'
+        elif _is_date_column(values):
+            plan[col] = 'date'
+        elif values.nunique() <= category_ratio * max(len(values), 1):
+            plan[col] = 'category'
+        else:
+            plan[col] = 'object'
+    logging.debug(f'dtype plan for {path}: {plan}')
+    return plan
+
+
+def read_csv_kwargs(plan):
+    """Translates a plan into read_csv arguments
+
+    read_csv silently wraps integers that overflow a narrow dtype, so integer columns are parsed
+    at full width here and narrowed afterwards by apply_plan, which checks the bounds.
+    """
+    dtype = {}
+    for col, kind in plan.items():
+        if kind in ('category', 'object', 'float64'):
+            dtype[col] = kind
+        elif kind == 'bool':
+            dtype[col] = 'boolean'
+    return {
+        'dtype': dtype,
+        'parse_dates': [col for col, kind in plan.items() if kind == 'date'],
+        'date_format': 'ISO8601',
+    }
+
+
+def apply_plan(df, plan):
+    """Narrows the integer columns of a parsed frame to their planned types
+
+    A chunk that does not fit the plan (a value outside the sampled range plus headroom) gets the
+    narrowest type that holds it instead, so values are never wrapped.
+    """
+    for col, kind in plan.items():
+        if col not in df.columns or kind.lower() not in INT_TYPES:
+            continue
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values):
+            continue
+        if pd.api.types.is_float_dtype(values) and not (values.dropna() % 1 == 0).all():
+            logging.warning(f'{col}: non-integral values, kept as float64 instead of {kind}')
+            continue
+        nullable = kind[0] == 'I' or values.hasnans
+        nonnull = values.dropna()
+        target = kind.capitalize() if nullable else kind
+        if len(nonnull):
+            low, high = nonnull.min(), nonnull.max()
+            info = np.iinfo(kind.lower())
+            if low < info.min or high > info.max:
+                target = narrowest_int(low, high, nullable = nullable)
+                logging.warning(f'{col}: values outside the planned {kind}, widened to {target}')
+        df[col] = values.astype(target)
+    return df
+
+
+def read_planned_csv(path, plan, **kwargs):
+    """read_csv with a dtype plan applied; with chunksize set this yields planned chunks"""
+    reader = pd.read_csv(path, **read_csv_kwargs(plan), **kwargs)
+    if 'chunksize' in kwargs:
+        return (apply_plan(chunk, plan) for chunk in reader)
+    return apply_plan(reader, plan)
+
+
+def column_types(plan):
+    """Declared SQLite column types for a plan, used for the explicit CREATE TABLE"""
+    types = {}
+    for col, kind in plan.items():
+        if kind.lower() in INT_TYPES or kind == 'bool':
+            types[col] = 'INTEGER'
+        elif kind == 'float64':
+            types[col] = 'REAL'
+        elif kind == 'date':
+            types[col] = 'DATE'
+        else:
+            types[col] = 'TEXT'
+    return types
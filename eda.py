@@ -1,39 +1,55 @@
 import pandas as pd
-import sqlite3
-
-# Database connection
-conn = sqlite3.connect('inventory.db')
-conn = sqlite3.connect('D:/Python-DataAnalysis/inventory.db')
-conn.execute("PRAGMA temp_store = MEMORY;")  # Use RAM instead of disk for temp storage
+from db_connection import writer_connection
+from query_cache import cached_read_sql
+from instrumentation import measure
+from bulk_insert import bump_table_version
+from distribution_summary import load_distribution_summary
+from rollups import ensure_rollups
+from table_profiler import profile_tables
+from vendor_drilldown import VendorDrilldown
+
+# Database connection; this script also writes final_summary_table, so it uses the writer
+conn = writer_connection()
 
 tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table'", conn)
 print("Tables in the database:")
 print(tables)
 
+# One scan per table for counts, nulls, ranges and distinct counts, reused while the table is unchanged
+profile = profile_tables(conn)
+
 for table in tables['name']:
   print('-'*50 , f'{table}', '-'*50)
-  print('Count of records: ', pd.read_sql(f"select count(*) as count from {table}", conn)['count'].values[0])
+  table_profile = profile[profile['TableName'] == table]
+  if table_profile.empty:
+    continue
+  print('Count of records: ', table_profile['RowCount'].iloc[0])
+  print(table_profile[['ColumnName', 'NullCount', 'MinValue', 'MaxValue', 'MeanValue', 'DistinctCount']].to_string(index = False))
   print(pd.read_sql(f"select * from {table} limit 5", conn))
 
 
-purchases = pd.read_sql("select * from purchases where VendorNumber = 4466", conn)
+# Indexed lookups of the vendor's rows in all four tables; pass more vendor numbers to bundles() to drill into a batch
+drilldown = VendorDrilldown(conn)
+vendor = drilldown.bundle(4466)
+
+purchases = vendor['purchases']
 print(purchases)
 
-purchase_prices = pd.read_sql("select * from purchase_prices where VendorNumber = 4466", conn)
+purchase_prices = vendor['purchase_prices']
 print(purchase_prices)
 
-vendor_invoice = pd.read_sql("select * from vendor_invoice where VendorNumber = 4466", conn)
+vendor_invoice = vendor['vendor_invoice']
 print(vendor_invoice)
 
-sales = pd.read_sql("select * from sales where VendorNo = 4466", conn)
+sales = vendor['sales']
 print(sales)
 
 
-print(purchases.groupby(['Brand' , 'PurchasePrice'])[['Quantity', 'Dollars']].sum())
+print(vendor['purchases_by_brand_price'])
 
-print(vendor_invoice['PONumber'].nunique())
+print(vendor['po_count'])
 
-print(sales.groupby(['Brand'])[['SalesPrice', 'SalesDollars', 'SalesQuantity']].sum())
+print(vendor['sales_by_brand'])
 
 
 '''
@@ -62,11 +78,11 @@ Freight costs for each vendor
 Actual product prices from vendors
 '''
 
-freight_summary = pd.read_sql(""" select VendorNumber, SUM(Freight) as TotalFreight FROM vendor_invoice GROUP BY VendorNumber """, conn )
+freight_summary = cached_read_sql(""" select VendorNumber, SUM(Freight) as TotalFreight FROM vendor_invoice GROUP BY VendorNumber """, conn )
 print(freight_summary)
 
 
-summary_table_1 = pd.read_sql_query("""
+summary_table_1 = cached_read_sql("""
     SELECT 
         p.VendorNumber, 
         p.VendorName, 
@@ -93,7 +109,7 @@ summary_table_1 = pd.read_sql_query("""
 print(summary_table_1)
 
 
-summary_table_2 = pd.read_sql_query("""
+summary_table_2 = cached_read_sql("""
     SELECT 
       VendorNo,
       Brand,
@@ -110,9 +126,7 @@ print(summary_table_2)
 
 
 
-import time
-start = time.time()
-final_summary_table = pd.read_sql_query("""
+final_summary_query = """
 WITH FreightSummary AS (
     SELECT
         VendorNumber,
@@ -174,11 +188,14 @@ LEFT JOIN FreightSummary fs
     ON ps.VendorNumber = fs.VendorNumber
 ORDER BY ps.TotalPurchaseDollars DESC
 
-""", conn)
-end = time.time()
+"""
+# Timed through the instrumentation layer, which also logs the record to logs/metrics.jsonl
+with measure('query', 'final_summary_table', conn) as record:
+  final_summary_table = cached_read_sql(final_summary_query, conn)
+  record['rows_out'] = len(final_summary_table)
 
 print(final_summary_table)
-print(f"Time taken to execute the final summary table query: {end - start} seconds")
+print(f"Time taken to execute the final summary table query: {record['wall_seconds']} seconds")
 
 
 
@@ -262,6 +279,14 @@ cursor.execute(""" CREATE TABLE final_summary_table (
 
 # Insert the final summary table into the new table
 final_summary_table.to_sql('final_summary_table', conn, if_exists='replace', index=False)
+bump_table_version(conn, 'final_summary_table')
+conn.commit()
+
+# Vendor and brand rollups of the final summary table, for the ranking questions of visualanalysis.py
+ensure_rollups(conn, 'final_summary_table')
+
+# Histograms, KDEs and box statistics of the final summary table, which visualanalysis.py draws from
+load_distribution_summary(conn, 'final_summary_table')
 
 # Print the final summary table
 print("Final summary table created and data inserted successfully.")
@@ -1,10 +1,15 @@
 import pandas as pd
+import numpy as np
 import os
-from sqlalchemy import create_engine
 import logging
 import time
 from ingestion_DB import ingest_db
-import sqlite3
+from db_indexes import build_indexes, check_query_plan
+import argparse
+from bulk_insert import create_table_sql, insert_rows, load_pragmas
+from rollups import build_rollups
+from db_connection import writer_connection
+from instrumentation import measure
 
 logging.basicConfig(
    filename="logs/ingestion_db.log",
@@ -13,14 +18,20 @@ logging.basicConfig(
    filemode = "a"
 )
 
-def create_vendor_summary(conn):
-  """this function merges different tables to create a summary table of vendor information"""
-  final_summary_table = pd.read_sql_query("""
+# Order of the summary rows. The columns after TotalPurchaseDollars only break ties, which
+# keeps the row order deterministic (and the partitioned path in parallel_summary identical).
+SUMMARY_ORDER_BY = """{prefix}TotalPurchaseDollars DESC, {prefix}VendorNumber, {prefix}Brand, {prefix}VendorName,
+      {prefix}Description, {prefix}PurchasePrice, {prefix}ActualPrice, {prefix}Volume"""
+
+# Query behind the vendor summary table. The filter slots restrict each aggregation to a
+# subset of vendors; they are empty for the full table.
+VENDOR_SUMMARY_TEMPLATE = """
   WITH FreightSummary AS (
       SELECT
           VendorNumber,
           SUM(Freight) AS FreightCost
       FROM vendor_invoice
+      {freight_filter}
       GROUP BY VendorNumber
   ),
 
@@ -39,6 +50,7 @@ def create_vendor_summary(conn):
       JOIN purchase_prices pp
           ON p.VendorNumber = pp.VendorNumber
           AND p.Brand = pp.Brand
+      {purchase_filter}
       GROUP BY p.VendorNumber, p.VendorName, p.Brand, p.Description, p.PurchasePrice, pp.Price, pp.Volume
   ),
 
@@ -51,6 +63,7 @@ def create_vendor_summary(conn):
           SUM(SalesPrice) AS TotalSalesPrice,
           SUM(ExciseTax) AS TotalExciseTax
       FROM sales
+      {sales_filter}
       GROUP BY VendorNo, Brand
   )
 
@@ -75,9 +88,18 @@ def create_vendor_summary(conn):
       AND ps.Brand = ss.Brand
   LEFT JOIN FreightSummary fs
       ON ps.VendorNumber = fs.VendorNumber
-  ORDER BY ps.TotalPurchaseDollars DESC
+  ORDER BY {order_by}
 
-  """, conn)
+  """
+
+VENDOR_SUMMARY_QUERY = VENDOR_SUMMARY_TEMPLATE.format(
+    freight_filter = '', purchase_filter = '', sales_filter = '', order_by = SUMMARY_ORDER_BY.format(prefix = 'ps.'))
+
+def create_vendor_summary(conn):
+  """this function merges different tables to create a summary table of vendor information"""
+  with measure('query', 'vendor_summary', conn) as record:
+    final_summary_table = pd.read_sql_query(VENDOR_SUMMARY_QUERY, conn)
+    record['rows_out'] = len(final_summary_table)
   return final_summary_table
 
 def clean_data(df):
@@ -104,25 +126,214 @@ def clean_data(df):
 
     return df
 
+
+ZERO_DIVISION_POLICIES = ('nan', 'zero', 'flag')
+
+# Measures of the summary query that are cast to float64, with NULLs (in practice the sales and
+# freight columns of the LEFT JOINs) filled with 0
+SUMMARY_NUMERIC_COLUMNS = ['PurchasePrice', 'ActualPrice', 'Volume', 'TotalPurchaseQuantity', 'TotalPurchaseDollars',
+                           'TotalSalesQuantity', 'TotalSalesDollars', 'TotalSalesPrice', 'TotalExciseTax', 'FreightCost']
+
+
+def _safe_divide(numerator, denominator, out, zero_division):
+    """Divides into a preallocated array, writing NaN or 0 where the denominator is 0; returns the zero mask"""
+    zero = denominator == 0
+    np.divide(numerator, denominator, out = out, where = ~zero)
+    out[zero] = np.nan if zero_division == 'nan' else 0.0
+    return zero
+
+
+def _to_float64(values):
+    """Casts a column to float64; arrow-backed strings are parsed by arrow, which is several times faster"""
+    try:
+        if isinstance(values.dtype, pd.StringDtype) and values.dtype.storage == 'pyarrow':
+            return values.astype('float64[pyarrow]').astype('float64')
+        return values.astype('float64')
+    except (ValueError, TypeError):
+        # Non-numeric volumes such as 'Unknown' become NaN instead of failing the whole run
+        return pd.to_numeric(values, errors = 'coerce').astype('float64')
+
+
+def clean_data_vectorized(df, zero_division = 'nan'):
+    """This function cleans the summary data and derives the KPIs in one vectorized pass
+
+    The measure columns are cast to float64 and their NULLs filled with 0, and the four KPIs are
+    computed into preallocated float64 arrays. A zero denominator never yields inf: depending on
+    zero_division the KPI is NaN ('nan'), 0 ('zero'), or 0 with the boolean KPIUndefined column
+    set for that row ('flag'). The function only looks at one row at a time, so it can be applied
+    to chunks of the summary as well as to the whole frame.
+    """
+    if zero_division not in ZERO_DIVISION_POLICIES:
+        raise ValueError(f'zero_division must be one of {ZERO_DIVISION_POLICIES}')
+
+    # The columns are cast by name rather than by inferred dtype: a column that is NULL in every
+    # row of a chunk comes back as object dtype, and would otherwise keep its NULLs
+    for col in SUMMARY_NUMERIC_COLUMNS:
+        values = _to_float64(df[col])
+        df[col] = values.fillna(0) if values.hasnans else values
+
+    for col in ['VendorName', 'Description']:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.rename_categories(df[col].cat.categories.str.strip())
+        else:
+            df[col] = df[col].str.strip()
+
+    sales_dollars = df['TotalSalesDollars'].to_numpy(dtype = 'float64')
+    purchase_dollars = df['TotalPurchaseDollars'].to_numpy(dtype = 'float64')
+    sales_quantity = df['TotalSalesQuantity'].to_numpy(dtype = 'float64')
+    purchase_quantity = df['TotalPurchaseQuantity'].to_numpy(dtype = 'float64')
+
+    n = len(df)
+    gross_profit = np.empty(n)
+    profit_margin = np.empty(n)
+    stock_turnover = np.empty(n)
+    sales_to_purchase = np.empty(n)
+
+    np.subtract(sales_dollars, purchase_dollars, out = gross_profit)
+    undefined = _safe_divide(gross_profit, sales_dollars, profit_margin, zero_division)
+    np.multiply(profit_margin, 100, out = profit_margin)
+    undefined |= _safe_divide(sales_quantity, purchase_quantity, stock_turnover, zero_division)
+    undefined |= _safe_divide(sales_dollars, purchase_dollars, sales_to_purchase, zero_division)
+
+    df['GrossProfit'] = gross_profit
+    df['ProfitMargin'] = profit_margin
+    df['StockTurnover'] = stock_turnover
+    df['SalesToPurchaseRatio'] = sales_to_purchase
+    if zero_division == 'flag':
+        df['KPIUndefined'] = undefined
+
+    return df
+
+
+def clean_data_chunks(chunks, zero_division = 'nan'):
+    """Generator that cleans and derives the KPIs for an iterable of summary chunks"""
+    for chunk in chunks:
+        yield clean_data_vectorized(chunk, zero_division)
+
+
+# Declared column types of vendor_summary. They are fixed rather than inferred from the data, so
+# a chunk without NULLs (int64) and one with NULLs (float64) are stored the same way and the
+# streaming and batch paths write identical tables.
+SUMMARY_COLUMN_TYPES = {
+    'VendorNumber': 'INTEGER', 'VendorName': 'TEXT', 'Brand': 'INTEGER', 'Description': 'TEXT',
+    'PurchasePrice': 'REAL', 'ActualPrice': 'REAL', 'Volume': 'REAL',
+    'TotalPurchaseQuantity': 'INTEGER', 'TotalPurchaseDollars': 'REAL',
+    'TotalSalesQuantity': 'REAL', 'TotalSalesDollars': 'REAL', 'TotalSalesPrice': 'REAL',
+    'TotalExciseTax': 'REAL', 'FreightCost': 'REAL',
+    'GrossProfit': 'REAL', 'ProfitMargin': 'REAL', 'StockTurnover': 'REAL', 'SalesToPurchaseRatio': 'REAL',
+    'KPIUndefined': 'INTEGER',
+}
+
+DEFAULT_SUMMARY_CHUNKSIZE = 50_000
+
+
+def summary_column_types(columns):
+    return {col: SUMMARY_COLUMN_TYPES.get(col, 'TEXT') for col in columns}
+
+
+def iter_cursor(cursor, chunksize = DEFAULT_SUMMARY_CHUNKSIZE):
+    """Generator that yields the rows of an executed cursor in DataFrame chunks"""
+    columns = [col[0] for col in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        yield pd.DataFrame.from_records(rows, columns = columns)
+
+
+def build_vendor_summary_streaming(conn, table_name = 'vendor_summary', chunksize = DEFAULT_SUMMARY_CHUNKSIZE,
+                                   zero_division = 'nan'):
+    """This function builds the vendor summary table chunk by chunk
+
+    The summary query is read through a cursor, every chunk goes through cleaning and KPI
+    derivation and is written right away, all in one transaction. Only one chunk is held in
+    memory at a time, and the table is the same as the one the batch path writes.
+    """
+    start = time.time()
+    rows = 0
+    with load_pragmas(conn):
+        # The table is replaced before the query starts; SQLite cannot drop a table while a
+        # read on the same connection is still pending
+        conn.execute('BEGIN')
+        conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        cursor = conn.execute(VENDOR_SUMMARY_QUERY)
+        # The output columns are known before the first row is read
+        empty = pd.DataFrame(columns = [col[0] for col in cursor.description])
+        columns = clean_data_vectorized(empty, zero_division).columns
+        conn.execute(create_table_sql(table_name, summary_column_types(columns)))
+        for chunk in clean_data_chunks(iter_cursor(cursor, chunksize), zero_division):
+            insert_rows(conn, chunk, table_name)
+            rows += len(chunk)
+        conn.commit()
+
+    logging.info(f'{table_name}: {rows} rows streamed in {time.time() - start:.2f} seconds')
+    return rows
+
+
+def check_streaming_summary(conn, table_name = 'vendor_summary', chunksize = DEFAULT_SUMMARY_CHUNKSIZE,
+                            zero_division = 'nan'):
+    """Builds the summary table both ways and raises AssertionError where the streamed table differs from the batch one"""
+    batch_table = f'{table_name}_batch'
+    batch = clean_data_vectorized(create_vendor_summary(conn), zero_division)
+    ingest_db(batch, batch_table, conn, column_types = summary_column_types(batch.columns))
+    build_vendor_summary_streaming(conn, table_name, chunksize, zero_division)
+    try:
+        streamed = pd.read_sql_query(f'SELECT * FROM "{table_name}" ORDER BY rowid', conn)
+        expected = pd.read_sql_query(f'SELECT * FROM "{batch_table}" ORDER BY rowid', conn)
+        if not streamed.equals(expected):
+            differing = int((streamed.ne(expected) & ~(streamed.isna() & expected.isna())).any(axis = 1).sum()) \
+                if streamed.shape == expected.shape else abs(len(streamed) - len(expected))
+            raise AssertionError(f'Streamed {table_name} differs from the batch one in {differing} rows '
+                                 f'(chunksize {chunksize})')
+    finally:
+        conn.execute(f'DROP TABLE IF EXISTS "{batch_table}"')
+        conn.commit()
+    logging.info(f'{table_name}: streamed table matches the batch one (chunksize {chunksize})')
+
+
 if __name__ == "__main__":
-    # Create a database connection
-    conn = sqlite3.connect('inventory.db')
-    conn = sqlite3.connect('D:/Python-DataAnalysis/inventory.db')
-    conn.execute("PRAGMA temp_store = MEMORY;")
+    parser = argparse.ArgumentParser(description = 'Build the vendor_summary table')
+    parser.add_argument('--stream', action = 'store_true', help = 'build the table chunk by chunk with O(chunk) memory')
+    parser.add_argument('--chunksize', type = int, default = DEFAULT_SUMMARY_CHUNKSIZE)
+    parser.add_argument('--check', action = 'store_true', help = 'with --stream, check the table against the batch path')
+    args = parser.parse_args()
 
-    logging.info("Creating vendor summary table")
-    summary_df = create_vendor_summary(conn)
-    logging.info(summary_df.head())
+    # The writer connection of the configured database (see db_connection.database_path)
+    conn = writer_connection()
 
-    logging.info("Cleaning the data")
-    clean_df = clean_data(summary_df)
-    logging.info(clean_df.head())
+    # Timings, row counts, memory, and the page cache and database sizes of each step go to logs/metrics.jsonl
+    logging.info("Indexing the join and group keys of the summary query")
+    with measure('stage', 'index', conn):
+        build_indexes(conn)
+        check_query_plan(conn, VENDOR_SUMMARY_QUERY)
 
+    if args.stream:
+        logging.info("Creating vendor summary table chunk by chunk")
+        with measure('stage', 'summary_streaming', conn) as record:
+            if args.check:
+                check_streaming_summary(conn, chunksize = args.chunksize)
+            else:
+                build_vendor_summary_streaming(conn, chunksize = args.chunksize)
+            record['rows_out'] = conn.execute('SELECT COUNT(*) FROM vendor_summary').fetchone()[0]
+    else:
+        logging.info("Creating vendor summary table")
+        summary_df = create_vendor_summary(conn)
 
-    logging.info("Ingesting the cleaned data into the database")
-    ingest_db(clean_df, 'vendor_summary', conn)
+        logging.info("Cleaning the data")
+        with measure('stage', 'clean', rows_in = len(summary_df)) as record:
+            # Unlike clean_data, a KPI with a zero denominator is stored as NULL instead of +-inf
+            clean_df = clean_data_vectorized(summary_df, zero_division = 'nan')
+            record['rows_out'] = len(clean_df)
+
+        logging.info("Ingesting the cleaned data into the database")
+        with measure('stage', 'ingest_summary', conn, rows_in = len(clean_df)):
+            ingest_db(clean_df, 'vendor_summary', conn, column_types = summary_column_types(clean_df.columns))
     logging.info("Vendor summary table created and ingested successfully")
 
+    logging.info("Building the vendor and brand rollups")
+    with measure('stage', 'rollups', conn):
+        build_rollups(conn)
+
     # Close the database connection
     conn.close()
 
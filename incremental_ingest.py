@@ -0,0 +1,185 @@
+import pandas as pd
+import os
+import hashlib
+import logging
+import time
+from ingestion_DB import engine, ingest_csv_chunked, DEFAULT_CHUNKSIZE
+from bulk_insert import insert_rows, raw_sqlite_connection, table_exists
+from dtype_planner import plan_dtypes, read_planned_csv
+
+MANIFEST_TABLE = 'ingest_manifest'
+
+# Bytes read at a time while hashing a csv
+HASH_BLOCK = 1 << 20
+
+
+def read_manifest(engine):
+    """Returns the manifest as {file name: entry dict}"""
+    with raw_sqlite_connection(engine) as conn:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                file TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                sha256 TEXT,
+                rows INTEGER,
+                ingested_at TEXT
+            )""")
+        conn.commit()
+        rows = conn.execute(f'SELECT file, size, mtime_ns, sha256, rows FROM {MANIFEST_TABLE}').fetchall()
+    return {file: {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256, 'rows': n}
+            for file, size, mtime_ns, sha256, n in rows}
+
+
+def put_manifest_entry(conn, file, size, mtime_ns, sha256, rows):
+    """Writes the manifest entry of a file inside the caller's transaction"""
+    conn.execute(
+        f'INSERT OR REPLACE INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, datetime(\'now\'))',
+        (file, size, mtime_ns, sha256, rows))
+
+
+def write_manifest_entry(engine, file, size, mtime_ns, sha256, rows):
+    with raw_sqlite_connection(engine) as conn:
+        put_manifest_entry(conn, file, size, mtime_ns, sha256, rows)
+        conn.commit()
+
+
+def hash_file(path, prefix_size = None):
+    """Hashes a file in one pass and returns (sha256 of the first prefix_size bytes, sha256 of the whole file)"""
+    digest = hashlib.sha256()
+    prefix_digest = None
+    read = 0
+    with open(path, 'rb') as f:
+        if prefix_size is not None:
+            while read < prefix_size:
+                block = f.read(min(HASH_BLOCK, prefix_size - read))
+                if not block:
+                    break
+                digest.update(block)
+                read += len(block)
+            prefix_digest = digest.hexdigest()
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return prefix_digest, digest.hexdigest()
+
+
+def ends_with_newline(path, offset):
+    """Checks that the byte before offset is a newline, i.e. that offset is a row boundary"""
+    if offset == 0:
+        return False
+    with open(path, 'rb') as f:
+        f.seek(offset - 1)
+        return f.read(1) == b'\n'
+
+
+def max_rowid(engine, table_name):
+    with raw_sqlite_connection(engine) as conn:
+        if not table_exists(conn, table_name):
+            return 0
+        return conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table_name}"').fetchone()[0]
+
+
+def ingest_tail(path, table_name, engine, offset, manifest_entry, chunksize = DEFAULT_CHUNKSIZE):
+    """Appends the rows that start at byte offset of a csv to its table
+
+    The rows and the updated manifest entry (file, size, mtime_ns, sha256 and the row count before
+    the append) are committed in one transaction, so a crash can never leave appended rows behind
+    a manifest that would make the next run append them again.
+    """
+    columns = pd.read_csv(path, nrows = 0).columns
+    plan = plan_dtypes(path)
+    file, size, mtime_ns, sha256, previous_rows = manifest_entry
+    rows = 0
+    with raw_sqlite_connection(engine) as conn:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN')
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for chunk in read_planned_csv(f, plan, header = None, names = columns, chunksize = chunksize):
+                    insert_rows(conn, chunk, table_name)
+                    rows += len(chunk)
+            put_manifest_entry(conn, file, size, mtime_ns, sha256, previous_rows + rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return rows
+
+
+def plan_file(path, entry, table_present):
+    """Decides whether a csv is skipped, appended to or rebuilt, and hashes it
+
+    Returns (action, sha256 of the whole file). The action is 'skip' when the file is unchanged,
+    'append' when the previously ingested bytes are an untouched prefix of the file, and 'rebuild'
+    otherwise.
+    """
+    stat = os.stat(path)
+    if entry is None or not table_present:
+        return 'rebuild', hash_file(path)[1]
+    if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+        return 'skip', entry['sha256']
+
+    prefix_size = entry['size'] if stat.st_size >= entry['size'] else None
+    prefix_sha, sha = hash_file(path, prefix_size)
+    if sha == entry['sha256']:
+        return 'skip', sha
+    if prefix_sha == entry['sha256'] and ends_with_newline(path, entry['size']):
+        return 'append', sha
+    return 'rebuild', sha
+
+
+def load_raw_data_incremental(chunksize = DEFAULT_CHUNKSIZE):
+    """This function ingests only what changed in data/ since the last run
+
+    Unchanged csvs are skipped, csvs that only grew at the end get their new tail rows appended,
+    and only csvs that were rewritten are reloaded in full. Returns {table name: delta} where delta
+    holds the action, the number of rows written and the rowid of the first new row.
+    """
+    start = time.time()
+    manifest = read_manifest(engine)
+    deltas = {}
+
+    for file in os.listdir('data'):
+        if '.csv' not in file:
+            continue
+        path = 'data/' + file
+        table_name = file[:-4]
+        entry = manifest.get(file)
+        with raw_sqlite_connection(engine) as conn:
+            table_present = table_exists(conn, table_name)
+
+        action, sha = plan_file(path, entry, table_present)
+        stat = os.stat(path)
+        first_rowid = None
+
+        if action == 'skip':
+            logging.info(f'{file} is unchanged, skipping')
+            rows = 0
+            total_rows = entry['rows']
+        elif action == 'append':
+            logging.info(f'{file} grew by {stat.st_size - entry["size"]} bytes, ingesting the new rows')
+            first_rowid = max_rowid(engine, table_name) + 1
+            rows = ingest_tail(path, table_name, engine, entry['size'],
+                               (file, stat.st_size, stat.st_mtime_ns, sha, entry['rows']), chunksize = chunksize)
+            total_rows = entry['rows'] + rows
+        else:
+            logging.info(f'Ingesting {file} into the database')
+            first_rowid = 1
+            rows = ingest_csv_chunked(path, table_name, engine, chunksize = chunksize)
+            total_rows = rows
+
+        # An append has already written its manifest entry together with the rows
+        if action == 'rebuild' or (action == 'skip' and stat.st_mtime_ns != entry['mtime_ns']):
+            write_manifest_entry(engine, file, stat.st_size, stat.st_mtime_ns, sha, total_rows)
+        deltas[table_name] = {'action': action, 'rows': rows, 'first_rowid': first_rowid}
+
+    total_time = (time.time() - start)/60
+    logging.info(f'Incremental ingestion finished: {deltas}')
+    logging.info(f'Total time taken to ingest all files: {total_time} minutes')
+    return deltas
+
+
+if __name__ == "__main__":
+    load_raw_data_incremental()
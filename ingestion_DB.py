@@ -1,8 +1,17 @@
 import pandas as pd
 import os
-from sqlalchemy import create_engine
 import logging
 import time
+import argparse
+import queue
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from bulk_insert import bulk_insert, bump_table_version, raw_sqlite_connection
+from dtype_planner import plan_dtypes, read_planned_csv, column_types
+from db_connection import writer_connection, writer_engine
+from instrumentation import emit, measure
 
 
 logging.basicConfig(
@@ -12,24 +21,209 @@ logging.basicConfig(
    filemode = "a"
 )
 
-engine = create_engine('sqlite:///inventory.db')
+# Writes go through the single WAL-mode writer connection of the configured database
+engine = writer_engine()
 
+# Default number of rows read per chunk in streaming mode
+DEFAULT_CHUNKSIZE = 100_000
 
+# Queue shared with the parser processes of the parallel mode, and the event that stops them
+_chunk_queue = None
+_stop_parsing = None
 
-def ingest_db(df ,table_name ,engine):
-    ''' This function will take a dataframe and a table name and ingest the dataframe into the database '''
-    df.to_sql(table_name , con = engine , if_exists = 'replace' , index = False)
 
 
-def load_raw_data():
-  ''' This function will load the csvs as dataframes and ingest them into the database '''
+def ingest_db(df ,table_name ,engine, if_exists = 'replace', bulk = True, column_types = None):
+    ''' This function will take a dataframe and a table name and ingest the dataframe into the database
+
+    By default the bulk-load path is used (one transaction, batched executemany, load-time pragmas
+    and declared column types, taken from column_types when given); bulk = False falls back to
+    DataFrame.to_sql.
+    '''
+    if bulk:
+        bulk_insert(df, table_name, engine, if_exists = if_exists, column_types = column_types)
+    else:
+        df.to_sql(table_name , con = engine , if_exists = if_exists , index = False)
+        with raw_sqlite_connection(engine) as conn:
+            bump_table_version(conn, table_name)
+            conn.commit()
+
+
+def rows_for_byte_budget(path, chunk_bytes, sample_lines = 1000):
+  ''' This function estimates how many csv rows fit into a byte budget by sampling the average line length '''
+  with open(path, 'rb') as f:
+    f.readline()  # header
+    lengths = [len(line) for _, line in zip(range(sample_lines), f)]
+  if not lengths:
+    return 1
+  avg_line = sum(lengths) / len(lengths)
+  return max(1, int(chunk_bytes // avg_line))
+
+
+def read_csv(path, dtype_plan = True, **kwargs):
+  ''' This function reads a csv, with its planned compact dtypes unless dtype_plan is False, and returns (data, declared column types) '''
+  if not dtype_plan:
+    return pd.read_csv(path, **kwargs), None
+  plan = plan_dtypes(path)
+  return read_planned_csv(path, plan, **kwargs), column_types(plan)
+
+
+def ingest_csv_chunked(path, table_name, engine, chunksize = DEFAULT_CHUNKSIZE, dtype_plan = True, write_lock = None):
+  ''' This function streams a csv into a table chunk by chunk so that only one chunk is held in memory at a time
+
+  With write_lock given, the lock is held while a chunk is written but not while the next one is parsed.
+  '''
+  start = time.time()
+  rows = 0
+  chunks, types = read_csv(path, dtype_plan, chunksize = chunksize)
+  for i, chunk in enumerate(chunks):
+    # The first chunk replaces the table, the following ones are appended to it
+    with write_lock or nullcontext():
+      ingest_db(chunk, table_name, engine, if_exists = 'replace' if i == 0 else 'append', column_types = types)
+    rows += len(chunk)
+    logging.debug(f'{table_name}: chunk {i} written ({rows} rows so far)')
+
+  elapsed = time.time() - start
+  rate = rows / elapsed if elapsed > 0 else float('inf')
+  logging.info(f'{table_name}: {rows} rows in {elapsed:.2f} seconds ({rate:,.0f} rows/sec)')
+  return rows
+
+
+def load_raw_data(chunksize = None, chunk_bytes = None, dtype_plan = True, backend = 'sqlite', partition_by = 'vendor'):
+  ''' This function will load the csvs as dataframes and ingest them into the database
+
+  With chunksize (rows) or chunk_bytes (approximate bytes per chunk) set, every csv is streamed
+  into its table in chunks instead of being read into memory as a whole. Unless dtype_plan is
+  False, each csv is sampled first and read with compact dtypes (see dtype_planner.py).
+  backend = 'parquet' writes partitioned parquet datasets instead (see parquet_store.py).
+  '''
+  if backend == 'parquet':
+    # Imported here so that pyarrow stays an optional dependency
+    from parquet_store import load_raw_data_parquet
+    return load_raw_data_parquet(partition_by = partition_by)
+
   start = time.time()
   for file in os.listdir('data'):
     if '.csv' in file:
-      df = pd.read_csv('data/' + file)
       logging.info(f'Ingesting {file} into the database')
-      
-      ingest_db(df , file[:-4], engine)
+      path = 'data/' + file
+
+      # engine writes through the writer connection, whose page cache size and database size are recorded
+      with measure('ingest', file, writer_connection(), path = path) as record:
+        if chunksize is None and chunk_bytes is None:
+          df, types = read_csv(path, dtype_plan)
+          ingest_db(df , file[:-4], engine, column_types = types)
+          record['rows_out'] = len(df)
+        else:
+          rows = chunksize or rows_for_byte_budget(path, chunk_bytes)
+          record['rows_out'] = ingest_csv_chunked(path, file[:-4], engine, chunksize = rows, dtype_plan = dtype_plan)
+
+  end = time.time()
+  total_time = (end - start)/60
+  logging.info('All files ingested successfully!')
+  logging.info(f'Total time taken to ingest all files: {total_time} minutes')
+
+
+def _init_parser(chunk_queue, stop_parsing):
+  ''' Pool initializer that hands the shared chunk queue and stop event to a parser process '''
+  global _chunk_queue, _stop_parsing
+  _chunk_queue = chunk_queue
+  _stop_parsing = stop_parsing
+
+
+def _parse_csv(path, table_name, chunksize, dtype_plan = True):
+  ''' This function parses and types a csv in a worker process and puts its chunks on the shared queue for the writer '''
+  rows = 0
+  try:
+    chunks, types = read_csv(path, dtype_plan, chunksize = chunksize)
+    for chunk in chunks:
+      if _stop_parsing.is_set():
+        return rows
+      _chunk_queue.put(('chunk', table_name, (chunk, types)))
+      rows += len(chunk)
+  except Exception as e:
+    _chunk_queue.put(('error', table_name, repr(e)))
+    raise
+  _chunk_queue.put(('done', table_name, rows))
+  return rows
+
+
+def _stop_parsers(pool, chunk_queue, stop_parsing):
+  ''' This function shuts the parser pool down after a failure
+
+  Parsers blocked on the full queue would keep the pool from shutting down, so the queue is
+  drained in the background until every worker has stopped.
+  '''
+  stop_parsing.set()
+  stopped = threading.Event()
+
+  def drain():
+    while not stopped.is_set():
+      try:
+        chunk_queue.get(timeout = 0.1)
+      except queue.Empty:
+        pass
+
+  drainer = threading.Thread(target = drain, name = 'chunk-queue-drainer', daemon = True)
+  drainer.start()
+  pool.shutdown(wait = True, cancel_futures = True)
+  stopped.set()
+  drainer.join()
+
+
+def load_raw_data_parallel(workers = None, chunksize = DEFAULT_CHUNKSIZE, max_queued_chunks = None, dtype_plan = True):
+  ''' This function parses the csvs concurrently in a process pool while a single writer inserts them
+
+  SQLite allows one writer only, so the parsed chunks go through a bounded queue to this process,
+  which is the only one writing to the database. At most max_queued_chunks chunks (two per worker
+  by default) are in flight, which caps memory at roughly that many chunks.
+  '''
+  start = time.time()
+  files = [file for file in os.listdir('data') if '.csv' in file]
+  workers = workers or min(len(files), os.cpu_count() or 1)
+  chunk_queue = mp.get_context().Queue(maxsize = max_queued_chunks or 2 * workers)
+  stop_parsing = mp.get_context().Event()
+
+  with ProcessPoolExecutor(max_workers = workers, initializer = _init_parser, initargs = (chunk_queue, stop_parsing)) as pool:
+    futures = [pool.submit(_parse_csv, 'data/' + file, file[:-4], chunksize, dtype_plan) for file in files]
+    written = {}
+    table_start = {}
+    pending = len(files)
+
+    try:
+      while pending:
+        try:
+          kind, table_name, payload = chunk_queue.get(timeout = 1)
+        except queue.Empty:
+          # A worker that died without reporting would otherwise leave the writer waiting forever
+          for future in futures:
+            if future.done() and future.exception() is not None:
+              raise future.exception()
+          continue
+
+        if kind == 'chunk':
+          chunk, types = payload
+          if table_name not in written:
+            logging.info(f'Ingesting {table_name}.csv into the database')
+            table_start[table_name] = time.time()
+            written[table_name] = 0
+          ingest_db(chunk, table_name, engine, if_exists = 'replace' if written[table_name] == 0 else 'append', column_types = types)
+          written[table_name] += len(chunk)
+        elif kind == 'error':
+          raise RuntimeError(f'Parsing {table_name}.csv failed: {payload}')
+        else:
+          pending -= 1
+          elapsed = time.time() - table_start.get(table_name, start)
+          rate = payload / elapsed if elapsed > 0 else float('inf')
+          logging.info(f'{table_name}: {payload} rows in {elapsed:.2f} seconds ({rate:,.0f} rows/sec)')
+          # Parsing runs in the workers, so only the wall time and throughput are known here
+          emit({'kind': 'ingest', 'name': f'{table_name}.csv', 'status': 'ok', 'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'wall_seconds': round(elapsed, 6), 'rows_out': payload, 'rows_per_second': round(rate, 1),
+                'bytes_read': os.path.getsize(f'data/{table_name}.csv')})
+    except BaseException:
+      # Raising straight out of the with block would wait forever for parsers blocked on the full queue
+      _stop_parsers(pool, chunk_queue, stop_parsing)
+      raise
 
   end = time.time()
   total_time = (end - start)/60
@@ -38,4 +232,16 @@ def load_raw_data():
 
 
 if __name__ == "__main__":
-   load_raw_data()
\ No newline at end of file
+   parser = argparse.ArgumentParser(description = 'Ingest the csv files in data/ into inventory.db')
+   parser.add_argument('--chunksize', type = int, help = 'stream each csv in chunks of this many rows')
+   parser.add_argument('--chunk-bytes', type = int, help = 'stream each csv in chunks of roughly this many bytes')
+   parser.add_argument('--workers', type = int, help = 'parse the csvs in parallel with this many processes')
+   parser.add_argument('--no-dtype-plan', action = 'store_true', help = 'let pandas infer the column types')
+   parser.add_argument('--backend', choices = ['sqlite', 'parquet'], default = 'sqlite', help = 'where the raw tables are stored')
+   parser.add_argument('--partition-by', choices = ['vendor', 'month'], default = 'vendor', help = 'partitioning of the parquet datasets')
+   args = parser.parse_args()
+   if args.workers:
+      load_raw_data_parallel(workers = args.workers, chunksize = args.chunksize or DEFAULT_CHUNKSIZE, dtype_plan = not args.no_dtype_plan)
+   else:
+      load_raw_data(chunksize = args.chunksize, chunk_bytes = args.chunk_bytes, dtype_plan = not args.no_dtype_plan,
+                    backend = args.backend, partition_by = args.partition_by)
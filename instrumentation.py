@@ -0,0 +1,248 @@
+import atexit
+import cProfile
+import json
+import logging
+import logging.handlers
+import os
+import platform
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Unix only
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # optional dependency, RSS comes from /proc or getrusage without it
+    psutil = None
+
+try:
+    import apsw
+except ImportError:  # optional dependency, the only binding here that exposes sqlite3_db_status
+    apsw = None
+
+_SQLITE_ERRORS = (sqlite3.Error, AttributeError) + ((apsw.Error,) if apsw is not None else ())
+
+# One JSON object per line for every measured ingest file, query and stage
+METRICS_LOG = os.path.join('logs', 'metrics.jsonl')
+
+PROFILE_DIR = os.path.join('logs', 'profiles')
+
+# Seconds between two RSS samples of the peak memory sampler
+RSS_SAMPLE_INTERVAL = 0.01
+
+_metrics_logger = logging.getLogger('metrics')
+_metrics_logger.propagate = False
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def start_metrics_logging(path = METRICS_LOG):
+    """Sends the metrics records through a queue to a background thread that appends them to path
+
+    The measured code only puts the record on the queue; formatting and file writes happen on
+    the listener thread. Called on the first record, stopped (and flushed) at exit.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        handler = logging.FileHandler(path, mode = 'a')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        records = queue.SimpleQueue()
+        _metrics_logger.addHandler(logging.handlers.QueueHandler(records))
+        _metrics_logger.setLevel(logging.INFO)
+        _listener = logging.handlers.QueueListener(records, handler)
+        _listener.start()
+        atexit.register(stop_metrics_logging)
+
+
+def stop_metrics_logging():
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in list(_metrics_logger.handlers):
+            _metrics_logger.removeHandler(handler)
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def emit(record):
+    """Writes one metrics record as a JSON line"""
+    if _listener is None:
+        start_metrics_logging()
+    _metrics_logger.info(json.dumps(record, default = str))
+
+
+def current_rss():
+    """Resident set size of this process in bytes (the peak so far where only that is available), or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == 'Darwin' else peak * 1024
+    return None
+
+
+def bytes_read():
+    """Bytes this process has read through read() calls so far, or None where it is not exposed"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class _PeakSampler:
+    """One background thread that tracks the peak RSS of every measurement in progress"""
+
+    def __init__(self):
+        self.active = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, peak):
+        with self.lock:
+            self.active.add(peak)
+            if self.thread is None:
+                self.thread = threading.Thread(target = self._run, name = 'rss-sampler', daemon = True)
+                self.thread.start()
+
+    def remove(self, peak):
+        with self.lock:
+            self.active.discard(peak)
+
+    def _run(self):
+        while True:
+            rss = current_rss()
+            with self.lock:
+                for peak in self.active:
+                    peak.value = max(peak.value, rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+class _Peak:
+    def __init__(self, value):
+        self.value = value
+
+
+_sampler = _PeakSampler()
+
+
+def cache_stats(conn):
+    """Page cache hits and misses of an apsw connection since it opened, from sqlite3_db_status; or None
+
+    The stdlib sqlite3 module has no binding for sqlite3_db_status, so sqlite3 connections get None.
+    """
+    if apsw is None or not isinstance(conn, apsw.Connection):
+        return None
+    try:
+        return {'cache_hit': conn.status(apsw.SQLITE_DBSTATUS_CACHE_HIT)[0],
+                'cache_miss': conn.status(apsw.SQLITE_DBSTATUS_CACHE_MISS)[0]}
+    except apsw.Error:
+        return None
+
+
+def cache_settings(conn):
+    """The page cache size a connection is configured with and the database size, in bytes; or None"""
+    try:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        cache_size = conn.execute('PRAGMA cache_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    except _SQLITE_ERRORS:
+        return None
+    # A negative cache_size is in KiB, a positive one in pages
+    capacity = -cache_size * 1024 if cache_size < 0 else cache_size * page_size
+    return {'page_cache_bytes': capacity, 'database_bytes': page_count * page_size}
+
+
+def short_name(sql, length = 80):
+    """A one-line, shortened form of a SQL statement for the metrics records"""
+    return re.sub(r'\s+', ' ', sql).strip()[:length]
+
+
+@contextmanager
+def measure(kind, name, conn = None, rows_in = None, path = None, profile = False):
+    """Measures the block and writes a metrics record for it when it ends
+
+    Yields the record, where the block sets what only it knows (rows_out, rows_in). Recorded:
+    wall time; CPU time of the calling thread (worker processes are not included); rows in and
+    out and rows per second; bytes read (the size of path when given, else the bytes the process
+    read); and the peak RSS increase during the block (None where RSS cannot be read). With a
+    conn, the configured page cache size and the database size at the end of the block; with an
+    apsw conn also its page cache hits, misses and hit ratio (sqlite3 connections cannot report
+    them). With profile set, the block runs under cProfile and the stats are dumped to logs/profiles.
+    """
+    record = {'kind': kind, 'name': name, 'rows_in': rows_in, 'rows_out': None}
+    start_cache = cache_stats(conn) if conn is not None else None
+    start_read = bytes_read()
+    peak = _Peak(current_rss())
+    start_rss = peak.value
+    if start_rss is not None:
+        _sampler.add(peak)
+    profiler = cProfile.Profile() if profile else None
+    start_cpu = time.thread_time()
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+        record['status'] = 'ok'
+    except BaseException as e:
+        record['status'] = f'error: {e!r}'
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        wall = time.perf_counter() - start
+        cpu = time.thread_time() - start_cpu
+        _sampler.remove(peak)
+        if start_rss is not None:
+            peak.value = max(peak.value, current_rss())
+
+        rows = record['rows_out'] if record['rows_out'] is not None else record['rows_in']
+        record.update({
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'rows_per_second': round(rows / wall, 1) if rows is not None and wall > 0 else None,
+            'peak_rss_delta_bytes': peak.value - start_rss if start_rss is not None else None,
+        })
+        if path is not None and os.path.exists(path):
+            record['bytes_read'] = os.path.getsize(path)
+        else:
+            end_read = bytes_read()
+            record['bytes_read'] = end_read - start_read if start_read is not None and end_read is not None else None
+        if conn is not None:
+            record.update(cache_settings(conn) or {})
+        end_cache = cache_stats(conn) if start_cache is not None else None
+        if end_cache is not None:
+            hits = end_cache['cache_hit'] - start_cache['cache_hit']
+            misses = end_cache['cache_miss'] - start_cache['cache_miss']
+            record.update({'cache_hit': hits, 'cache_miss': misses,
+                           'cache_hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None})
+        if profiler:
+            os.makedirs(PROFILE_DIR, exist_ok = True)
+            safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', f'{kind}_{name}')[:100]
+            record['profile'] = os.path.join(PROFILE_DIR, f'{safe}_{time.strftime("%Y%m%d-%H%M%S")}.prof')
+            profiler.dump_stats(record['profile'])
+        emit(record)
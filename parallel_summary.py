@@ -0,0 +1,127 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from db_connection import database_path, open_reader, read_connection
+from get_summary_table import VENDOR_SUMMARY_TEMPLATE, SUMMARY_ORDER_BY, create_vendor_summary
+
+
+def partition_bounds(conn, partitions):
+    """Splits the VendorNumber line into contiguous ranges holding about the same number of vendors
+
+    Returns [(low, high), ...] with None for an open end, so every vendor falls in one range.
+    The vendors are taken from the small vendor_invoice table.
+    """
+    vendors = [row[0] for row in conn.execute(
+        'SELECT DISTINCT VendorNumber FROM vendor_invoice WHERE VendorNumber IS NOT NULL ORDER BY 1')]
+    cuts = sorted({vendors[len(vendors) * i // partitions] for i in range(1, partitions)} if vendors else set())
+    edges = [None] + cuts + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _range_filter(column, low, high):
+    conditions = []
+    if low is not None:
+        conditions.append(f'{column} >= {low!r}')
+    if high is not None:
+        conditions.append(f'{column} < {high!r}')
+    return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+
+def partition_query(low, high):
+    """The summary query restricted to the vendors in [low, high)
+
+    All three aggregations are keyed by vendor, so a vendor's purchases, sales and freight
+    always land in the same partition and every partial result is final for its vendors.
+    A range (rather than a hash bucket) lets each aggregation seek into its index.
+    """
+    return VENDOR_SUMMARY_TEMPLATE.format(
+        freight_filter = _range_filter('VendorNumber', low, high),
+        purchase_filter = _range_filter('p.VendorNumber', low, high),
+        sales_filter = _range_filter('VendorNo', low, high),
+        order_by = SUMMARY_ORDER_BY.format(prefix = 'ps.'),
+    )
+
+
+def _summarize_partition(db_path, bounds):
+    """Runs one partition of the summary on its own read-only connection"""
+    conn = open_reader(db_path)
+    try:
+        cursor = conn.execute(partition_query(*bounds))
+        columns = [col[0] for col in cursor.description]
+        return columns, cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def create_vendor_summary_parallel(db_path = None, workers = None, partitions = None):
+    """Computes the vendor summary with the VendorNumber range split across a process pool
+
+    The partial results are merged by SQLite itself (an in-memory table sorted with the same
+    ORDER BY as the serial query), so values, column order, row order and dtypes match
+    create_vendor_summary. db_path defaults to the configured database.
+    """
+    db_path = database_path(db_path)
+    workers = workers or os.cpu_count() or 1
+    # More partitions than workers evens out skewed vendors
+    partitions = partitions or 4 * workers
+    with read_connection(db_path) as conn:
+        bounds = partition_bounds(conn, partitions)
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        results = list(pool.map(_summarize_partition, [db_path] * len(bounds), bounds))
+
+    columns = results[0][0]
+    merged = sqlite3.connect(':memory:')
+    merged.execute(f'CREATE TABLE summary ({", ".join(columns)})')
+    for _, rows in results:
+        merged.executemany(f'INSERT INTO summary VALUES ({", ".join("?" for _ in columns)})', rows)
+    summary = pd.read_sql_query(
+        f'SELECT * FROM summary ORDER BY {SUMMARY_ORDER_BY.format(prefix = "")}', merged)
+    merged.close()
+    return summary
+
+
+def benchmark(db_path = None, worker_counts = (1, 2, 4, 8), repeat = 3):
+    """Times the serial summary against the parallel one for each worker count; returns the best times"""
+    db_path = database_path(db_path)
+    timings = {}
+    serial = None
+    best = float('inf')
+    with read_connection(db_path) as conn:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            serial = create_vendor_summary(conn)
+            best = min(best, time.perf_counter() - start)
+    timings['serial'] = best
+
+    for workers in worker_counts:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parallel = create_vendor_summary_parallel(db_path, workers = workers)
+            best = min(best, time.perf_counter() - start)
+        if not parallel.equals(serial):
+            raise AssertionError(f'Parallel summary with {workers} workers differs from the serial one')
+        timings[workers] = best
+
+    for key, seconds in timings.items():
+        label = 'serial' if key == 'serial' else f'{key} workers'
+        speedup = timings['serial'] / seconds
+        print(f'{label:>12}: {seconds:8.3f} s  ({speedup:.2f}x)')
+        logging.info(f'Vendor summary benchmark, {label}: {seconds:.3f} seconds')
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Benchmark the partition-parallel vendor summary')
+    parser.add_argument('--db', default = None, help = 'database path, by default the configured one')
+    parser.add_argument('--workers', type = int, nargs = '+', default = [1, 2, 4, 8])
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+    benchmark(args.db, args.workers, args.repeat)
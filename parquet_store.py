@@ -0,0 +1,198 @@
+import logging
+import os
+import time
+
+import pandas as pd
+
+from dtype_planner import plan_dtypes, read_planned_csv
+from get_summary_table import SUMMARY_ORDER_BY, create_vendor_summary
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for the parquet backend
+    pa = ds = pq = None
+
+
+DEFAULT_ROOT = 'parquet'
+
+# Number of hash buckets the vendor partitioning spreads the vendors over
+VENDOR_BUCKETS = 16
+
+# Vendor and date columns of each raw table, used for partitioning and pruning
+VENDOR_COLUMNS = {
+    'purchases': 'VendorNumber',
+    'purchase_prices': 'VendorNumber',
+    'vendor_invoice': 'VendorNumber',
+    'sales': 'VendorNo',
+}
+DATE_COLUMNS = {
+    'purchases': 'PODate',
+    'vendor_invoice': 'InvoiceDate',
+    'sales': 'SalesDate',
+    'begin_inventory': 'startDate',
+    'end_inventory': 'endDate',
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('The parquet backend needs pyarrow: pip install pyarrow')
+
+
+def arrow_schema(plan):
+    """Arrow schema for a dtype plan; every integer is int64 since parquet encodes them compactly anyway"""
+    types = {'float64': pa.float64(), 'date': pa.timestamp('ms'), 'bool': pa.bool_()}
+    return pa.schema([(col, pa.int64() if kind.lower().startswith('int') else types.get(kind, pa.string()))
+                      for col, kind in plan.items()])
+
+
+def partition_column(table_name, partition_by):
+    """Name and values function of the partition column for a table, or None when it cannot be partitioned that way"""
+    if partition_by == 'vendor' and table_name in VENDOR_COLUMNS:
+        vendor = VENDOR_COLUMNS[table_name]
+        return 'VendorBucket', lambda df: df[vendor].fillna(-1).astype('int64').abs() % VENDOR_BUCKETS
+    if partition_by == 'month' and table_name in DATE_COLUMNS:
+        date = DATE_COLUMNS[table_name]
+        return 'Month', lambda df: pd.to_datetime(df[date], errors = 'coerce').dt.strftime('%Y-%m').fillna('unknown')
+    return None
+
+
+def write_parquet_dataset(path, table_name, root = DEFAULT_ROOT, partition_by = 'vendor', chunksize = 1_000_000):
+    """Streams a csv into a partitioned, zstd-compressed parquet dataset under root/table_name
+
+    Each chunk is sorted by its vendor column before it is written, so the row-group min/max
+    statistics stay tight and vendor filters can skip most row groups.
+    """
+    _require_pyarrow()
+    start = time.time()
+    plan = plan_dtypes(path)
+    schema = arrow_schema(plan)
+    partition = partition_column(table_name, partition_by)
+    if partition is not None:
+        schema = schema.append(pa.field(partition[0], pa.string() if partition_by == 'month' else pa.int64()))
+
+    target = os.path.join(root, table_name)
+    if os.path.isdir(target):
+        for dirpath, _, files in os.walk(target, topdown = False):
+            for file in files:
+                os.remove(os.path.join(dirpath, file))
+            os.rmdir(dirpath)
+
+    rows = 0
+    for i, chunk in enumerate(read_planned_csv(path, plan, chunksize = chunksize)):
+        if table_name in VENDOR_COLUMNS:
+            chunk = chunk.sort_values(VENDOR_COLUMNS[table_name], kind = 'stable')
+        if partition is not None:
+            chunk[partition[0]] = partition[1](chunk)
+        table = pa.Table.from_pandas(chunk, schema = schema, preserve_index = False, safe = True)
+        pq.write_to_dataset(table, target, partition_cols = [partition[0]] if partition else None,
+                            basename_template = f'part-{i}-{{i}}.parquet', compression = 'zstd')
+        rows += len(chunk)
+
+    elapsed = time.time() - start
+    logging.info(f'{table_name}: {rows} rows written to {target} in {elapsed:.2f} seconds')
+    return rows
+
+
+def load_raw_data_parquet(root = DEFAULT_ROOT, partition_by = 'vendor'):
+    """Writes every csv in data/ to its own parquet dataset"""
+    start = time.time()
+    for file in os.listdir('data'):
+        if '.csv' in file:
+            logging.info(f'Writing {file} to parquet')
+            write_parquet_dataset('data/' + file, file[:-4], root, partition_by)
+    total_time = (time.time() - start)/60
+    logging.info(f'Total time taken to write all files to parquet: {total_time} minutes')
+
+
+def read_columns(table_name, columns, root = DEFAULT_ROOT, vendors = None):
+    """Reads only the given columns of a parquet table, optionally for some vendors only
+
+    The vendor filter is pushed down to the scan: it prunes the vendor buckets and skips row
+    groups by their statistics.
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(os.path.join(root, table_name), format = 'parquet', partitioning = 'hive')
+    expression = None
+    if vendors is not None and table_name in VENDOR_COLUMNS:
+        vendors = list(vendors)
+        expression = ds.field(VENDOR_COLUMNS[table_name]).isin(vendors)
+        if 'VendorBucket' in dataset.schema.names:
+            buckets = sorted({abs(int(v)) % VENDOR_BUCKETS for v in vendors})
+            expression = ds.field('VendorBucket').isin(buckets) & expression
+    return dataset.to_table(columns = columns, filter = expression)
+
+
+def _group_sum(table, keys, sums):
+    """GROUP BY keys with SUM over columns, returned as a DataFrame ({output: input} for sums)"""
+    grouped = table.group_by(keys).aggregate([(col, 'sum') for col in sums.values()])
+    df = grouped.to_pandas()
+    return df.rename(columns = {f'{col}_sum': name for name, col in sums.items()})[keys + list(sums)]
+
+
+def sort_like_sqlite(df, order_by):
+    """Sorts a frame like an SQLite ORDER BY clause, where NULL sorts below every value"""
+    keys, ascending = [], []
+    sort_frame = pd.DataFrame(index = df.index)
+    for i, term in enumerate(part.split() for part in order_by.split(',')):
+        col, desc = term[0], len(term) > 1 and term[1].upper() == 'DESC'
+        # NULLs come first in ascending order and last in descending order
+        sort_frame[f'null{i}'] = df[col].notna() if not desc else df[col].isna()
+        sort_frame[f'value{i}'] = df[col]
+        keys += [f'null{i}', f'value{i}']
+        ascending += [True, not desc]
+    order = sort_frame.sort_values(keys, ascending = ascending, kind = 'mergesort').index
+    return df.loc[order].reset_index(drop = True)
+
+
+def create_vendor_summary_parquet(root = DEFAULT_ROOT, vendors = None):
+    """Computes the vendor summary from the parquet datasets, reading only the columns it needs
+
+    It reproduces VENDOR_SUMMARY_QUERY: purchases are aggregated before the join with
+    purchase_prices, which is joined with its row multiplicity, and NULL keys never join.
+    """
+    purchase_keys = ['VendorNumber', 'VendorName', 'Brand', 'Description', 'PurchasePrice']
+    purchases = _group_sum(read_columns('purchases', purchase_keys + ['Quantity', 'Dollars'], root, vendors),
+                           purchase_keys, {'TotalPurchaseQuantity': 'Quantity', 'TotalPurchaseDollars': 'Dollars'})
+    prices = read_columns('purchase_prices', ['VendorNumber', 'Brand', 'Price', 'Volume'], root, vendors)
+    prices = prices.group_by(['VendorNumber', 'Brand', 'Price', 'Volume']).aggregate([([], 'count_all')]).to_pandas()
+    sales = _group_sum(read_columns('sales', ['VendorNo', 'Brand', 'SalesQuantity', 'SalesDollars', 'SalesPrice', 'ExciseTax'], root, vendors),
+                       ['VendorNo', 'Brand'], {'TotalSalesQuantity': 'SalesQuantity', 'TotalSalesDollars': 'SalesDollars',
+                                               'TotalSalesPrice': 'SalesPrice', 'TotalExciseTax': 'ExciseTax'})
+    freight = _group_sum(read_columns('vendor_invoice', ['VendorNumber', 'Freight'], root, vendors),
+                         ['VendorNumber'], {'FreightCost': 'Freight'})
+
+    summary = purchases.dropna(subset = ['VendorNumber', 'Brand']).merge(
+        prices.dropna(subset = ['VendorNumber', 'Brand']).rename(columns = {'Price': 'ActualPrice'}),
+        on = ['VendorNumber', 'Brand'])
+    for col in ['TotalPurchaseQuantity', 'TotalPurchaseDollars']:
+        summary[col] = summary[col] * summary['count_all']
+    summary = summary.merge(sales.dropna(subset = ['VendorNo', 'Brand']).rename(columns = {'VendorNo': 'VendorNumber'}),
+                            on = ['VendorNumber', 'Brand'], how = 'left')
+    summary = summary.merge(freight.dropna(subset = ['VendorNumber']), on = 'VendorNumber', how = 'left')
+
+    columns = purchase_keys + ['ActualPrice', 'Volume', 'TotalPurchaseQuantity', 'TotalPurchaseDollars',
+                               'TotalSalesQuantity', 'TotalSalesDollars', 'TotalSalesPrice', 'TotalExciseTax',
+                               'FreightCost']
+    return sort_like_sqlite(summary[columns], SUMMARY_ORDER_BY.format(prefix = ''))
+
+
+def compare_with_sqlite(conn, root = DEFAULT_ROOT, rtol = 1e-9):
+    """Checks that the parquet summary matches the SQLite one; sums may differ in the last bits
+    because the two engines add the values in a different order"""
+    expected = create_vendor_summary(conn)
+    actual = create_vendor_summary_parquet(root)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype = False, rtol = rtol)
+    return True
+
+
+if __name__ == "__main__":
+    from db_connection import reader_connection
+
+    load_raw_data_parquet()
+    conn = reader_connection()
+    compare_with_sqlite(conn)
+    logging.info('The parquet vendor summary matches the SQLite one')
+    conn.close()
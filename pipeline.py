@@ -0,0 +1,325 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from bulk_insert import table_exists
+from db_connection import read_connection, writer_connection
+from db_indexes import SUMMARY_INDEXES, build_indexes
+from ingestion_DB import DEFAULT_CHUNKSIZE, engine, ingest_csv_chunked
+from instrumentation import measure
+from query_cache import table_version
+from rollups import build_rollups
+from summary_maintenance import AGGREGATES, rebuild_aggregates, write_summary
+
+# Stage fingerprints of the last successful runs
+STATE_TABLE = 'pipeline_state'
+
+DEFAULT_DATA_DIR = 'data'
+DEFAULT_OUTPUT_DIR = 'reports'
+
+# The table the analysis stages read
+ANALYSIS_TABLE = 'vendor_summary'
+
+# SQLite takes one writer at a time; stages hold this lock around their writes only
+WRITE_LOCK = threading.Lock()
+
+
+class Stage:
+    """A pipeline step: func(**kwargs), with the tables ('table:name'), indexes ('index:name') and
+    files ('file:path') it reads and writes. The edges of the DAG follow from these."""
+
+    def __init__(self, name, func, inputs, outputs, **kwargs):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f'Stage({self.name!r})'
+
+
+def ingest_table(path, table_name, dtype_plan = True, chunksize = DEFAULT_CHUNKSIZE):
+    """Streams a csv into its table; only the chunk writes hold the write lock, so several tables parse
+    at once and each ingest holds one chunk in memory"""
+    ingest_csv_chunked(path, table_name, engine, chunksize = chunksize, dtype_plan = dtype_plan, write_lock = WRITE_LOCK)
+
+
+def index_tables():
+    with WRITE_LOCK:
+        build_indexes(writer_connection())
+
+
+def aggregate_tables():
+    with WRITE_LOCK:
+        rebuild_aggregates(writer_connection())
+
+
+def clean_summary():
+    with WRITE_LOCK:
+        write_summary(writer_connection())
+
+
+def rollup_tables(table_name = ANALYSIS_TABLE):
+    with WRITE_LOCK:
+        build_rollups(writer_connection(), table_name)
+
+
+def distribution_tables(table_name = ANALYSIS_TABLE):
+    from distribution_summary import build_distribution_summary
+
+    with WRITE_LOCK:
+        build_distribution_summary(writer_connection(), table_name)
+
+
+def chart_report(output_dir, table_name = ANALYSIS_TABLE, formats = ('png',)):
+    # Imported here so that matplotlib and seaborn are only needed by this stage
+    from analysis_context import AnalysisContext
+    from report_charts import build_specs, render_report
+
+    with read_connection() as conn:
+        specs = build_specs(AnalysisContext(conn, table_name), conn, table_name = table_name)
+    # The renderers are processes; spawning them is safe while the other stages' threads run
+    render_report(specs, output_dir, formats, mp_context = mp.get_context('spawn'))
+
+
+def bootstrap_report(path, table_name = ANALYSIS_TABLE):
+    from bootstrap_ci import segment_cis
+
+    with read_connection() as conn:
+        result = segment_cis(conn, table_name = table_name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    result.to_csv(path, index = False)
+
+
+def tests_report(path, table_name = ANALYSIS_TABLE):
+    from batch_tests import compare_groups_vs_rest
+
+    with read_connection() as conn:
+        result = compare_groups_vs_rest(conn, table_name = table_name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    result.to_csv(path, index = False)
+
+
+def build_stages(data_dir = DEFAULT_DATA_DIR, output_dir = DEFAULT_OUTPUT_DIR):
+    """The ingest -> index -> summary -> clean -> analysis/report DAG, one ingest stage per csv"""
+    stages = []
+    for file in sorted(os.listdir(data_dir)):
+        if file.endswith('.csv'):
+            path = os.path.join(data_dir, file)
+            stages.append(Stage(f'ingest:{file[:-4]}', ingest_table, [f'file:{path}'], [f'table:{file[:-4]}'],
+                                path = path, table_name = file[:-4]))
+
+    indexed = sorted({table for table, _ in SUMMARY_INDEXES.values()})
+    indexes = [f'index:{name}' for name in SUMMARY_INDEXES]
+    aggregates = [f'table:{spec["table"]}' for spec in AGGREGATES.values()]
+    summary = f'table:{ANALYSIS_TABLE}'
+    stages += [
+        Stage('index', index_tables, [f'table:{table}' for table in indexed], indexes),
+        Stage('summary', aggregate_tables, [f'table:{table}' for table in AGGREGATES] + indexes, aggregates),
+        Stage('clean', clean_summary, aggregates + ['table:purchase_prices'], [summary]),
+        Stage('rollups', rollup_tables, [summary], ['table:vendor_rollup', 'table:brand_rollup']),
+        Stage('distributions', distribution_tables, [summary], ['table:distribution_summary']),
+        Stage('charts', chart_report, [summary, 'table:vendor_rollup', 'table:brand_rollup', 'table:distribution_summary'],
+              [f'file:{os.path.join(output_dir, "charts")}'], output_dir = os.path.join(output_dir, 'charts')),
+        Stage('bootstrap', bootstrap_report, [summary], [f'file:{os.path.join(output_dir, "bootstrap_ci.csv")}'],
+              path = os.path.join(output_dir, 'bootstrap_ci.csv')),
+        Stage('tests', tests_report, [summary], [f'file:{os.path.join(output_dir, "welch_tests.csv")}'],
+              path = os.path.join(output_dir, 'welch_tests.csv')),
+    ]
+    return stages
+
+
+def dependencies(stages):
+    """{stage name: names of the stages producing its inputs}"""
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: {producers[ref] for ref in stage.inputs if ref in producers} for stage in stages}
+
+
+def select_stages(stages, targets):
+    """The target stages and everything upstream of them, in declaration order"""
+    if not targets:
+        return stages
+    deps = dependencies(stages)
+    unknown = set(targets) - set(deps)
+    if unknown:
+        raise ValueError(f'Unknown stages: {", ".join(sorted(unknown))}')
+    needed, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(deps[name])
+    return [stage for stage in stages if stage.name in needed]
+
+
+def fingerprint(conn, ref):
+    """Current version of a table, index or file; None when it does not exist"""
+    kind, name = ref.split(':', 1)
+    if kind == 'table':
+        return table_version(conn, name) if table_exists(conn, name) else None
+    if kind == 'index':
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()
+        return row[0] if row else None
+    if kind == 'file':
+        if not os.path.exists(name):
+            return None
+        stat = os.stat(name)
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+    raise ValueError(f'Unknown reference {ref!r}')
+
+
+def stage_fingerprint(conn, stage):
+    inputs = {ref: fingerprint(conn, ref) for ref in stage.inputs}
+    payload = json.dumps([stage.name, repr(sorted(stage.kwargs.items())), inputs], sort_keys = True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def output_fingerprint(conn, stage):
+    """Fingerprint of the stage's outputs; None when one of them does not exist"""
+    outputs = {ref: fingerprint(conn, ref) for ref in stage.outputs}
+    if any(value is None for value in outputs.values()):
+        return None
+    return hashlib.sha256(json.dumps(outputs, sort_keys = True).encode()).hexdigest()
+
+
+def is_fresh(conn, stage, current):
+    """True when the stage last ran on the same inputs and its outputs are still the ones it wrote
+
+    An output rewritten by something else (another script, an older run) makes the stage stale.
+    """
+    if not table_exists(conn, STATE_TABLE) or 'Outputs' not in _state_columns(conn):
+        return False
+    row = conn.execute(f'SELECT Fingerprint, Outputs FROM {STATE_TABLE} WHERE Stage = ?', (stage.name,)).fetchone()
+    return row is not None and row[0] == current and row[1] is not None and row[1] == output_fingerprint(conn, stage)
+
+
+def _state_columns(conn):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({STATE_TABLE})')]
+
+
+def record_stage(stage, current):
+    with WRITE_LOCK:
+        conn = writer_connection()
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {STATE_TABLE} '
+                     f'(Stage TEXT PRIMARY KEY, Fingerprint TEXT, CompletedAt TEXT, Outputs TEXT)')
+        if 'Outputs' not in _state_columns(conn):
+            conn.execute(f'ALTER TABLE {STATE_TABLE} ADD COLUMN Outputs TEXT')
+        conn.execute(f'INSERT OR REPLACE INTO {STATE_TABLE} (Stage, Fingerprint, CompletedAt, Outputs) VALUES (?, ?, ?, ?)',
+                     (stage.name, current, time.strftime('%Y-%m-%d %H:%M:%S'), output_fingerprint(conn, stage)))
+        conn.commit()
+
+
+def table_rows(conn, refs):
+    """Total rows of the tables among refs, or None if there are none"""
+    tables = [ref.split(':', 1)[1] for ref in refs if ref.startswith('table:')]
+    tables = [table for table in tables if table_exists(conn, table)]
+    if not tables:
+        return None
+    return sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+
+
+def run_stage(stage, force = False, profile = False):
+    """Runs a stage unless its inputs are unchanged since its last run; returns 'ran' or 'skipped'
+
+    The fingerprint is taken when the stage starts, after its upstream stages committed. A stage
+    that runs is measured (see instrumentation.measure), under cProfile if profile is set.
+    """
+    with read_connection() as conn:
+        current = stage_fingerprint(conn, stage)
+        if not force and is_fresh(conn, stage, current):
+            logging.info(f'Stage {stage.name} is up to date')
+            return 'skipped'
+        rows_in = table_rows(conn, stage.inputs)
+    start = time.time()
+    logging.info(f'Running stage {stage.name}')
+    # The database size recorded from the writer includes the writes of stages running at the same time
+    with measure('stage', stage.name, writer_connection(), rows_in = rows_in, profile = profile) as record:
+        stage.func(**stage.kwargs)
+        with read_connection() as conn:
+            record['rows_out'] = table_rows(conn, stage.outputs)
+    record_stage(stage, current)
+    logging.info(f'Stage {stage.name} done in {time.time() - start:.2f} seconds')
+    return 'ran'
+
+
+def run_pipeline(stages, targets = None, workers = None, force = False, profile = ()):
+    """Runs the stages in dependency order, each one as soon as its upstream stages are done
+
+    Independent stages (the per-table ingests, the reports) run concurrently in a thread pool;
+    their SQLite writes are serialized by WRITE_LOCK and reads use pooled read-only connections.
+    After a failure no new stage starts; the running ones finish and the error is raised.
+    The stages named in profile run under cProfile. Returns {stage name: 'ran' or 'skipped'}.
+    """
+    start = time.time()
+    stages = select_stages(stages, targets)
+    deps = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    # Make sure the database exists before the readers open it
+    writer_connection()
+
+    results, running, failed = {}, {}, []
+    with ThreadPoolExecutor(max_workers = workers or min(len(stages), (os.cpu_count() or 1) + 4)) as pool:
+        while len(results) < len(stages) and (running or not failed):
+            if not failed:
+                for name, stage in by_name.items():
+                    if name not in results and name not in running.values() and deps[name] <= results.keys():
+                        running[pool.submit(run_stage, stage, force, name in profile)] = name
+            if not running:
+                raise RuntimeError(f'Stages waiting on each other: {", ".join(sorted(set(by_name) - set(results)))}')
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    logging.error(f'Stage {name} failed: {e!r}')
+                    failed.append((name, e))
+
+    if failed:
+        name, error = failed[0]
+        raise RuntimeError(f'Stage {name} failed') from error
+    ran = sum(status == 'ran' for status in results.values())
+    logging.info(f'Pipeline finished in {time.time() - start:.2f} seconds: {ran} stages ran, '
+                 f'{len(results) - ran} up to date')
+    return results
+
+
+def plan(stages, targets = None):
+    """The stages that are stale right now; their downstream stages will usually follow"""
+    stages = select_stages(stages, targets)
+    with read_connection() as conn:
+        return [stage.name for stage in stages if not is_fresh(conn, stage, stage_fingerprint(conn, stage))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Run the ingest -> summary -> analysis pipeline, skipping up to date stages')
+    parser.add_argument('targets', nargs = '*', help = 'stages to bring up to date, with their upstream stages (default: all)')
+    parser.add_argument('--data-dir', default = DEFAULT_DATA_DIR)
+    parser.add_argument('--output-dir', default = DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--workers', type = int, default = None, help = 'stages run at the same time')
+    parser.add_argument('--force', action = 'store_true', help = 'run every selected stage even if up to date')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'list the stale stages and exit')
+    parser.add_argument('--profile', nargs = '+', default = [], metavar = 'STAGE', help = 'run these stages under cProfile')
+    parser.add_argument('--list', action = 'store_true', help = 'list the stages with their inputs and outputs and exit')
+    args = parser.parse_args()
+
+    stages = build_stages(args.data_dir, args.output_dir)
+    if args.list:
+        deps = dependencies(stages)
+        for stage in stages:
+            print(f'{stage.name}: after {", ".join(sorted(deps[stage.name])) or "-"}')
+            print(f'    inputs: {", ".join(stage.inputs)}')
+            print(f'    outputs: {", ".join(stage.outputs)}')
+    elif args.dry_run:
+        writer_connection()
+        print('Stale stages:', ', '.join(plan(stages, args.targets)) or 'none')
+    else:
+        for name, status in run_pipeline(stages, args.targets, args.workers, args.force, args.profile).items():
+            print(f'{name}: {status}')
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import re
+import time
+
+import pandas as pd
+
+from bulk_insert import VERSIONS_TABLE
+from instrumentation import measure, short_name
+
+try:
+    import pyarrow  # noqa: F401  (feather needs it)
+    FORMAT = 'feather'
+except ImportError:  # optional dependency, results are pickled without it
+    FORMAT = 'pickle'
+
+
+DEFAULT_CACHE_DIR = 'cache'
+
+# Total size the cached results may take before the least recently used ones are evicted
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+def normalize_sql(query):
+    """Collapses whitespace so that the same query written over different lines shares a cache entry"""
+    return ' '.join(query.split()).rstrip(';').strip()
+
+
+def source_tables(conn, query):
+    """Names of the tables and views of the database that a query refers to"""
+    words = {word.lower() for word in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', query)}
+    names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")]
+    return sorted(name for name in names if name.lower() in words)
+
+
+def table_version(conn, table_name):
+    """Data version of a table: the counter bumped by bulk_insert.py plus the table's schema and
+    highest rowid, which also catch appends and schema changes that went around it
+
+    An UPDATE, or a DELETE that keeps the highest rowid, changes neither, so code that writes
+    that way must call bump_table_version in the same transaction.
+    """
+    version = None
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (VERSIONS_TABLE,)).fetchone():
+        row = conn.execute(f'SELECT version FROM {VERSIONS_TABLE} WHERE name = ?', (table_name,)).fetchone()
+        version = row and row[0]
+    kind, sql = conn.execute('SELECT type, sql FROM sqlite_master WHERE name = ?', (table_name,)).fetchone()
+    last_row = conn.execute(f'SELECT MAX(rowid) FROM "{table_name}"').fetchone()[0] if kind == 'table' else None
+    return f'{version}:{last_row}:{sql}'
+
+
+def cache_key(conn, query, params = None):
+    """Returns (hash of the normalized query and its parameters, hash of the versions of its source tables)"""
+    text = normalize_sql(query) + '\0' + repr(params)
+    versions = '\0'.join(f'{name}={table_version(conn, name)}' for name in source_tables(conn, query))
+    return hashlib.sha256(text.encode()).hexdigest()[:24], hashlib.sha256(versions.encode()).hexdigest()[:16]
+
+
+def _write(df, path):
+    if FORMAT == 'feather':
+        df.to_feather(path)
+    else:
+        df.to_pickle(path)
+
+
+def _read(path):
+    if path.endswith('.feather'):
+        return pd.read_feather(path)
+    return pd.read_pickle(path)
+
+
+def evict(cache_dir = DEFAULT_CACHE_DIR, max_bytes = DEFAULT_MAX_BYTES):
+    """Deletes the least recently used results until the cache fits in max_bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        stat = os.stat(path)
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        logging.debug(f'Query cache: evicted {path}')
+
+
+def cached_read_sql(query, conn, params = None, cache_dir = DEFAULT_CACHE_DIR, max_bytes = DEFAULT_MAX_BYTES):
+    """pd.read_sql_query with an on-disk result cache
+
+    Results are keyed by the normalized query and the data versions of the tables it reads, so
+    re-ingesting a table invalidates every cached query over it. A hit refreshes the entry's
+    modification time, which is what the LRU eviction goes by.
+    """
+    with measure('query', short_name(query), conn) as record:
+        df = _cached_read_sql(query, conn, params, cache_dir, max_bytes, record)
+        record['rows_out'] = len(df)
+    return df
+
+
+def _cached_read_sql(query, conn, params, cache_dir, max_bytes, record):
+    start = time.time()
+    os.makedirs(cache_dir, exist_ok = True)
+    query_hash, version_hash = cache_key(conn, query, params)
+    path = os.path.join(cache_dir, f'{query_hash}-{version_hash}.{FORMAT}')
+
+    if os.path.exists(path):
+        df = _read(path)
+        os.utime(path)
+        record['result_cache'] = 'hit'
+        logging.info(f'Query cache hit {query_hash} ({len(df)} rows in {time.time() - start:.3f} seconds)')
+        return df
+
+    record['result_cache'] = 'miss'
+    df = pd.read_sql_query(query, conn, params = params)
+    # Results of the same query over older data can never be hit again
+    for name in os.listdir(cache_dir):
+        if name.startswith(query_hash + '-'):
+            os.remove(os.path.join(cache_dir, name))
+    try:
+        # Written under a temporary name first so a reader never sees a half-written file
+        _write(df, path + '.tmp')
+        os.replace(path + '.tmp', path)
+    except Exception as e:  # e.g. a column arrow cannot store; the result is still returned
+        logging.warning(f'Query cache: could not store {query_hash}: {e!r}')
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+    evict(cache_dir, max_bytes)
+    logging.info(f'Query cache miss {query_hash} ({len(df)} rows in {time.time() - start:.3f} seconds)')
+    return df
+
+
+def clear_cache(cache_dir = DEFAULT_CACHE_DIR):
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
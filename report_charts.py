@@ -0,0 +1,322 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis_context import AnalysisContext
+from db_connection import writer_connection
+from distribution_summary import load_distribution_summary
+from rollups import ensure_rollups, top_n, purchase_contribution, brand_margin_vs_sales
+
+DEFAULT_OUTPUT_DIR = 'reports'
+
+# Largest number of raw points a chart is drawn from; bigger inputs are binned or sampled
+POINT_BUDGET = 50_000
+
+
+def downsample(df, budget = POINT_BUDGET, seed = 0):
+    """Uniform random sample of at most budget rows (the rows keep their order)"""
+    if len(df) <= budget:
+        return df
+    rng = np.random.default_rng(seed)
+    return df.iloc[np.sort(rng.choice(len(df), budget, replace = False))]
+
+
+def hist_data(values, bins = 30, budget = POINT_BUDGET):
+    """Bin counts over all the values plus a sample for the KDE curve"""
+    values = pd.Series(values, dtype = 'float64').replace([np.inf, -np.inf], np.nan).dropna().to_numpy()
+    counts, edges = np.histogram(values, bins = bins) if len(values) else (np.zeros(bins), np.linspace(0, 1, bins + 1))
+    return {'counts': counts, 'edges': edges, 'n': len(values), 'sample': downsample(pd.Series(values), budget).to_numpy()}
+
+
+def density_data(df, x, y, bins = 100):
+    """2-D bin counts of a point cloud, drawn instead of the points when there are too many of them"""
+    points = df[[x, y]].replace([np.inf, -np.inf], np.nan).dropna()
+    counts, x_edges, y_edges = np.histogram2d(points[x], points[y], bins = bins)
+    return {'counts': counts, 'x_edges': x_edges, 'y_edges': y_edges}
+
+
+def box_data(values, budget = POINT_BUDGET, label = ''):
+    """Five-number summary of all the values, with at most budget outliers drawn"""
+    from matplotlib.cbook import boxplot_stats
+    values = pd.Series(values, dtype = 'float64').replace([np.inf, -np.inf], np.nan).dropna()
+    if not len(values):
+        values = pd.Series([np.nan])
+    stats = boxplot_stats(values.to_numpy(), labels = [label])[0]
+    stats['fliers'] = downsample(pd.Series(stats['fliers']), budget).to_numpy()
+    return stats
+
+
+def t_interval(values, confidence = 0.95):
+    """Mean with a t-based confidence interval, as in visualanalysis.confidence_interval"""
+    from scipy import stats
+    values = np.asarray(values, dtype = 'float64')
+    mean = values.mean()
+    margin = stats.t.ppf((1 + confidence) / 2, df = len(values) - 1) * values.std(ddof = 1) / np.sqrt(len(values))
+    return mean, mean - margin, mean + margin
+
+
+def build_specs(ctx, conn, budget = POINT_BUDGET, table_name = 'final_summary_table'):
+    """Builds the data of every visualanalysis.py chart; the specs are small enough to ship to worker processes
+
+    The distribution and box plots are drawn from the stored distribution summary of the table.
+    """
+    df = ctx.df
+    numerical_columns = list(df.select_dtypes(include = np.number).columns)[:16]
+    distributions = load_distribution_summary(conn, table_name)
+    specs = [
+        {'name': 'distributions', 'kind': 'hist_grid',
+         'panels': {col: distributions[col] for col in numerical_columns}},
+        {'name': 'boxplots', 'kind': 'box_grid',
+         'panels': {col: distributions[col]['box'] for col in numerical_columns}},
+        {'name': 'category_frequency', 'kind': 'counts',
+         'panels': {col: ctx.value_counts(col, 'consistent').head(10) for col in ['VendorName', 'Description']}},
+        {'name': 'correlation_heatmap', 'kind': 'heatmap',
+         'matrix': ctx.view('consistent', numerical_columns).corr()},
+    ]
+
+    brands = brand_margin_vs_sales(conn, 'consistent', table_name)
+    brands = brands[brands['TotalSalesDollars'] < 10000]
+    low_sales = brands['TotalSalesDollars'].quantile(0.15)
+    high_margin = brands['ProfitMargin'].quantile(0.85)
+    targets = brands[(brands['TotalSalesDollars'] <= low_sales) & (brands['ProfitMargin'] >= high_margin)]
+    specs.append({'name': 'brand_targets', 'kind': 'scatter',
+                  'points': brands if len(brands) <= budget else None,
+                  'density': density_data(brands, 'TotalSalesDollars', 'ProfitMargin') if len(brands) > budget else None,
+                  'highlight': downsample(targets, budget), 'x': 'TotalSalesDollars', 'y': 'ProfitMargin',
+                  'hlines': [high_margin], 'vlines': [low_sales]})
+
+    specs.append({'name': 'top_sales', 'kind': 'top_bars',
+                  'panels': {'Vendors': top_n(conn, 'vendor', 'TotalSalesDollarsSum', 10, 'consistent', source = table_name),
+                             'Brands': top_n(conn, 'brand', 'TotalSalesDollarsSum', 10, 'consistent', source = table_name)}})
+    top_vendors = purchase_contribution(conn, 10, 'consistent', table_name)
+    top_vendors['Cumulative_Contri'] = top_vendors['PurchaseContribution'].cumsum()
+    specs.append({'name': 'pareto', 'kind': 'pareto', 'vendors': top_vendors})
+    specs.append({'name': 'procurement_donut', 'kind': 'donut', 'vendors': top_vendors})
+
+    quantity = ctx.column('TotalPurchaseQuantity', 'consistent')
+    unit_price = ctx.column('TotalPurchaseDollars', 'consistent') / quantity
+    order_size = pd.qcut(quantity, q = 3, labels = ['Small', 'Medium', 'Large'])
+    specs.append({'name': 'unit_price_by_order_size', 'kind': 'box_groups',
+                  'groups': [box_data(unit_price[order_size == size], budget, size) for size in order_size.cat.categories]})
+
+    sales = ctx.column('TotalSalesDollars', 'consistent')
+    margin = ctx.column('ProfitMargin', 'consistent')
+    top = margin[sales >= sales.quantile(0.75)].dropna()
+    bottom = margin[sales <= sales.quantile(0.25)].dropna()
+    specs.append({'name': 'margin_confidence_intervals', 'kind': 'ci_hist',
+                  'groups': {'Top vendors': (hist_data(top, budget = budget), t_interval(top), 'blue'),
+                             'Low vendors': (hist_data(bottom, budget = budget), t_interval(bottom), 'red')}})
+    return specs
+
+
+def _draw_hist(ax, data, color = None, label = None, alpha = 0.5):
+    edges, counts = data['edges'], data['counts']
+    ax.stairs(counts, edges, fill = True, alpha = alpha, color = color, label = label)
+    # The density is scaled to counts per bin, as seaborn's histplot(kde=True) does
+    scale = data['n'] * (edges[1] - edges[0])
+    if data.get('kde_density') is not None:
+        ax.plot(data['kde_x'], data['kde_density'] * scale, color = color)
+        return
+    sample = data.get('sample', [])
+    if len(sample) > 1 and np.ptp(sample) > 0:
+        from scipy.stats import gaussian_kde
+        grid = np.linspace(edges[0], edges[-1], 200)
+        ax.plot(grid, gaussian_kde(sample)(grid) * scale, color = color)
+
+
+def _render_hist_grid(plt, sns, spec):
+    fig = plt.figure(figsize = (15, 10))
+    for i, (col, data) in enumerate(spec['panels'].items()):
+        ax = fig.add_subplot(4, 4, i + 1)
+        _draw_hist(ax, data, alpha = 0.6)
+        ax.set_title(f'Distribution of {col}')
+        ax.set_xlabel(col)
+        ax.set_ylabel('Frequency')
+    return fig
+
+
+def _render_box_grid(plt, sns, spec):
+    fig = plt.figure(figsize = (15, 10))
+    for i, (col, stats) in enumerate(spec['panels'].items()):
+        ax = fig.add_subplot(4, 4, i + 1)
+        ax.bxp([stats])
+        ax.set_title(f'Distribution of {col}')
+        ax.set_xlabel(col)
+    return fig
+
+
+def _render_counts(plt, sns, spec):
+    fig = plt.figure(figsize = (12, 5))
+    for i, (col, counts) in enumerate(spec['panels'].items()):
+        ax = fig.add_subplot(1, 2, i + 1)
+        sns.barplot(x = counts.values, y = counts.index.astype(str), ax = ax)
+        ax.set_title(f'Frequency of {col}')
+        ax.set_xlabel('count')
+    return fig
+
+
+def _render_heatmap(plt, sns, spec):
+    fig, ax = plt.subplots(figsize = (12, 8))
+    sns.heatmap(spec['matrix'], annot = True, fmt = '.2f', cmap = 'coolwarm', linewidths = 0.5, ax = ax)
+    ax.set_title('Correlation Heatmap')
+    return fig
+
+
+def _render_scatter(plt, sns, spec):
+    fig, ax = plt.subplots(figsize = (10, 6))
+    x, y = spec['x'], spec['y']
+    if spec['density'] is not None:
+        # Too many points to draw one by one: their binned density on a log scale instead
+        from matplotlib.colors import LogNorm
+        density = spec['density']
+        counts = np.ma.masked_equal(density['counts'].T, 0)
+        ax.pcolormesh(density['x_edges'], density['y_edges'], counts, cmap = 'Purples', norm = LogNorm())
+    else:
+        ax.scatter(spec['points'][x], spec['points'][y], color = 'purple', alpha = 0.2, label = 'All Brands')
+    ax.scatter(spec['highlight'][x], spec['highlight'][y], color = 'red', label = 'Target Brands')
+    for value in spec['hlines']:
+        ax.axhline(value, color = 'green', linestyle = '--', label = 'High Margin Threshold')
+    for value in spec['vlines']:
+        ax.axvline(value, color = 'green', linestyle = '--', label = 'Low Sales Threshold')
+    ax.set_title('Brands for Promotional or Pricing Adjustments')
+    ax.set_xlabel('Total Sales Dollars ($)')
+    ax.set_ylabel('Profit Margin (%)')
+    ax.legend()
+    ax.grid(True)
+    return fig
+
+
+def _render_top_bars(plt, sns, spec):
+    fig = plt.figure(figsize = (15, 5))
+    for i, (label, totals) in enumerate(spec['panels'].items()):
+        ax = fig.add_subplot(1, 2, i + 1)
+        sns.barplot(y = totals.index.astype(str), x = totals.values, hue = totals.index.astype(str), legend = False,
+                    ax = ax, palette = 'viridis' if i == 0 else 'plasma')
+        ax.set_title(f'Top 10 {label} by Total Sales Dollars')
+    fig.tight_layout()
+    return fig
+
+
+def _render_pareto(plt, sns, spec):
+    vendors = spec['vendors']
+    fig, ax1 = plt.subplots(figsize = (10, 6))
+    sns.barplot(x = vendors['VendorName'], y = vendors['PurchaseContribution'], hue = vendors['VendorName'], legend = False,
+                palette = 'mako', ax = ax1)
+    ax2 = ax1.twinx()
+    ax2.plot(vendors['VendorName'], vendors['Cumulative_Contri'], color = 'red', marker = 'o',
+             label = 'Cumulative Contribution', linewidth = 2, linestyle = '--')
+    ax1.tick_params(axis = 'x', rotation = 45)
+    ax1.set_ylabel('Purchase Contribution (%)', color = 'red')
+    ax2.set_ylabel('Cumulative Contribution (%)', color = 'blue')
+    ax1.set_xlabel('Vendor Name')
+    ax1.set_title('Pareto Chart :Vendor Purchase Contribution and Cumulative Contribution')
+    ax2.axhline(y = 100, color = 'gray', linestyle = '--', alpha = 0.7)
+    ax2.legend(loc = 'upper right')
+    return fig
+
+
+def _render_donut(plt, sns, spec):
+    vendors = list(spec['vendors']['VendorName']) + ['Other Vendors']
+    total = spec['vendors']['PurchaseContribution'].sum()
+    contributions = list(spec['vendors']['PurchaseContribution']) + [100 - total]
+    fig, ax = plt.subplots(figsize = (8, 8))
+    ax.pie(contributions, labels = vendors, autopct = '%1.1f%%', startangle = 140,
+           colors = sns.color_palette('pastel', len(vendors)))
+    ax.add_artist(plt.Circle((0, 0), 0.70, color = 'white'))
+    ax.text(0, 0, f'Total Contribution: {total:.2f}%', ha = 'center', va = 'center', fontsize = 14, fontweight = 'bold')
+    ax.set_title(' Top 10 Vendor Procurement Cost Contribution')
+    return fig
+
+
+def _render_box_groups(plt, sns, spec):
+    fig, ax = plt.subplots(figsize = (10, 6))
+    ax.bxp(spec['groups'])
+    ax.set_title('Unit Price by Order Size')
+    ax.set_xlabel('Order Size')
+    ax.set_ylabel('Unit Price ($)')
+    ax.grid(True)
+    return fig
+
+
+def _render_ci_hist(plt, sns, spec):
+    fig, ax = plt.subplots(figsize = (12, 6))
+    for label, (data, (mean, lower, upper), color) in spec['groups'].items():
+        _draw_hist(ax, data, color = color, label = label)
+        ax.axvline(lower, color = color, linestyle = '--', label = f'{label} Lower: {lower:.2f}')
+        ax.axvline(upper, color = color, linestyle = '--', label = f'{label} Upper: {upper:.2f}')
+        ax.axvline(mean, color = color, linestyle = '-', label = f'{label} Mean: {mean:.2f}')
+    ax.set_title('Confidence Interval Comparison: Top vs. Low Vendors (Profit Margin)')
+    ax.set_xlabel('Profit Margin (%)')
+    ax.set_ylabel('Frequency')
+    ax.legend()
+    ax.grid(True)
+    return fig
+
+
+RENDERERS = {
+    'hist_grid': _render_hist_grid,
+    'box_grid': _render_box_grid,
+    'counts': _render_counts,
+    'heatmap': _render_heatmap,
+    'scatter': _render_scatter,
+    'top_bars': _render_top_bars,
+    'pareto': _render_pareto,
+    'donut': _render_donut,
+    'box_groups': _render_box_groups,
+    'ci_hist': _render_ci_hist,
+}
+
+
+def render_spec(spec, output_dir = DEFAULT_OUTPUT_DIR, formats = ('png',)):
+    """Draws one figure with the non-interactive Agg backend and saves it; returns the file paths"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig = RENDERERS[spec['kind']](plt, sns, spec)
+    fig.tight_layout()
+    paths = []
+    for fmt in formats:
+        path = os.path.join(output_dir, f'{spec["name"]}.{fmt}')
+        fig.savefig(path, format = fmt, dpi = 100)
+        paths.append(path)
+    plt.close(fig)
+    return paths
+
+
+def render_report(specs, output_dir = DEFAULT_OUTPUT_DIR, formats = ('png',), workers = None, mp_context = None):
+    """Renders the figures concurrently in a process pool; returns {figure name: file paths}
+
+    mp_context selects how the workers start, e.g. a spawn context when the caller runs threads.
+    """
+    start = time.time()
+    os.makedirs(output_dir, exist_ok = True)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers = min(workers, len(specs)), mp_context = mp_context) as pool:
+        paths = list(pool.map(render_spec, specs, [output_dir] * len(specs), [tuple(formats)] * len(specs)))
+    logging.info(f'{len(specs)} charts rendered to {output_dir} in {time.time() - start:.2f} seconds')
+    return {spec['name']: spec_paths for spec, spec_paths in zip(specs, paths)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Render the visualanalysis.py charts headless')
+    parser.add_argument('--db', default = None, help = 'database path, by default the configured one')
+    parser.add_argument('--table', default = 'final_summary_table')
+    parser.add_argument('--output-dir', default = DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--formats', nargs = '+', default = ['png'], choices = ['png', 'svg'])
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--point-budget', type = int, default = POINT_BUDGET)
+    args = parser.parse_args()
+
+    conn = writer_connection(args.db)
+    ensure_rollups(conn, args.table)
+    specs = build_specs(AnalysisContext(conn, args.table), conn, args.point_budget, args.table)
+    conn.close()
+    for name, paths in render_report(specs, args.output_dir, args.formats, args.workers).items():
+        print(f'{name}: {", ".join(paths)}')
@@ -0,0 +1,173 @@
+import argparse
+import logging
+import time
+
+import pandas as pd
+
+from bulk_insert import bump_table_version, table_exists
+from db_connection import writer_connection
+from query_cache import table_version
+
+# Rollup tables and the summary column each one groups by
+LEVELS = {
+    'vendor': ('vendor_rollup', 'VendorName'),
+    'brand': ('brand_rollup', 'Description'),
+}
+
+# Metrics rolled up with a sum, a count of non-NULL values and a sum of squares, which give
+# totals, means and variances without going back to the summary rows
+METRICS = {
+    'TotalSalesDollars': 'TotalSalesDollars',
+    'TotalPurchaseDollars': 'TotalPurchaseDollars',
+    'GrossProfit': 'GrossProfit',
+    'ProfitMargin': 'ProfitMargin',
+    'StockTurnover': 'StockTurnover',
+    'UnsoldInventoryValue': '(TotalPurchaseQuantity - TotalSalesQuantity) * PurchasePrice',
+}
+
+# Each rollup is computed for every segment of the summary rows
+SEGMENTS = {
+    'all': 'true',
+    # The rows visualanalysis.py analyses
+    'consistent': 'GrossProfit > 0 AND ProfitMargin > 0 AND TotalSalesQuantity > 0',
+}
+
+# Columns that are ranked on, each gets an index
+RANKED = ['TotalSalesDollarsSum', 'TotalPurchaseDollarsSum', 'UnsoldInventoryValueSum', 'StockTurnoverMean']
+
+META_TABLE = 'rollup_meta'
+
+
+def rollup_select(source, key, segment):
+    columns = [f"'{source}' AS Source", f"'{segment}' AS Segment", key, 'COUNT(*) AS RowCount']
+    for name, expression in METRICS.items():
+        columns += [f'SUM({expression}) AS {name}Sum',
+                    f'COUNT({expression}) AS {name}Count',
+                    f'SUM(({expression}) * ({expression})) AS {name}SumSq']
+    columns += ['AVG(StockTurnover) AS StockTurnoverMean',
+                # Slow-moving rows (turnover below 1) for the low-turnover vendor question
+                'SUM(StockTurnover < 1) AS SlowMovingCount',
+                'SUM(CASE WHEN StockTurnover < 1 THEN StockTurnover END) AS SlowMovingTurnoverSum']
+    return (f'SELECT {", ".join(columns)} FROM {source} '
+            f'WHERE {SEGMENTS[segment]} AND {key} IS NOT NULL GROUP BY {key}')
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _drop_unkeyed(conn):
+    """Drops rollup tables from before the rows were keyed by their source table"""
+    for table, _ in LEVELS.values():
+        if table_exists(conn, table) and 'Source' not in _columns(conn, table):
+            conn.execute(f'DROP TABLE {table}')
+    # The metadata is keyed by (name, source) now, it used to be keyed by name alone
+    if table_exists(conn, META_TABLE) and [row[5] for row in conn.execute(f'PRAGMA table_info({META_TABLE})')][:2] != [1, 2]:
+        conn.execute(f'DROP TABLE {META_TABLE}')
+
+
+def build_rollups(conn, source = 'vendor_summary'):
+    """Materializes the vendor and brand rollups of a summary table, with indexes on the ranking columns
+
+    The rows of every source table are kept apart (the Source column), so rolling up one summary
+    table leaves the rollups of the others alone. Runs in one transaction after the summary table
+    is built. Returns {rollup table: rows of this source}.
+    """
+    start = time.time()
+    rows = {}
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN')
+    _drop_unkeyed(conn)
+    for table, key in LEVELS.values():
+        selects = ' UNION ALL '.join(rollup_select(source, key, segment) for segment in SEGMENTS)
+        if table_exists(conn, table):
+            conn.execute(f'DELETE FROM {table} WHERE Source = ?', (source,))
+            conn.execute(f'INSERT INTO {table} {selects}')
+        else:
+            conn.execute(f'CREATE TABLE {table} AS {selects}')
+            conn.execute(f'CREATE UNIQUE INDEX idx_{table}_key ON {table} (Source, Segment, {key})')
+            for col in RANKED:
+                conn.execute(f'CREATE INDEX idx_{table}_{col} ON {table} (Source, Segment, {col}, {key})')
+        bump_table_version(conn, table)
+        rows[table] = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE Source = ?', (source,)).fetchone()[0]
+
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {META_TABLE} '
+                 f'(name TEXT, source TEXT, source_version TEXT, PRIMARY KEY (name, source))')
+    conn.executemany(f'INSERT OR REPLACE INTO {META_TABLE} VALUES (?, ?, ?)',
+                     [(table, source, table_version(conn, source)) for table, _ in LEVELS.values()])
+    conn.commit()
+    logging.info(f'Rollups of {source} built in {time.time() - start:.2f} seconds: {rows}')
+    return rows
+
+
+def rollups_current(conn, source = 'vendor_summary'):
+    """Whether the rollups of a source table exist and were built from its current data version"""
+    if not table_exists(conn, META_TABLE):
+        return False
+    versions = conn.execute(f'SELECT source_version FROM {META_TABLE} WHERE source = ?', (source,)).fetchall()
+    return len(versions) == len(LEVELS) and all(version == table_version(conn, source) for version, in versions) \
+        and all(table_exists(conn, table) and 'Source' in _columns(conn, table) for table, _ in LEVELS.values())
+
+
+def ensure_rollups(conn, source = 'vendor_summary'):
+    """Builds the rollups of a source table unless they are already up to date with it"""
+    if rollups_current(conn, source):
+        return False
+    build_rollups(conn, source)
+    return True
+
+
+def require_rollups(conn, source = 'vendor_summary'):
+    """Raises a RuntimeError unless the rollups of source are up to date; for read-only connections"""
+    if not rollups_current(conn, source):
+        raise RuntimeError(f'The rollups of {source} are missing or out of date; '
+                           f'build them with: python rollups.py --source {source}')
+
+
+def top_n(conn, level, metric, n = 10, segment = 'all', ascending = False, source = 'vendor_summary'):
+    """Ranks the vendors or brands by a rollup column with an indexed lookup; returns a Series"""
+    table, key = LEVELS[level]
+    order = 'ASC' if ascending else 'DESC'
+    limit = '' if n is None else f'LIMIT {int(n)}'
+    df = pd.read_sql_query(f'SELECT {key}, {metric} FROM {table} WHERE Source = ? AND Segment = ? '
+                           f'AND {metric} IS NOT NULL ORDER BY {metric} {order}, {key} {limit}',
+                           conn, params = (source, segment))
+    return df.set_index(key)[metric]
+
+
+def purchase_contribution(conn, n = 10, segment = 'all', source = 'vendor_summary'):
+    """Top vendors by purchase dollars with their share of all purchase dollars (the Pareto chart data)"""
+    total = conn.execute('SELECT SUM(TotalPurchaseDollarsSum) FROM vendor_rollup WHERE Source = ? AND Segment = ?',
+                         (source, segment)).fetchone()[0]
+    df = pd.read_sql_query(f"""
+        SELECT VendorName, TotalPurchaseDollarsSum AS TotalPurchaseDollars, GrossProfitSum AS GrossProfit,
+               TotalSalesDollarsSum AS TotalSalesDollars
+        FROM vendor_rollup WHERE Source = ? AND Segment = ?
+        ORDER BY TotalPurchaseDollarsSum DESC, VendorName LIMIT {int(n)}""", conn, params = (source, segment))
+    df['PurchaseContribution'] = df['TotalPurchaseDollars'] / total * 100
+    return df
+
+
+def low_turnover_vendors(conn, n = 10, segment = 'all', source = 'vendor_summary'):
+    """Vendors with the lowest mean turnover over their slow-moving (turnover below 1) rows"""
+    return pd.read_sql_query(f"""
+        SELECT VendorName, SlowMovingTurnoverSum / SlowMovingCount AS StockTurnover
+        FROM vendor_rollup WHERE Source = ? AND Segment = ? AND SlowMovingCount > 0
+        ORDER BY StockTurnover, VendorName LIMIT {int(n)}""", conn, params = (source, segment)).set_index('VendorName')
+
+
+def brand_margin_vs_sales(conn, segment = 'all', source = 'vendor_summary'):
+    """Total sales and mean profit margin of every brand"""
+    return pd.read_sql_query("""
+        SELECT Description, TotalSalesDollarsSum AS TotalSalesDollars,
+               ProfitMarginSum / ProfitMarginCount AS ProfitMargin
+        FROM brand_rollup WHERE Source = ? AND Segment = ?
+        ORDER BY Description""", conn, params = (source, segment))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Build the vendor and brand rollups of a summary table')
+    parser.add_argument('--source', default = 'vendor_summary')
+    args = parser.parse_args()
+    build_rollups(writer_connection(), args.source)
@@ -0,0 +1,203 @@
+import logging
+import time
+
+import pandas as pd
+
+from bulk_insert import bulk_insert, insert_rows, table_exists
+from db_connection import writer_connection
+from rollups import build_rollups
+from get_summary_table import SUMMARY_ORDER_BY, clean_data_vectorized, summary_column_types
+
+# Additive aggregates behind vendor_summary. Each one is keyed like the matching CTE of
+# VENDOR_SUMMARY_QUERY and stores sums plus a row count, so new rows can be folded in
+# without rereading the history.
+AGGREGATES = {
+    'purchases': {
+        'table': 'agg_purchases',
+        'keys': ['VendorNumber', 'VendorName', 'Brand', 'Description', 'PurchasePrice'],
+        'sums': {'TotalQuantity': 'Quantity', 'TotalDollars': 'Dollars'},
+    },
+    'sales': {
+        'table': 'agg_sales',
+        'keys': ['VendorNo', 'Brand'],
+        'sums': {'TotalSalesQuantity': 'SalesQuantity', 'TotalSalesDollars': 'SalesDollars',
+                 'TotalSalesPrice': 'SalesPrice', 'TotalExciseTax': 'ExciseTax'},
+    },
+    'vendor_invoice': {
+        'table': 'agg_freight',
+        'keys': ['VendorNumber'],
+        'sums': {'FreightCost': 'Freight'},
+    },
+}
+
+# Same columns as VENDOR_SUMMARY_QUERY, computed from the aggregates instead of the raw tables.
+# purchase_prices is tiny, it is grouped with a multiplicity so duplicate price rows weigh in
+# the same way they do in the raw join. The query orders its rows like VENDOR_SUMMARY_QUERY, so
+# a full rebuild stores them in that order; a refresh appends the rewritten rows at the end.
+SUMMARY_FROM_AGGREGATES = """
+    SELECT * FROM (
+    SELECT
+        p.VendorNumber,
+        p.VendorName,
+        p.Brand,
+        p.Description,
+        p.PurchasePrice,
+        pp.Price AS ActualPrice,
+        pp.Volume,
+        p.TotalQuantity * pp.n AS TotalPurchaseQuantity,
+        p.TotalDollars * pp.n AS TotalPurchaseDollars,
+        s.TotalSalesQuantity,
+        s.TotalSalesDollars,
+        s.TotalSalesPrice,
+        s.TotalExciseTax,
+        f.FreightCost
+    FROM agg_purchases p
+    JOIN (
+        SELECT VendorNumber, Brand, Price, Volume, COUNT(*) AS n
+        FROM purchase_prices
+        GROUP BY VendorNumber, Brand, Price, Volume
+    ) pp
+        ON p.VendorNumber = pp.VendorNumber
+        AND p.Brand = pp.Brand
+    LEFT JOIN agg_sales s
+        ON p.VendorNumber = s.VendorNo
+        AND p.Brand = s.Brand
+    LEFT JOIN agg_freight f
+        ON p.VendorNumber = f.VendorNumber
+    {where}
+    )
+    ORDER BY {order_by}
+"""
+
+TOUCHED_FILTER = """
+    WHERE ({prefix}VendorNumber, {prefix}Brand) IN (SELECT VendorNumber, Brand FROM temp.touched_keys)
+    OR {prefix}VendorNumber IN (SELECT VendorNumber FROM temp.touched_vendors)
+"""
+
+
+def _aggregate_select(source, spec, where = ''):
+    keys = ', '.join(spec['keys'])
+    sums = ', '.join(f'SUM({col})' for col in spec['sums'].values())
+    return f'SELECT {keys}, {sums}, COUNT(*) FROM {source} {where} GROUP BY {keys}'
+
+
+def rebuild_aggregates(conn):
+    """Recomputes every aggregate table from the full raw tables"""
+    for source, spec in AGGREGATES.items():
+        columns = ', '.join(spec['keys'] + list(spec['sums']) + ['RowCount'])
+        conn.execute(f'DROP TABLE IF EXISTS {spec["table"]}')
+        conn.execute(f'CREATE TABLE {spec["table"]} ({columns}, PRIMARY KEY ({", ".join(spec["keys"])}))')
+        conn.execute(f'INSERT INTO {spec["table"]} {_aggregate_select(source, spec)}')
+    conn.commit()
+
+
+def _create_touched_tables(conn):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS touched_keys (VendorNumber, Brand, PRIMARY KEY (VendorNumber, Brand))')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS touched_vendors (VendorNumber PRIMARY KEY)')
+    conn.execute('DELETE FROM temp.touched_keys')
+    conn.execute('DELETE FROM temp.touched_vendors')
+
+
+def touch_price_keys(conn, first_rowid):
+    """Records the keys of the purchase_prices rows from first_rowid on; purchase_prices has no aggregate,
+    it is joined from the raw table, so only the summary rows of those keys need rewriting"""
+    conn.execute('INSERT OR IGNORE INTO temp.touched_keys SELECT DISTINCT VendorNumber, Brand FROM purchase_prices '
+                 f'WHERE rowid >= {int(first_rowid)}')
+
+
+def apply_delta(conn, source, first_rowid):
+    """Folds the rows of a raw table from first_rowid on into its aggregate and records the touched keys"""
+    spec = AGGREGATES[source]
+    delta = f'WHERE rowid >= {int(first_rowid)}'
+    if source == 'vendor_invoice':
+        # Freight is per vendor, so every brand of the vendor needs a refresh
+        conn.execute(f'INSERT OR IGNORE INTO temp.touched_vendors SELECT DISTINCT VendorNumber FROM {source} {delta}')
+    else:
+        vendor_col = spec['keys'][0]
+        conn.execute(f'INSERT OR IGNORE INTO temp.touched_keys SELECT DISTINCT {vendor_col}, Brand FROM {source} {delta}')
+
+    columns = spec['keys'] + list(spec['sums']) + ['RowCount']
+    # A SUM over only NULLs is NULL, so NULL + x keeps x instead of turning into NULL
+    updates = ', '.join(f'{col} = COALESCE({col} + excluded.{col}, {col}, excluded.{col})'
+                        for col in list(spec['sums']) + ['RowCount'])
+    conn.execute(f"""
+        INSERT INTO {spec['table']} ({', '.join(columns)})
+        SELECT * FROM ({_aggregate_select(source, spec, delta)}) WHERE true
+        ON CONFLICT ({', '.join(spec['keys'])}) DO UPDATE SET {updates}
+    """)
+
+
+def summary_from_aggregates(conn, touched_only = False):
+    """Builds the cleaned summary rows (all of them, or only the touched keys) from the aggregates"""
+    query = SUMMARY_FROM_AGGREGATES.format(where = TOUCHED_FILTER.format(prefix = 'p.') if touched_only else '',
+                                           order_by = SUMMARY_ORDER_BY.format(prefix = ''))
+    return clean_data_vectorized(pd.read_sql_query(query, conn))
+
+
+def write_summary(conn):
+    """Rebuilds the whole vendor_summary table from the aggregates"""
+    summary = summary_from_aggregates(conn)
+    bulk_insert(summary, 'vendor_summary', conn, if_exists = 'replace', column_types = summary_column_types(summary.columns))
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_vendor_summary_vendor_brand ON vendor_summary (VendorNumber, Brand)')
+    conn.commit()
+    return len(summary)
+
+
+def full_refresh(conn):
+    """Rebuilds the aggregates and the whole vendor_summary table"""
+    rebuild_aggregates(conn)
+    return write_summary(conn)
+
+
+def refresh_vendor_summary(conn, deltas):
+    """Brings vendor_summary up to date with the deltas reported by load_raw_data_incremental
+
+    Appended rows only touch the aggregates and summary rows of their own (vendor, brand) keys
+    (appended purchase_prices rows only the summary rows); a rewritten source table, or missing
+    aggregates, fall back to a full refresh. Returns the number of summary rows rewritten.
+
+    The rewritten rows are deleted and appended, so after a refresh the table is no longer
+    stored in SUMMARY_ORDER_BY order; readers that need the order must ORDER BY it. Re-sorting
+    would rewrite the whole table and make the refresh cost scale with the history again.
+    """
+    start = time.time()
+    sources = ['purchase_prices'] + list(AGGREGATES)
+    actions = {table: deltas.get(table, {}).get('action', 'skip') for table in sources}
+    ready = all(table_exists(conn, name) for name in
+                ['vendor_summary'] + [spec['table'] for spec in AGGREGATES.values()])
+
+    if not ready or any(action == 'rebuild' for action in actions.values()):
+        rows = full_refresh(conn)
+        build_rollups(conn)
+        logging.info(f'vendor_summary fully refreshed: {rows} rows in {time.time() - start:.2f} seconds')
+        return rows
+
+    appended = [table for table in sources if actions[table] == 'append']
+    if not appended:
+        logging.info('vendor_summary is up to date')
+        return 0
+
+    # The aggregates and the touched summary rows change in one transaction
+    _create_touched_tables(conn)
+    for source in appended:
+        if source == 'purchase_prices':
+            touch_price_keys(conn, deltas[source]['first_rowid'])
+        else:
+            apply_delta(conn, source, deltas[source]['first_rowid'])
+    summary = summary_from_aggregates(conn, touched_only = True)
+    conn.execute('DELETE FROM vendor_summary ' + TOUCHED_FILTER.format(prefix = ''))
+    insert_rows(conn, summary, 'vendor_summary')
+    conn.commit()
+    build_rollups(conn)
+
+    logging.info(f'vendor_summary refreshed for {len(summary)} rows in {time.time() - start:.2f} seconds')
+    return len(summary)
+
+
+if __name__ == "__main__":
+    from incremental_ingest import load_raw_data_incremental
+
+    deltas = load_raw_data_incremental()
+    conn = writer_connection()
+    refresh_vendor_summary(conn, deltas)
+    conn.close()
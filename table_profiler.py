@@ -0,0 +1,190 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bulk_insert import VERSIONS_TABLE, bulk_insert, sql_type, table_exists
+from db_connection import read_connection, writer_connection
+from query_cache import table_version
+
+PROFILE_TABLE = 'table_profile'
+
+DEFAULT_CHUNKSIZE = 100_000
+
+# HyperLogLog precision: 2**14 registers, about 0.8% standard error on distinct counts
+HLL_PRECISION = 14
+
+
+def _bit_length(x):
+    """Exact bit length of every uint64 in x (a float log2 rounds near powers of two)"""
+    length = np.zeros(x.shape, dtype = 'int64')
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = x >= (np.uint64(1) << np.uint64(shift))
+        length[big] += shift
+        x = np.where(big, x >> np.uint64(shift), x)
+    return length + (x > 0)
+
+
+class HyperLogLog:
+    """Approximate distinct counter over 64-bit hashes, updated with whole arrays"""
+
+    def __init__(self, precision = HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype = 'int64')
+
+    def update(self, hashes):
+        hashes = np.asarray(hashes, dtype = 'uint64')
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype('int64')
+        rest = hashes & ((np.uint64(1) << (np.uint64(64) - p)) - np.uint64(1))
+        # Position of the first 1 bit in the 64 - p low bits
+        rank = (64 - self.precision) - _bit_length(rest) + 1
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out = self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers)
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+def _hash_values(values):
+    """64-bit hashes of a column chunk; numbers are hashed as float64 so that a chunk read as
+    integers and one read as floats agree"""
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        values = values.astype('float64')
+    else:
+        values = values.astype(str)
+    return pd.util.hash_pandas_object(values, index = False).to_numpy()
+
+
+def profile_table(db_path, table_name, chunksize = DEFAULT_CHUNKSIZE):
+    """Profiles every column of a table in one scan on a pooled read-only connection
+
+    Returns one dict per column with the row count, null count, min and max, mean (numeric
+    values only) and the approximate distinct count. Columns without numbers get the min and
+    max of their text, compared as strings, which orders ISO dates by time.
+    """
+    start = time.time()
+    with read_connection(db_path) as conn:
+        version = table_version(conn, table_name)
+        cursor = conn.execute(f'SELECT * FROM "{table_name}"')
+        columns = [col[0] for col in cursor.description]
+        rows = 0
+        stats = {col: {'nulls': 0, 'numeric': 0, 'sum': 0.0, 'min': None, 'max': None,
+                       'text_min': None, 'text_max': None, 'hll': HyperLogLog()}
+                 for col in columns}
+        while True:
+            chunk = cursor.fetchmany(chunksize)
+            if not chunk:
+                break
+            rows += len(chunk)
+            df = pd.DataFrame.from_records(chunk, columns = columns)
+            for col in columns:
+                values, stat = df[col], stats[col]
+                present = values.dropna()
+                stat['nulls'] += len(values) - len(present)
+                if len(present):
+                    stat['hll'].update(_hash_values(present))
+                numbers = present
+                if not pd.api.types.is_numeric_dtype(present.dtype):
+                    numbers = pd.to_numeric(present, errors = 'coerce')
+                    text = present[numbers.isna()].astype(str)
+                    numbers = numbers.dropna()
+                    if len(text):
+                        low, high = text.min(), text.max()
+                        stat['text_min'] = low if stat['text_min'] is None else min(stat['text_min'], low)
+                        stat['text_max'] = high if stat['text_max'] is None else max(stat['text_max'], high)
+                if len(numbers) and pd.api.types.is_numeric_dtype(numbers.dtype):
+                    numbers = numbers.astype('float64')
+                    stat['numeric'] += len(numbers)
+                    stat['sum'] += numbers.sum()
+                    stat['min'] = numbers.min() if stat['min'] is None else min(stat['min'], numbers.min())
+                    stat['max'] = numbers.max() if stat['max'] is None else max(stat['max'], numbers.max())
+
+    profile = [{
+        'TableName': table_name,
+        'ColumnName': col,
+        'RowCount': rows,
+        'NullCount': stat['nulls'],
+        'MinValue': stat['min'] if stat['numeric'] else stat['text_min'],
+        'MaxValue': stat['max'] if stat['numeric'] else stat['text_max'],
+        'MeanValue': stat['sum'] / stat['numeric'] if stat['numeric'] else None,
+        'DistinctCount': stat['hll'].count(),
+        'TableVersion': version,
+    } for col, stat in stats.items()]
+    logging.info(f'{table_name}: {rows} rows profiled in {time.time() - start:.2f} seconds')
+    return profile
+
+
+def database_path(conn):
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+
+def profile_tables(conn, tables = None, workers = None, reuse = True, chunksize = DEFAULT_CHUNKSIZE):
+    """Profiles the tables of the database concurrently and stores the result in table_profile
+
+    Tables whose data version did not change since the stored profile are not scanned again
+    when reuse is set. Returns the profile of all the requested tables.
+    """
+    start = time.time()
+    if tables is None:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT IN (?, ?)",
+            (PROFILE_TABLE, VERSIONS_TABLE))]
+
+    stored = pd.DataFrame()
+    if table_exists(conn, PROFILE_TABLE):
+        stored = pd.read_sql_query(f'SELECT * FROM {PROFILE_TABLE}', conn)
+    current = {table: table_version(conn, table) for table in tables}
+    fresh = set()
+    if reuse and not stored.empty:
+        versions = stored.groupby('TableName')['TableVersion'].first()
+        fresh = {table for table in tables if versions.get(table) == current[table]}
+    stale = [table for table in tables if table not in fresh]
+
+    profiles = []
+    if stale:
+        # The connection's pending writes must be visible to the read-only workers
+        conn.commit()
+        db_path = database_path(conn)
+        # Threads rather than processes: sqlite3 releases the GIL while it steps through rows, and
+        # eda.py, which runs at import time, can call this without being re-run by spawned workers
+        with ThreadPoolExecutor(max_workers = workers or min(len(stale), (os.cpu_count() or 1) + 4)) as pool:
+            for profile in pool.map(profile_table, [db_path] * len(stale), stale, [chunksize] * len(stale)):
+                profiles.extend(profile)
+
+    kept = stored[~stored['TableName'].isin(stale)] if not stored.empty else stored
+    profile = pd.concat([kept, pd.DataFrame(profiles)], ignore_index = True) if profiles else kept
+    if stale:
+        profile['ProfiledAt'] = profile.get('ProfiledAt', pd.Series(index = profile.index, dtype = object))
+        profile.loc[profile['TableName'].isin(stale), 'ProfiledAt'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        # MinValue and MaxValue hold numbers or text; BLOB affinity stores each value as it is
+        column_types = {col: sql_type(dtype) for col, dtype in profile.dtypes.items()}
+        column_types.update({'MinValue': 'BLOB', 'MaxValue': 'BLOB'})
+        bulk_insert(profile, PROFILE_TABLE, conn, if_exists = 'replace', column_types = column_types)
+    logging.info(f'Profiled {len(stale)} tables, reused {len(fresh)}, in {time.time() - start:.2f} seconds')
+    return profile[profile['TableName'].isin(tables)].reset_index(drop = True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Profile every table of the database in one scan each')
+    parser.add_argument('--db', default = None, help = 'database path, by default the configured one')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--no-reuse', action = 'store_true', help = 'profile every table even if it did not change')
+    args = parser.parse_args()
+
+    conn = writer_connection(args.db)
+    print(profile_tables(conn, workers = args.workers, reuse = not args.no_reuse).to_string(index = False))
+    conn.close()
@@ -0,0 +1,71 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from batch_tests import adjust_p_values, compare_groups_vs_rest, welch_from_stats
+
+
+@pytest.fixture
+def conn():
+    rng = np.random.default_rng(0)
+    groups = np.repeat([f'Vendor {i}' for i in range(30)], rng.integers(2, 60, 30))
+    # Margins around a large mean with a small spread, where naive sums of squares cancel
+    margins = 1e6 + rng.normal(0, 1, len(groups)) + (groups == 'Vendor 3') * 2.0
+    df = pd.DataFrame({'VendorName': groups, 'ProfitMargin': margins, 'GrossProfit': 1.0, 'TotalSalesQuantity': 1})
+    df.loc[::17, 'ProfitMargin'] = np.nan
+    conn = sqlite3.connect(':memory:')
+    df.to_sql('final_summary_table', conn, index = False)
+    yield conn
+    conn.close()
+
+
+def test_welch_tests_match_scipy(conn):
+    result = compare_groups_vs_rest(conn, where = None, correction = 'none').set_index('VendorName')
+    df = pd.read_sql_query('SELECT * FROM final_summary_table WHERE ProfitMargin IS NOT NULL', conn)
+    for vendor, row in result.iterrows():
+        inside = df.loc[df['VendorName'] == vendor, 'ProfitMargin']
+        rest = df.loc[df['VendorName'] != vendor, 'ProfitMargin']
+        expected = stats.ttest_ind(inside, rest, equal_var = False)
+        assert row['TStatistic'] == pytest.approx(expected.statistic, rel = 1e-6)
+        assert row['PValue'] == pytest.approx(expected.pvalue, rel = 1e-6, abs = 1e-12)
+        assert row['Mean'] == pytest.approx(inside.mean(), rel = 1e-12)
+    assert result.loc['Vendor 3', 'PValue'] < 1e-6
+
+
+def test_groups_with_one_value_get_no_test():
+    t, dof, p = welch_from_stats([1, 3], [5.0, 3.0], [25.0, 5.0], [10, 10], [10.0, 10.0], [20.0, 20.0])
+    assert np.isnan([t[0], dof[0], p[0]]).all()
+    assert not np.isnan(p[1])
+
+
+P_VALUES = np.array([0.01, 0.04, 0.03, 0.2, np.nan, 0.005, 0.5, 0.04])
+
+
+def test_holm_and_bonferroni_match_their_definitions():
+    valid = P_VALUES[~np.isnan(P_VALUES)]
+    m = len(valid)
+    order = np.argsort(valid)
+    holm = np.empty(m)
+    holm[order] = np.minimum(np.maximum.accumulate(valid[order] * (m - np.arange(m))), 1)
+    adjusted = adjust_p_values(P_VALUES, 'holm')
+    assert np.isnan(adjusted[4])
+    assert np.allclose(adjusted[~np.isnan(P_VALUES)], holm)
+    # The smallest p-value is multiplied by m, the next by m - 1, ...
+    assert adjusted[5] == pytest.approx(0.005 * 7) and adjusted[0] == pytest.approx(0.01 * 6)
+    assert np.allclose(adjust_p_values(P_VALUES, 'bonferroni')[~np.isnan(P_VALUES)], np.minimum(valid * m, 1))
+
+
+def test_benjamini_hochberg_matches_scipy():
+    valid = ~np.isnan(P_VALUES)
+    expected = stats.false_discovery_control(P_VALUES[valid], method = 'bh')
+    assert np.allclose(adjust_p_values(P_VALUES, 'fdr_bh')[valid], expected)
+
+
+@pytest.mark.parametrize('method', ['holm', 'bonferroni', 'fdr_bh'])
+def test_adjustments_match_statsmodels(method):
+    multitest = pytest.importorskip('statsmodels.stats.multitest')
+    p = np.random.default_rng(1).uniform(0, 0.2, 200)
+    assert np.allclose(adjust_p_values(p, method), multitest.multipletests(p, method = method)[1])
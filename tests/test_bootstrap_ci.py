@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from bootstrap_ci import bootstrap_ci
+
+
+@pytest.fixture(scope = 'module')
+def segments():
+    """200 vendors of 5 to 80 skewed margins with a known mean of 10"""
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(5, 80, 200)
+    vendors = np.repeat([f'Vendor {i:03d}' for i in range(len(sizes))], sizes)
+    margins = 10 + rng.standard_exponential(len(vendors)) * 4 - 4
+    df = pd.DataFrame({'VendorName': vendors, 'ProfitMargin': margins})
+    # Missing and infinite values are dropped rather than propagated
+    extra = pd.DataFrame({'VendorName': ['Vendor 000', 'Vendor 001', None], 'ProfitMargin': [np.nan, np.inf, 1.0]})
+    return pd.concat([df, extra], ignore_index = True).sample(frac = 1, random_state = 1)
+
+
+def test_the_result_does_not_depend_on_the_number_of_workers(segments):
+    # A small chunk budget splits the replicates into several chunks
+    kwargs = dict(n_resamples = 500, seed = 7, chunk_bytes = 2**20)
+    serial = bootstrap_ci(segments, 'VendorName', 'ProfitMargin', workers = 1, **kwargs)
+    parallel = bootstrap_ci(segments, 'VendorName', 'ProfitMargin', workers = 3, **kwargs)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert not serial.equals(bootstrap_ci(segments, 'VendorName', 'ProfitMargin', workers = 1,
+                                          **dict(kwargs, seed = 8)))
+
+
+def test_estimates_and_counts_match_the_groups(segments):
+    result = bootstrap_ci(segments, 'VendorName', 'ProfitMargin', n_resamples = 200).set_index('VendorName')
+    valid = segments[np.isfinite(segments['ProfitMargin'])].dropna()
+    grouped = valid.groupby('VendorName')['ProfitMargin']
+    assert result['Count'].to_dict() == grouped.size().to_dict()
+    assert np.allclose(result['Estimate'], grouped.mean().loc[result.index])
+    assert (result['Lower'] <= result['Estimate']).all() and (result['Estimate'] <= result['Upper']).all()
+
+
+def test_intervals_match_scipy_and_cover_the_mean(segments):
+    result = bootstrap_ci(segments, 'VendorName', 'ProfitMargin', n_resamples = 4000).set_index('VendorName')
+    # Nominal 95% percentile intervals cover the true mean a little less often on small skewed samples
+    coverage = ((result['Lower'] <= 10) & (10 <= result['Upper'])).mean()
+    assert 0.85 <= coverage <= 0.99
+
+    for vendor in ['Vendor 002', 'Vendor 100', 'Vendor 150']:
+        values = segments.loc[segments['VendorName'] == vendor, 'ProfitMargin'].to_numpy()
+        expected = stats.bootstrap((values,), np.mean, n_resamples = 4000, method = 'percentile',
+                                   random_state = 0).confidence_interval
+        # Two independent sets of 4000 replicates agree to a fraction of the standard error
+        tolerance = 0.3 * values.std() / np.sqrt(len(values))
+        assert result.loc[vendor, 'Lower'] == pytest.approx(expected.low, abs = tolerance)
+        assert result.loc[vendor, 'Upper'] == pytest.approx(expected.high, abs = tolerance)
@@ -0,0 +1,68 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bulk_insert import VERSIONS_TABLE, bulk_insert
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'inventory.db')
+    yield conn
+    conn.close()
+
+
+def version(conn, table):
+    return conn.execute(f'SELECT version FROM {VERSIONS_TABLE} WHERE name = ?', (table,)).fetchone()[0]
+
+
+def test_values_and_declared_types_round_trip(conn):
+    df = pd.DataFrame({
+        'Brand': np.array([1, 2, 3], dtype = 'int32'),
+        'Price': [1.5, np.nan, 3.25],
+        'Name': ['a', None, 'c'],
+        'InStock': [True, False, True],
+        'SalesDate': pd.to_datetime(['2024-01-01', None, '2024-02-29']),
+        'LoggedAt': pd.to_datetime(['2024-01-01 10:30:00', '2024-01-02 00:00:00', None]),
+    })
+    assert bulk_insert(df, 'sales', conn, batch_size = 2) == 3
+    types = {name: declared for _, name, declared, *_ in conn.execute('PRAGMA table_info(sales)')}
+    assert types == {'Brand': 'INTEGER', 'Price': 'REAL', 'Name': 'TEXT', 'InStock': 'INTEGER',
+                     'SalesDate': 'TIMESTAMP', 'LoggedAt': 'TIMESTAMP'}
+    assert conn.execute('SELECT * FROM sales ORDER BY rowid').fetchall() == [
+        (1, 1.5, 'a', 1, '2024-01-01', '2024-01-01 10:30:00'),
+        (2, None, None, 0, None, '2024-01-02 00:00:00'),
+        (3, 3.25, 'c', 1, '2024-02-29', None),
+    ]
+
+
+def test_if_exists_and_version_bumps(conn):
+    df = pd.DataFrame({'a': [1, 2]})
+    bulk_insert(df, 't', conn)
+    assert version(conn, 't') == 1
+    bulk_insert(df, 't', conn, if_exists = 'append')
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 4
+    assert version(conn, 't') == 2
+    bulk_insert(pd.DataFrame({'b': [1.0]}), 't', conn, if_exists = 'replace')
+    assert conn.execute('SELECT * FROM t').fetchall() == [(1.0,)]
+    assert version(conn, 't') == 3
+    with pytest.raises(ValueError):
+        bulk_insert(df, 't', conn, if_exists = 'fail')
+    assert version(conn, 't') == 3
+
+
+def test_a_failed_load_leaves_the_table_and_pragmas_as_they_were(conn):
+    bulk_insert(pd.DataFrame({'a': [1, 2]}), 't', conn)
+    synchronous, cache_size = (conn.execute(f'PRAGMA {name}').fetchone()[0] for name in ['synchronous', 'cache_size'])
+    # The third batch holds a value sqlite3 cannot bind, after two batches were written
+    bad = pd.DataFrame({'a': [1, 2, 3, 4, {'not': 'bindable'}, 6]}, dtype = 'object')
+    for if_exists in ['replace', 'append']:
+        with pytest.raises(sqlite3.Error):
+            bulk_insert(bad, 't', conn, if_exists = if_exists, batch_size = 2)
+        assert conn.execute('SELECT a FROM t ORDER BY rowid').fetchall() == [(1,), (2,)]
+        assert version(conn, 't') == 1
+    assert not conn.in_transaction
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == synchronous
+    assert conn.execute('PRAGMA cache_size').fetchone()[0] == cache_size
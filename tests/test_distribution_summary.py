@@ -0,0 +1,93 @@
+import json
+import sqlite3
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib import cbook
+from scipy.stats import gaussian_kde
+
+import distribution_summary
+from bulk_insert import bulk_insert
+from db_connection import close_all, reader_connection
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'skewed': rng.lognormal(0, 2, 45_000), 'normal': rng.normal(10, 3, 45_000),
+                       'constant': np.full(45_000, 5.0), 'label': 'x'})
+    df.loc[::9, 'normal'] = np.nan
+    df.loc[1, 'normal'] = np.inf
+    return df
+
+
+def summary_of(summary, column):
+    return summary.set_index('ColumnName').loc[column]
+
+
+def test_histogram_and_box_statistics_match_numpy_and_matplotlib(frame):
+    summary = distribution_summary.summarize_columns(frame)
+    assert list(summary['ColumnName']) == ['skewed', 'normal', 'constant']
+    for column in ['skewed', 'normal', 'constant']:
+        row = summary_of(summary, column)
+        values = frame[column].replace(np.inf, np.nan).dropna().to_numpy()
+        counts, edges = np.histogram(values, bins = 30)
+        assert json.loads(row['BinCounts']) == counts.tolist()
+        assert np.allclose(json.loads(row['BinEdges']), edges)
+        assert row['Count'] == len(values)
+        assert np.allclose([row['Q1'], row['Median'], row['Q3']], np.percentile(values, [25, 50, 75]))
+        [stats] = cbook.boxplot_stats(values)
+        assert row['WhiskerLow'] == stats['whislo'] and row['WhiskerHigh'] == stats['whishi']
+        assert row['OutlierCount'] == len(stats['fliers'])
+
+
+def test_kde_is_close_to_the_exact_gaussian_kde_near_the_mode(frame):
+    summary = distribution_summary.summarize_columns(frame)
+    for column in ['skewed', 'normal']:
+        row = summary_of(summary, column)
+        x, density = np.array(json.loads(row['KdeX'])), np.array(json.loads(row['KdeDensity']))
+        values = frame[column].replace(np.inf, np.nan).dropna().to_numpy()
+        exact = gaussian_kde(values)
+        # Between the stored points too, where a plot interpolates linearly
+        midpoints = (x[:-1] + x[1:]) / 2
+        near = midpoints[(midpoints > np.percentile(values, 1)) & (midpoints < np.percentile(values, 90))]
+        expected = exact(near)
+        assert np.max(np.abs(np.interp(near, x, density) - expected)) / expected.max() < 0.01
+    assert np.isnan(json.loads(summary_of(summary, 'constant')['KdeDensity'])).all()
+
+
+def test_blocks_bound_memory_without_changing_the_summary(frame):
+    whole = distribution_summary.summarize_columns(frame)
+    tracemalloc.start()
+    blocked = distribution_summary.summarize_columns(frame, block_bytes = 1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for column in ['BinCounts', 'Q1', 'Median', 'Q3', 'WhiskerLow', 'WhiskerHigh', 'OutlierCount', 'Fliers']:
+        assert (whole[column].fillna(-1) == blocked[column].fillna(-1)).all(), column
+    # One column at a time: a few times the size of a column, well under the three numeric columns
+    assert peak < 6 * 8 * len(frame) + 2**20
+
+
+def test_build_keeps_other_sources_and_readers_do_not_rebuild(frame, tmp_path, monkeypatch):
+    monkeypatch.setenv('INVENTORY_DB', str(tmp_path / 'inventory.db'))
+    conn = sqlite3.connect(tmp_path / 'inventory.db')
+    bulk_insert(frame.replace(np.inf, np.nan), 'first', conn)
+    bulk_insert(frame.head(100).replace(np.inf, np.nan), 'second', conn)
+    distribution_summary.build_distribution_summary(conn, 'first')
+    distribution_summary.build_distribution_summary(conn, 'second')
+    distribution_summary.build_distribution_summary(conn, 'first')
+    counts = dict(conn.execute('SELECT Source, COUNT(*) FROM distribution_summary GROUP BY Source').fetchall())
+    assert counts == {'first': 3, 'second': 3}
+
+    bulk_insert(frame.head(10).replace(np.inf, np.nan), 'second', conn, if_exists = 'append')
+    reader = reader_connection()
+    try:
+        assert distribution_summary.load_distribution_summary(reader, 'first')['normal']['n'] == frame['normal'].count() - 1
+        with pytest.raises(RuntimeError, match = 'read-only'):
+            distribution_summary.load_distribution_summary(reader, 'second')
+    finally:
+        reader.close()
+        close_all()
+        conn.close()
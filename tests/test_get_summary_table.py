@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from get_summary_table import clean_data, clean_data_chunks, clean_data_vectorized
+
+KPIS = ['GrossProfit', 'ProfitMargin', 'StockTurnover', 'SalesToPurchaseRatio']
+
+
+@pytest.fixture
+def summary():
+    """A summary as create_vendor_summary returns it, with unsold brands and zero purchases"""
+    rng = np.random.default_rng(0)
+    n = 1000
+    df = pd.DataFrame({
+        'VendorNumber': rng.integers(1, 50, n), 'VendorName': [f' Vendor {i % 50}  ' for i in range(n)],
+        'Brand': np.arange(n), 'Description': [f'Brand {i} ' for i in range(n)],
+        'PurchasePrice': rng.uniform(1, 50, n).round(2), 'ActualPrice': rng.uniform(1, 80, n).round(2),
+        'Volume': rng.choice(['750', '1750', '50'], n),
+        'TotalPurchaseQuantity': rng.integers(1, 500, n), 'TotalPurchaseDollars': rng.uniform(10, 5000, n).round(2),
+        'TotalSalesQuantity': rng.integers(1, 500, n).astype('float64'),
+        'TotalSalesDollars': rng.uniform(10, 8000, n).round(2), 'TotalSalesPrice': rng.uniform(1, 900, n).round(2),
+        'TotalExciseTax': rng.uniform(0, 90, n).round(2), 'FreightCost': rng.uniform(0, 900, n).round(2),
+    })
+    # Brands that never sold come back from the LEFT JOIN with NULL sales
+    unsold = rng.random(n) < 0.1
+    df.loc[unsold, ['TotalSalesQuantity', 'TotalSalesDollars', 'TotalSalesPrice', 'TotalExciseTax']] = np.nan
+    # Zero purchases, alone and together with no sales (0 / 0)
+    df.loc[::97, ['TotalPurchaseQuantity', 'TotalPurchaseDollars']] = 0
+    df.loc[::97 * 3, ['TotalSalesQuantity', 'TotalSalesDollars']] = 0
+    df.loc[::13, 'FreightCost'] = np.nan
+    return df
+
+
+def zero_denominators(df):
+    return {'ProfitMargin': df['TotalSalesDollars'].fillna(0) == 0,
+            'StockTurnover': df['TotalPurchaseQuantity'] == 0,
+            'SalesToPurchaseRatio': df['TotalPurchaseDollars'] == 0}
+
+
+def test_vectorized_cleaning_matches_clean_data(summary):
+    expected = clean_data(summary.copy())
+    result = clean_data_vectorized(summary.copy(), zero_division = 'nan')
+    assert list(result.columns) == list(expected.columns)
+
+    undefined = zero_denominators(summary)
+    assert all(mask.any() for mask in undefined.values())
+    # clean_data leaves x / 0 as +-inf and 0 / 0 as NaN; the 'nan' policy makes both NaN
+    for col, mask in undefined.items():
+        assert np.isinf(expected.loc[mask, col]).any()
+        assert result.loc[mask, col].isna().all()
+    # Everything else is the same
+    pd.testing.assert_frame_equal(result, expected.replace([np.inf, -np.inf], np.nan), check_dtype = False)
+
+
+@pytest.mark.parametrize('policy', ['zero', 'flag'])
+def test_zero_division_policies(summary, policy):
+    expected = clean_data(summary.copy())
+    result = clean_data_vectorized(summary.copy(), zero_division = policy)
+    undefined = zero_denominators(summary)
+    for col, mask in undefined.items():
+        assert (result.loc[mask, col] == 0).all()
+        assert np.allclose(result.loc[~mask, col], expected.loc[~mask, col])
+    if policy == 'flag':
+        assert result['KPIUndefined'].tolist() == (undefined['ProfitMargin'] | undefined['StockTurnover']
+                                                   | undefined['SalesToPurchaseRatio']).tolist()
+    else:
+        assert 'KPIUndefined' not in result
+    with pytest.raises(ValueError):
+        clean_data_vectorized(summary.copy(), zero_division = 'inf')
+
+
+def test_chunked_cleaning_matches_the_whole_frame(summary):
+    chunks = [summary.iloc[:5].copy(), summary.iloc[5:400].copy(), summary.iloc[400:].copy()]
+    # A chunk where a column is NULL in every row reads back as object dtype
+    chunks[0]['TotalExciseTax'] = pd.Series([None] * 5, index = chunks[0].index, dtype = 'object')
+    whole = clean_data_vectorized(pd.concat(chunks), zero_division = 'flag')
+    chunked = pd.concat(clean_data_chunks(iter(chunks), zero_division = 'flag'))
+    pd.testing.assert_frame_equal(chunked, whole)
+    assert chunked['TotalExciseTax'].dtype == 'float64' and (chunked['TotalExciseTax'].iloc[:5] == 0).all()
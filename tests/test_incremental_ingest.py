@@ -0,0 +1,112 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+MODULES = ['incremental_ingest', 'ingestion_DB', 'db_connection']
+
+
+@pytest.fixture
+def incremental(tmp_path, monkeypatch):
+    """incremental_ingest imported against a fresh database in tmp_path, with a data/ folder of csvs"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('INVENTORY_DB', str(tmp_path / 'inventory.db'))
+    os.makedirs('logs')
+    os.makedirs('data')
+    for name in MODULES:
+        sys.modules.pop(name, None)
+    module = importlib.import_module('incremental_ingest')
+    yield module
+    importlib.import_module('db_connection').close_all()
+    for name in MODULES:
+        sys.modules.pop(name, None)
+
+
+def rows(begin, end):
+    return ''.join(f'{i},{i % 7},{i * 0.5}\n' for i in range(begin, end))
+
+
+def write(name, text, mode = 'w', mtime_ns = None):
+    path = f'data/{name}.csv'
+    with open(path, mode) as f:
+        f.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns = (mtime_ns, mtime_ns))
+
+
+def table(name):
+    conn = importlib.import_module('db_connection').writer_connection()
+    return conn.execute(f'SELECT Brand, VendorNumber, Price FROM {name} ORDER BY rowid').fetchall()
+
+
+def expected(begin, end):
+    return [(i, i % 7, i * 0.5) for i in range(begin, end)]
+
+
+HEADER = 'Brand,VendorNumber,Price\n'
+
+
+def test_unchanged_grown_and_rewritten_files(incremental):
+    write('a', HEADER + rows(0, 100), mtime_ns = 10**18)
+    write('b', HEADER + rows(0, 50), mtime_ns = 10**18)
+    deltas = incremental.load_raw_data_incremental(chunksize = 30)
+    assert deltas == {'a': {'action': 'rebuild', 'rows': 100, 'first_rowid': 1},
+                      'b': {'action': 'rebuild', 'rows': 50, 'first_rowid': 1}}
+
+    # a grows at the end, b is only touched
+    write('a', rows(100, 130), mode = 'a', mtime_ns = 2 * 10**18)
+    os.utime('data/b.csv', ns = (2 * 10**18, 2 * 10**18))
+    deltas = incremental.load_raw_data_incremental(chunksize = 30)
+    assert deltas == {'a': {'action': 'append', 'rows': 30, 'first_rowid': 101},
+                      'b': {'action': 'skip', 'rows': 0, 'first_rowid': None}}
+    assert table('a') == expected(0, 130)
+    manifest = incremental.read_manifest(incremental.engine)
+    assert manifest['a.csv']['rows'] == 130 and manifest['b.csv']['mtime_ns'] == 2 * 10**18
+
+    # Nothing changed since the last run
+    assert {delta['action'] for delta in incremental.load_raw_data_incremental().values()} == {'skip'}
+
+    # A row in the middle of a is rewritten, so its table is reloaded in full
+    text = open('data/a.csv').read().replace('\n50,1,25.0\n', '\n50,1,99.0\n')
+    write('a', text + rows(130, 131), mtime_ns = 3 * 10**18)
+    assert incremental.load_raw_data_incremental()['a'] == {'action': 'rebuild', 'rows': 131, 'first_rowid': 1}
+    assert table('a')[50] == (50, 1, 99.0) and len(table('a')) == 131
+
+
+def test_a_last_row_that_grows_is_not_appended_as_a_new_row(incremental):
+    write('a', HEADER + rows(0, 10) + '10,3,', mtime_ns = 10**18)
+    incremental.load_raw_data_incremental()
+    # The unterminated last row continues, so the old bytes end mid-row
+    write('a', '5.0\n' + rows(11, 12), mode = 'a', mtime_ns = 2 * 10**18)
+    assert incremental.load_raw_data_incremental()['a']['action'] == 'rebuild'
+    assert table('a') == expected(0, 12)
+
+
+def test_a_failed_append_is_rolled_back_with_its_manifest_entry(incremental, monkeypatch):
+    write('a', HEADER + rows(0, 100), mtime_ns = 10**18)
+    incremental.load_raw_data_incremental()
+    before = incremental.read_manifest(incremental.engine)
+    write('a', rows(100, 200), mode = 'a', mtime_ns = 2 * 10**18)
+
+    # The second chunk of the tail fails after the first one was inserted
+    insert_rows = incremental.insert_rows
+    calls = []
+
+    def failing_insert(conn, df, table_name):
+        calls.append(len(df))
+        if len(calls) == 2:
+            raise OSError('disk full')
+        insert_rows(conn, df, table_name)
+
+    monkeypatch.setattr(incremental, 'insert_rows', failing_insert)
+    with pytest.raises(OSError):
+        incremental.load_raw_data_incremental(chunksize = 40)
+    assert table('a') == expected(0, 100)
+    assert incremental.read_manifest(incremental.engine) == before
+
+    # The next run appends the tail exactly once
+    monkeypatch.setattr(incremental, 'insert_rows', insert_rows)
+    assert incremental.load_raw_data_incremental(chunksize = 40)['a'] == {'action': 'append', 'rows': 100,
+                                                                          'first_rowid': 101}
+    assert table('a') == expected(0, 200)
@@ -0,0 +1,66 @@
+import importlib
+import os
+import sys
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def ingestion(tmp_path, monkeypatch):
+    """ingestion_DB imported against a fresh database in tmp_path, with a data/ folder of csvs"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('INVENTORY_DB', str(tmp_path / 'inventory.db'))
+    os.makedirs('logs')
+    os.makedirs('data')
+    for name in ['ingestion_DB', 'db_connection']:
+        sys.modules.pop(name, None)
+    module = importlib.import_module('ingestion_DB')
+    yield module
+    importlib.import_module('db_connection').close_all()
+    for name in ['ingestion_DB', 'db_connection']:
+        sys.modules.pop(name, None)
+
+
+def write_csv(name, rows, bad_row = None):
+    with open(f'data/{name}.csv', 'w') as f:
+        f.write('Brand,VendorNumber,Price\n')
+        for i in range(rows):
+            f.write('1,2,3,4\n' if i == bad_row else f'{i},{i % 7},{i * 0.5}\n')
+
+
+def run_with_timeout(function, timeout = 60):
+    """Runs function in a daemon thread; returns the exception it raised, fails if it does not finish"""
+    outcome = {}
+
+    def target():
+        try:
+            function()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target = target, daemon = True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'load_raw_data_parallel did not return'
+    return outcome.get('error')
+
+
+def test_parallel_ingest_writes_every_file(ingestion):
+    for name in ['a', 'b', 'c']:
+        write_csv(name, 500)
+    error = run_with_timeout(lambda: ingestion.load_raw_data_parallel(workers = 3, chunksize = 10, max_queued_chunks = 1))
+    assert error is None
+    conn = importlib.import_module('db_connection').writer_connection()
+    for name in ['a', 'b', 'c']:
+        assert conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0] == 500
+
+
+def test_parallel_ingest_fails_instead_of_hanging_when_a_parser_fails(ingestion):
+    # One malformed row in the middle of a file while the other parsers keep the queue full
+    write_csv('a', 5000)
+    write_csv('b', 200, bad_row = 100)
+    write_csv('c', 5000)
+    error = run_with_timeout(lambda: ingestion.load_raw_data_parallel(workers = 3, chunksize = 10, max_queued_chunks = 1))
+    assert isinstance(error, RuntimeError)
+    assert 'b.csv' in str(error)
@@ -0,0 +1,50 @@
+import json
+import sqlite3
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture(autouse = True)
+def metrics_dir(tmp_path, monkeypatch):
+    """Runs each test in tmp_path with a metrics log of its own"""
+    instrumentation.stop_metrics_logging()
+    monkeypatch.chdir(tmp_path)
+    yield
+    instrumentation.stop_metrics_logging()
+
+
+def read_records(path):
+    instrumentation.stop_metrics_logging()
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_measure_records_the_page_cache_size_of_a_sqlite3_connection(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'metrics.db'))
+    conn.execute('PRAGMA cache_size = -2048')
+    conn.execute('CREATE TABLE t (a)')
+    with instrumentation.measure('query', 'insert', conn) as record:
+        conn.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(1000)])
+        conn.commit()
+        record['rows_out'] = 1000
+    conn.close()
+
+    [record] = read_records('logs/metrics.jsonl')
+    assert record['status'] == 'ok'
+    assert record['rows_out'] == 1000
+    assert record['page_cache_bytes'] == 2048 * 1024
+    assert record['database_bytes'] > 0
+    # sqlite3 has no binding for sqlite3_db_status, so no hit counts are made up
+    assert 'cache_hit' not in record
+
+
+def test_measure_without_any_rss_source(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'current_rss', lambda: None)
+    with instrumentation.measure('stage', 'no_rss'):
+        pass
+
+    [record] = read_records('logs/metrics.jsonl')
+    assert record['status'] == 'ok'
+    assert record['peak_rss_delta_bytes'] is None
@@ -0,0 +1,61 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from quantile_sketch import KLLSketch, stream_quantiles
+
+EPSILON = 0.01
+FRACTIONS = np.linspace(0.01, 0.99, 99)
+
+
+def max_rank_error(sketch, values):
+    """Largest distance between a requested fraction and the true rank of the value returned for it"""
+    ordered = np.sort(values)
+    estimates = sketch.quantiles(FRACTIONS)
+    ranks = np.searchsorted(ordered, estimates, side = 'right') / len(ordered)
+    return np.max(np.abs(ranks - FRACTIONS))
+
+
+@pytest.fixture(scope = 'module')
+def skewed():
+    return np.random.default_rng(0).lognormal(0, 2, 1_000_000)
+
+
+def test_rank_error_of_a_chunked_stream_is_within_epsilon(skewed):
+    sketch = KLLSketch(EPSILON)
+    for chunk in np.array_split(skewed, 37):
+        sketch.update(chunk)
+    assert sketch.n == len(skewed)
+    assert max_rank_error(sketch, skewed) <= EPSILON
+    assert sketch.quantiles([0, 1]) == [skewed.min(), skewed.max()]
+    # O(1/epsilon) memory, far below the million values
+    assert sketch.size() < 20 / EPSILON
+
+
+def test_rank_error_of_merged_sketches_is_within_epsilon(skewed):
+    left, right = KLLSketch(EPSILON, seed = 1), KLLSketch(EPSILON, seed = 2)
+    # Uneven halves with different distributions, so the merge has to combine different levels
+    split = 700_000
+    for chunk in np.array_split(skewed[:split], 10):
+        left.update(chunk)
+    shifted = skewed[split:] * 3
+    right.update(shifted)
+    merged = left.merge(right)
+    values = np.concatenate([skewed[:split], shifted])
+    assert merged.n == len(values)
+    assert max_rank_error(merged, values) <= EPSILON
+
+
+def test_stream_quantiles_over_a_cursor_skips_nulls():
+    values = np.random.default_rng(3).normal(100, 15, 50_000)
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (a REAL, b REAL)')
+    conn.executemany('INSERT INTO t VALUES (?, ?)',
+                     [(float(v), None if i % 10 == 0 else float(-v)) for i, v in enumerate(values)])
+    result = stream_quantiles(conn.execute('SELECT a, b FROM t'), {'a': [0.25, 0.5], 'b': [0, 1]},
+                              EPSILON, chunksize = 999)
+    for q in [0.25, 0.5]:
+        assert abs(np.mean(values <= result['a'][q]) - q) <= EPSILON
+    present = -values[np.arange(len(values)) % 10 != 0]
+    assert [result['b'][0], result['b'][1]] == [present.min(), present.max()]
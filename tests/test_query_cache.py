@@ -0,0 +1,101 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import query_cache
+from bulk_insert import bulk_insert, bump_table_version
+
+QUERY = 'SELECT * FROM sales ORDER BY Brand'
+
+# The uncounted read, to compare the cached results with
+read_sql_query = pd.read_sql_query
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'inventory.db')
+    bulk_insert(pd.DataFrame({'Brand': [1, 2, 3], 'SalesDollars': [10.0, 20.0, 30.0]}), 'sales', conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Counts the queries that actually reach SQLite"""
+    calls = []
+    monkeypatch.setattr(query_cache.pd, 'read_sql_query',
+                        lambda query, conn, params = None: calls.append(query) or read_sql_query(query, conn, params = params))
+    return calls
+
+
+def cached(conn, tmp_path, query = QUERY, params = None):
+    return query_cache.cached_read_sql(query, conn, params = params, cache_dir = str(tmp_path / 'cache'))
+
+
+def assert_fresh(conn, tmp_path, reads, misses):
+    """The cached result equals a direct read, after the expected number of misses"""
+    result = cached(conn, tmp_path)
+    pd.testing.assert_frame_equal(result, read_sql_query(QUERY, conn))
+    assert len(reads) == misses
+
+
+def test_an_unchanged_table_is_served_from_the_cache(conn, tmp_path, reads):
+    first = cached(conn, tmp_path)
+    # The same query written differently shares the entry
+    second = cached(conn, tmp_path, '  SELECT *\n  FROM sales\n  ORDER BY Brand;')
+    pd.testing.assert_frame_equal(first, second)
+    assert len(reads) == 1
+    cached(conn, tmp_path, 'SELECT * FROM sales WHERE Brand > ? ORDER BY Brand', params = (1,))
+    cached(conn, tmp_path, 'SELECT * FROM sales WHERE Brand > ? ORDER BY Brand', params = (2,))
+    assert len(reads) == 3
+
+
+def test_appended_rows_invalidate_the_result(conn, tmp_path, reads):
+    assert_fresh(conn, tmp_path, reads, 1)
+    bulk_insert(pd.DataFrame({'Brand': [4], 'SalesDollars': [40.0]}), 'sales', conn, if_exists = 'append')
+    assert_fresh(conn, tmp_path, reads, 2)
+    assert_fresh(conn, tmp_path, reads, 2)
+
+
+def test_a_reingested_table_of_the_same_size_invalidates_the_result(conn, tmp_path, reads):
+    assert_fresh(conn, tmp_path, reads, 1)
+    # Same row count and rowids, different values: only the version counter tells them apart
+    bulk_insert(pd.DataFrame({'Brand': [1, 2, 3], 'SalesDollars': [11.0, 21.0, 31.0]}), 'sales', conn)
+    assert_fresh(conn, tmp_path, reads, 2)
+
+
+def test_an_update_with_a_version_bump_invalidates_the_result(conn, tmp_path, reads):
+    assert_fresh(conn, tmp_path, reads, 1)
+    conn.execute('UPDATE sales SET SalesDollars = 0 WHERE Brand = 2')
+    bump_table_version(conn, 'sales')
+    conn.commit()
+    assert_fresh(conn, tmp_path, reads, 2)
+
+
+def test_writes_that_bypass_the_version_counter_are_still_caught(conn, tmp_path, reads):
+    assert_fresh(conn, tmp_path, reads, 1)
+    # A plain INSERT moves MAX(rowid)
+    conn.execute('INSERT INTO sales VALUES (5, 50.0)')
+    conn.commit()
+    assert_fresh(conn, tmp_path, reads, 2)
+    # A schema change alters the table's CREATE statement
+    conn.execute('ALTER TABLE sales ADD COLUMN Store INTEGER DEFAULT 7')
+    conn.commit()
+    assert_fresh(conn, tmp_path, reads, 3)
+    assert 'Store' in cached(conn, tmp_path).columns
+
+
+def test_a_stale_entry_is_replaced_and_lru_eviction_keeps_the_cap(conn, tmp_path, reads):
+    cache_dir = tmp_path / 'cache'
+    cached(conn, tmp_path)
+    bulk_insert(pd.DataFrame({'Brand': [4], 'SalesDollars': [40.0]}), 'sales', conn, if_exists = 'append')
+    cached(conn, tmp_path)
+    # Results of the query over the older data are deleted, not left to be hit
+    assert len(list(cache_dir.iterdir())) == 1
+
+    for brand in range(5):
+        query_cache.cached_read_sql(f'SELECT * FROM sales WHERE Brand = {brand}', conn,
+                                    cache_dir = str(cache_dir), max_bytes = 1)
+    # Over the cap every older entry is evicted
+    assert len(list(cache_dir.iterdir())) <= 1
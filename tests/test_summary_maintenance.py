@@ -0,0 +1,111 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import summary_maintenance
+from bulk_insert import bulk_insert
+from get_summary_table import clean_data, create_vendor_summary
+
+VENDORS = 40
+
+# Columns that identify a summary row
+KEYS = ['VendorNumber', 'Brand', 'VendorName', 'Description', 'PurchasePrice', 'ActualPrice', 'Volume']
+
+
+def purchases(rng, n, brands):
+    brand = rng.choice(brands, n)
+    vendor = brand % VENDORS + 1
+    quantity = rng.integers(1, 50, n)
+    price = np.round(5 + brand % 7 + (brand % 2) * rng.integers(0, 2, n) * 0.5, 2)
+    return pd.DataFrame({'VendorNumber': vendor, 'VendorName': [f'Vendor {v}  ' for v in vendor], 'Brand': brand,
+                         'Description': [f'Brand {b} ' for b in brand], 'PurchasePrice': price,
+                         'Quantity': quantity, 'Dollars': np.round(quantity * price, 2)})
+
+
+def purchase_prices(brands, duplicates = ()):
+    brands = np.concatenate([brands, duplicates]).astype('int64')
+    return pd.DataFrame({'VendorNumber': brands % VENDORS + 1, 'Brand': brands, 'Price': np.round(9 + brands % 11, 2),
+                         'Volume': np.where(brands % 3 == 0, 1750, 750)})
+
+
+def sales(rng, n, brands):
+    brand = rng.choice(brands, n)
+    quantity = rng.integers(1, 10, n)
+    price = np.round(9 + brand % 11, 2)
+    return pd.DataFrame({'VendorNo': brand % VENDORS + 1, 'Brand': brand, 'SalesQuantity': quantity,
+                         'SalesDollars': np.round(quantity * price, 2), 'SalesPrice': price,
+                         'ExciseTax': np.round(quantity * 0.79, 2)})
+
+
+def invoices(rng, vendors):
+    return pd.DataFrame({'VendorNumber': vendors, 'Freight': np.round(rng.uniform(10, 500, len(vendors)), 2)})
+
+
+def append(conn, df, table, deltas):
+    first_rowid = conn.execute(f'SELECT MAX(rowid) FROM {table}').fetchone()[0] + 1
+    bulk_insert(df, table, conn, if_exists = 'append')
+    deltas[table] = {'action': 'append', 'rows': len(df), 'first_rowid': first_rowid}
+
+
+def sorted_frame(df):
+    return df.sort_values(KEYS).reset_index(drop = True)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    rng = np.random.default_rng(0)
+    conn = sqlite3.connect(tmp_path / 'inventory.db')
+    # Brands 300 and up have no purchase price yet, the last 80 of the others never sold
+    priced = np.arange(1, 300)
+    bulk_insert(purchases(rng, 5000, priced), 'purchases', conn)
+    bulk_insert(purchase_prices(priced, duplicates = [5, 6]), 'purchase_prices', conn)
+    bulk_insert(sales(rng, 8000, priced[:-80]), 'sales', conn)
+    bulk_insert(invoices(rng, np.arange(1, VENDORS - 5)), 'vendor_invoice', conn)
+    yield conn
+    conn.close()
+
+
+def test_refresh_of_appended_rows_matches_a_full_rebuild(conn):
+    full = summary_maintenance.refresh_vendor_summary(conn, {})
+    before = dict(conn.execute('SELECT rowid, VendorNumber || \'/\' || Brand FROM vendor_summary').fetchall())
+
+    rng = np.random.default_rng(1)
+    deltas = {}
+    # A new priced brand and its first purchases, a second price row of brand 20, sales of some
+    # brands (one of them without any sales so far), and freight of a vendor that had none
+    append(conn, purchase_prices([300, 20]), 'purchase_prices', deltas)
+    append(conn, purchases(rng, 30, [7, 300]), 'purchases', deltas)
+    append(conn, sales(rng, 20, [11, 12, 250]), 'sales', deltas)
+    append(conn, invoices(rng, [VENDORS - 2]), 'vendor_invoice', deltas)
+    rewritten = summary_maintenance.refresh_vendor_summary(conn, deltas)
+
+    expected = clean_data(create_vendor_summary(conn))
+    # clean_data divides by zero into +-inf, the refresh uses clean_data_vectorized's NaN policy
+    expected = expected.replace([np.inf, -np.inf], np.nan)
+    refreshed = pd.read_sql_query('SELECT * FROM vendor_summary', conn)
+    pd.testing.assert_frame_equal(sorted_frame(refreshed), sorted_frame(expected), check_dtype = False)
+
+    # Only the touched keys were rewritten: every other row kept its rowid
+    touched_vendors = {VENDORS - 2}
+    touched_keys = {(brand % VENDORS + 1, brand) for brand in [7, 300, 20, 11, 12, 250]}
+    after = dict(conn.execute('SELECT rowid, VendorNumber || \'/\' || Brand FROM vendor_summary').fetchall())
+    untouched = {rowid: key for rowid, key in before.items()
+                 if int(key.split('/')[0]) not in touched_vendors
+                 and tuple(int(part) for part in key.split('/')) not in touched_keys}
+    assert all(after.get(rowid) == key for rowid, key in untouched.items())
+    assert 0 < rewritten < full / 4
+    assert rewritten == len(refreshed) - len(untouched)
+
+
+def test_refresh_after_a_rewrite_rebuilds_everything(conn):
+    summary_maintenance.refresh_vendor_summary(conn, {})
+    conn.execute('DELETE FROM sales WHERE Brand % 2 = 0')
+    conn.commit()
+    rows = summary_maintenance.refresh_vendor_summary(conn, {'sales': {'action': 'rebuild'}})
+    expected = clean_data(create_vendor_summary(conn)).replace([np.inf, -np.inf], np.nan)
+    assert rows == len(expected)
+    # A full rebuild stores the rows in SUMMARY_ORDER_BY order
+    refreshed = pd.read_sql_query('SELECT * FROM vendor_summary ORDER BY rowid', conn)
+    pd.testing.assert_frame_equal(refreshed, expected, check_dtype = False)
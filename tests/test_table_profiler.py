@@ -0,0 +1,65 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import table_profiler
+from bulk_insert import bulk_insert
+from db_connection import close_all
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'inventory.db')
+    yield conn
+    conn.close()
+    close_all()
+
+
+def test_profile_covers_numbers_text_and_dates(conn):
+    df = pd.DataFrame({
+        'Brand': [3, 1, 2, None, 5],
+        'Price': [1.5, 2.5, None, 4.0, 2.0],
+        'VendorName': ['b', 'a', 'c', None, 'a'],
+        'SalesDate': ['2024-02-29', '2024-01-01', '2023-12-31', '2024-01-15', None],
+    })
+    bulk_insert(df, 'sales', conn)
+    profile = table_profiler.profile_tables(conn, chunksize = 2).set_index('ColumnName')
+
+    assert (profile['RowCount'] == 5).all()
+    assert profile.loc['Brand', ['MinValue', 'MaxValue', 'MeanValue']].tolist() == [1, 5, 2.75]
+    assert profile.loc['Price', ['MinValue', 'MaxValue', 'MeanValue']].tolist() == [1.5, 4.0, 2.5]
+    assert profile.loc['VendorName', ['MinValue', 'MaxValue', 'NullCount']].tolist() == ['a', 'c', 1]
+    assert profile.loc['SalesDate', ['MinValue', 'MaxValue']].tolist() == ['2023-12-31', '2024-02-29']
+    assert profile.loc[['VendorName', 'SalesDate'], 'MeanValue'].isna().all()
+    assert profile.loc['VendorName', 'DistinctCount'] == 3
+
+    # The stored profile keeps numbers as numbers and text as text
+    stored = dict(conn.execute("SELECT ColumnName, typeof(MinValue) FROM table_profile").fetchall())
+    assert stored['Price'] == 'real' and stored['SalesDate'] == 'text'
+
+
+def test_distinct_counts_are_within_the_hyperloglog_error(conn):
+    values = np.random.default_rng(0).integers(0, 200_000, 300_000)
+    bulk_insert(pd.DataFrame({'Key': values, 'Name': [f'name {v}' for v in values]}), 'keys', conn)
+    profile = table_profiler.profile_tables(conn).set_index('ColumnName')
+    exact = len(np.unique(values))
+    for column in ['Key', 'Name']:
+        # Four standard errors of 2**14 registers
+        assert abs(profile.loc[column, 'DistinctCount'] - exact) / exact < 4 * 0.0081
+
+
+def test_unchanged_tables_are_not_profiled_again(conn, monkeypatch):
+    bulk_insert(pd.DataFrame({'a': [1, 2]}), 'first', conn)
+    bulk_insert(pd.DataFrame({'b': [1.0]}), 'second', conn)
+    table_profiler.profile_tables(conn)
+
+    scanned = []
+    profile_table = table_profiler.profile_table
+    monkeypatch.setattr(table_profiler, 'profile_table',
+                        lambda db_path, table, chunksize: scanned.append(table) or profile_table(db_path, table, chunksize))
+    bulk_insert(pd.DataFrame({'b': [5.0]}), 'second', conn, if_exists = 'append')
+    profile = table_profiler.profile_tables(conn).set_index('ColumnName')
+    assert scanned == ['second']
+    assert profile.loc['b', 'MaxValue'] == 5.0 and profile.loc['a', 'MaxValue'] == 2
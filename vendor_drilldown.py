@@ -0,0 +1,128 @@
+import argparse
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from db_connection import writer_connection
+from db_indexes import SUMMARY_INDEXES, build_indexes
+from query_cache import table_version
+
+# The vendor column of every drill-down table
+VENDOR_COLUMNS = {
+    'purchases': 'VendorNumber',
+    'purchase_prices': 'VendorNumber',
+    'vendor_invoice': 'VendorNumber',
+    'sales': 'VendorNo',
+}
+
+DEFAULT_CACHE_SIZE = 256
+
+
+def vendor_indexes():
+    """The indexes of db_indexes that lead with the vendor column of a drill-down table"""
+    return {name: (table, columns) for name, (table, columns) in SUMMARY_INDEXES.items()
+            if table in VENDOR_COLUMNS and columns[0] == VENDOR_COLUMNS[table]}
+
+
+def vendor_query(table):
+    """One statement per table for any batch size: the vendor numbers are bound as a single
+    JSON array, so the SQL text never changes and sqlite3 reuses the prepared statement"""
+    return f'SELECT * FROM {table} WHERE {VENDOR_COLUMNS[table]} IN (SELECT value FROM json_each(?))'
+
+
+def build_bundle(vendor, frames):
+    """The drill-down of one vendor: its rows of every table plus the aggregations eda.py prints"""
+    purchases, sales = frames['purchases'], frames['sales']
+    return {
+        'vendor': vendor,
+        **frames,
+        'purchases_by_brand_price': purchases.groupby(['Brand', 'PurchasePrice'])[['Quantity', 'Dollars']].sum(),
+        'po_count': frames['vendor_invoice']['PONumber'].nunique(),
+        'sales_by_brand': sales.groupby(['Brand'])[['SalesPrice', 'SalesDollars', 'SalesQuantity']].sum(),
+    }
+
+
+class VendorDrilldown:
+    """Per-vendor drill-downs of purchases, purchase_prices, vendor_invoice and sales
+
+    A batch of vendors costs one indexed query per table, whatever its size. The bundles of the
+    most recently requested vendors are kept in an LRU cache, which is dropped as soon as one of
+    the tables changes.
+    """
+
+    def __init__(self, conn, cache_size = DEFAULT_CACHE_SIZE):
+        self.conn = conn
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.versions = None
+        self.hits = 0
+        self.misses = 0
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        existing = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        missing = {name: index for name, index in vendor_indexes().items() if name not in existing}
+        if missing:
+            build_indexes(self.conn, missing)
+
+    def _check_versions(self):
+        versions = tuple(table_version(self.conn, table) for table in VENDOR_COLUMNS)
+        if versions != self.versions:
+            if self.cache:
+                logging.info('Drill-down tables changed, clearing the vendor cache')
+            self.cache.clear()
+            self.versions = versions
+
+    def _fetch(self, vendors):
+        """One round per table for the whole batch, split into per-vendor frames"""
+        start = time.time()
+        params = (json.dumps(vendors),)
+        frames = {vendor: {} for vendor in vendors}
+        for table, vendor_col in VENDOR_COLUMNS.items():
+            df = pd.read_sql_query(vendor_query(table), self.conn, params = params)
+            groups = dict(iter(df.groupby(vendor_col, sort = False)))
+            for vendor in vendors:
+                frames[vendor][table] = groups[vendor].reset_index(drop = True) if vendor in groups else df.iloc[:0]
+        logging.info(f'Fetched {len(vendors)} vendors in {time.time() - start:.2f} seconds')
+        return {vendor: build_bundle(vendor, frames[vendor]) for vendor in vendors}
+
+    def bundles(self, vendors):
+        """Drill-downs of many vendors: {vendor number: bundle}, in the order requested"""
+        vendors = list(dict.fromkeys(int(vendor) for vendor in vendors))
+        self._check_versions()
+        missing = [vendor for vendor in vendors if vendor not in self.cache]
+        self.hits += len(vendors) - len(missing)
+        self.misses += len(missing)
+        fetched = self._fetch(missing) if missing else {}
+
+        result = {}
+        for vendor in vendors:
+            bundle = fetched[vendor] if vendor in fetched else self.cache[vendor]
+            self.cache[vendor] = bundle
+            self.cache.move_to_end(vendor)
+            result[vendor] = bundle
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+        return result
+
+    def bundle(self, vendor):
+        """Drill-down of one vendor"""
+        return self.bundles([vendor])[int(vendor)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Drill into the purchases, prices, invoices and sales of vendors')
+    parser.add_argument('vendors', type = int, nargs = '+')
+    parser.add_argument('--db', default = None, help = 'database path, by default the configured one')
+    args = parser.parse_args()
+
+    conn = writer_connection(args.db)
+    for vendor, bundle in VendorDrilldown(conn).bundles(args.vendors).items():
+        print('-'*50, f'Vendor {vendor}', '-'*50)
+        print(bundle['purchases_by_brand_price'])
+        print('Purchase orders:', bundle['po_count'])
+        print(bundle['sales_by_brand'])
+    conn.close()
@@ -3,16 +3,27 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import warnings
-import sqlite3
+from db_connection import reader_connection
 from scipy.stats import ttest_ind
+from analysis_context import AnalysisContext
+from distribution_summary import load_distribution_summary
+from rollups import require_rollups, top_n, purchase_contribution, low_turnover_vendors, brand_margin_vs_sales
 import scipy.stats as stats
 warnings.filterwarnings("ignore")
 
-# Creating the database connection
-conn = sqlite3.connect('inventory.db')
+# Creating a read-only database connection, which keeps reading while ingestion writes
+conn = reader_connection()
 
-#fethcing vendor summary data
-df = pd.read_sql_query("SELECT * FROM final_summary_table", conn)
+# The summary table written by eda.py
+TABLE = 'final_summary_table'
+
+#fethcing vendor summary data once; filtered views and rollups are served from this context
+ctx = AnalysisContext(conn, TABLE)
+df = ctx.df
+
+# Vendor and brand rollups of the same table, for the ranking questions below. This script only
+# reads; eda.py builds them together with final_summary_table
+require_rollups(conn, TABLE)
 print(df.head())
 
 
@@ -33,10 +44,18 @@ print(summary_stats)
 # Distribution Plots for Numerical Columns
 numerical_columns = df.select_dtypes(include=np.number).columns 
 
+# The histograms, KDEs and box plots are drawn from the stored distribution summary of the table
+# (built by eda.py) instead of from the raw rows
+distributions = load_distribution_summary(conn, TABLE)
+
 plt.figure(figsize=(15, 10))
 for i , col in enumerate(numerical_columns):
-    plt.subplot(4, 4, i + 1) # Grid of 4 rows and 4 columns
-    sns.histplot(df[col], kde=True, bins=30)
+    ax = plt.subplot(4, 4, i + 1) # Grid of 4 rows and 4 columns
+    data = distributions[col]
+    ax.stairs(data['counts'], data['edges'], fill=True, alpha=0.6)
+    if data['kde_density'] is not None:
+        # The density is scaled to counts per bin, as histplot(kde=True) does
+        ax.plot(data['kde_x'], data['kde_density'] * data['n'] * (data['edges'][1] - data['edges'][0]))
     plt.title(f'Distribution of {col}')
     plt.xlabel(col)
     plt.ylabel('Frequency')
@@ -49,8 +68,8 @@ plt.show()
 
 plt.figure(figsize=(15, 10))
 for i , col in enumerate(numerical_columns):
-    plt.subplot(4, 4, i + 1) # Grid of 4 rows and 4 columns
-    sns.boxplot(df[col])
+    ax = plt.subplot(4, 4, i + 1) # Grid of 4 rows and 4 columns
+    ax.bxp([distributions[col]['box']])
     plt.title(f'Distribution of {col}')
     plt.xlabel(col)
     plt.ylabel('Frequency')
@@ -80,15 +99,9 @@ Stock Turnover: Varies between 0 to 274.5. Low values suggest products stay in s
 
 
 # Filtering data by removing the inconsistent values
-df = pd.read_sql_query("""
-SELECT *
-FROM final_summary_table 
-WHERE GrossProfit > 0
-AND ProfitMargin > 0
-AND TotalSalesQuantity > 0 """, conn)
-
+# GrossProfit > 0 AND ProfitMargin > 0 AND TotalSalesQuantity > 0, kept as a mask over the loaded frame
 print("Filtered Data:")
-print(df)
+print(ctx.view('consistent'))
 
 
 # Frequency plots for Categorical Columns
@@ -97,7 +110,7 @@ categorical_columns = ['VendorName', 'Description']
 plt.figure(figsize=(12, 5))
 for i, col in enumerate(categorical_columns):
     plt.subplot(1, 2, i + 1)
-    sns.countplot(y=df[col], order=df[col].value_counts().index[:10]) # Top 10 categories
+    sns.countplot(y=ctx.column(col, 'consistent'), order=ctx.value_counts(col, 'consistent').index[:10]) # Top 10 categories
     plt.title(f'Frequency of {col}')
 plt.tight_layout()
 plt.show()
@@ -105,7 +118,7 @@ plt.show()
 
 # Correlation Heatmap
 plt.figure(figsize=(12, 8))
-correlation_matrix = df[numerical_columns].corr()
+correlation_matrix = ctx.view('consistent', numerical_columns).corr()
 sns.heatmap(correlation_matrix, annot=True, fmt=".2f", cmap='coolwarm', linewidths=0.5)
 plt.title('Correlation Heatmap')
 plt.show()
@@ -129,10 +142,7 @@ Stock Turnover is weakly negatively correlated with both Gross Profit (-0.038) a
 """Data Analysis and Hypothesis Testing
 Identify Brands that needs promotional or Pricing adjustments which exhibit lower sales performance but higher profit margins."""
 
-brand_performance = df.groupby('Description').agg({
-    'TotalSalesDollars': 'sum',
-    'ProfitMargin': 'mean',
-}).reset_index()
+brand_performance = brand_margin_vs_sales(conn, 'consistent', TABLE)
 
 brand_performance = brand_performance[brand_performance['TotalSalesDollars']<10000]  # better visualization of  sales brands
 
@@ -173,9 +183,9 @@ def format_dollars(value):
     else:
         return f"${value:.2f}"
 
-top_vendors = df.groupby('VendorName')["TotalSalesDollars"].sum().nlargest(10)
+top_vendors = top_n(conn, 'vendor', 'TotalSalesDollarsSum', 10, 'consistent', source = TABLE).rename("TotalSalesDollars")
 
-top_brands = df.groupby('Description')["TotalSalesDollars"].sum().nlargest(10)
+top_brands = top_n(conn, 'brand', 'TotalSalesDollarsSum', 10, 'consistent', source = TABLE).rename("TotalSalesDollars")
 
 print("Top 10 Vendors by Total Sales Dollars:")
 print(top_vendors.apply(lambda x: format_dollars(x)))
@@ -211,17 +221,8 @@ plt.show()
 
 
 # Which vendors contribute the most to total purchase dollars?
-vendor_performance  = df.groupby('VendorName').agg({
-    'TotalPurchaseDollars': 'sum',
-    'GrossProfit': 'sum',
-    'TotalSalesDollars': 'sum'
-}).reset_index()
-
-
-vendor_performance['PurchaseContribution'] = vendor_performance['TotalPurchaseDollars'] / vendor_performance['TotalPurchaseDollars'].sum() * 100
-
 print("Top 10 Vendor's Performance:")
-top_vendors = vendor_performance.sort_values(by='TotalPurchaseDollars', ascending=False).head(10)
+top_vendors = purchase_contribution(conn, 10, 'consistent', TABLE)
 print(top_vendors)
 
 print(top_vendors['PurchaseContribution'].sum())
@@ -293,20 +294,20 @@ plt.show()
 
 #Does purchasing in bulk reduce the unit price and what is the optimal purchase volume for cost savings?
 
-df['UnitPrice'] = df['TotalPurchaseDollars'] / df['TotalPurchaseQuantity']
+ctx.add_column('UnitPrice', df['TotalPurchaseDollars'] / df['TotalPurchaseQuantity'])
 
-df["OrderSize"]=pd.qcut(df['TotalPurchaseQuantity'],
+ctx.add_column("OrderSize", pd.qcut(ctx.column('TotalPurchaseQuantity', 'consistent'),
                         q=3, 
-                        labels=['Small', 'Medium', 'Large'])
+                        labels=['Small', 'Medium', 'Large']))
 
-print(df[['OrderSize', 'UnitPrice']])
+print(ctx.view('consistent', ['OrderSize', 'UnitPrice']))
 
-df.groupby('OrderSize')['UnitPrice'].mean().plot(kind='bar', color='skyblue', figsize=(10, 6))
+ctx.groupby('OrderSize', {'UnitPrice': 'mean'}, 'consistent')['UnitPrice'].plot(kind='bar', color='skyblue', figsize=(10, 6))
 
 
 
 plt.figure(figsize=(10, 6))
-sns.boxplot(data=df, x="OrderSize", y="UnitPrice", palette="Set2")
+sns.boxplot(data=ctx.view('consistent', ['OrderSize', 'UnitPrice']), x="OrderSize", y="UnitPrice", palette="Set2")
 plt.title('Unit Price by Order Size')
 plt.xlabel('Order Size')
 plt.ylabel('Unit Price ($)')
@@ -327,33 +328,33 @@ This indicates that bulk pricing effectively motivates vendors to buy in larger
 
 # Which vendors have low inventory turnover and high stock levels, indicating potential overstocking or slow-moving inventory?
 
-turnover = df[df['StockTurnover'] < 1].groupby('VendorName')[['StockTurnover']].mean().sort_values(by='StockTurnover', ascending=True).head(10)
+turnover = low_turnover_vendors(conn, 10, 'consistent', TABLE)
 
 print("Vendors with Low Inventory Turnover:")
 print(turnover)
 
 # How much capital is locked in unsold invenotry per vendor and which vendors contribute the most to it ?
 
-df["UnsoldInventoryValue"] = (df["TotalPurchaseQuantity"] - df["TotalSalesQuantity"]) * df["PurchasePrice"]
-
-print("Total Unsold Inventory Value :" , format_dollars(df["UnsoldInventoryValue"].sum()))
+ctx.add_column("UnsoldInventoryValue", (df["TotalPurchaseQuantity"] - df["TotalSalesQuantity"]) * df["PurchasePrice"])
 
+print("Total Unsold Inventory Value :" , format_dollars(ctx.column("UnsoldInventoryValue", 'consistent').sum()))
 
-inventory_value_per_vendor = df.groupby('VendorName')['UnsoldInventoryValue'].sum().reset_index()
 
-# Sort Vendors with the highest unsold inventory value
-inventory_value_per_vendor = inventory_value_per_vendor.sort_values(by='UnsoldInventoryValue', ascending=False)
+# Vendors sorted by the highest unsold inventory value
+inventory_value_per_vendor = top_n(conn, 'vendor', 'UnsoldInventoryValueSum', None, 'consistent', source = TABLE).rename('UnsoldInventoryValue').reset_index()
 inventory_value_per_vendor['UnsoldInventoryValue'] = inventory_value_per_vendor['UnsoldInventoryValue'].apply(lambda x: format_dollars(x))
 print("Unsold Inventory Value per Vendor:")
 print(inventory_value_per_vendor.head(10))
 
 
 
-top_threshold = df["TotalSalesDollars"].quantile(0.75)
-bottom_threshold = df["TotalSalesDollars"].quantile(0.25)
+top_threshold = ctx.quantile("TotalSalesDollars", 0.75, 'consistent')
+bottom_threshold = ctx.quantile("TotalSalesDollars", 0.25, 'consistent')
 
-top_vendors = df[df["TotalSalesDollars"] >= top_threshold]["ProfitMargin"].dropna()
-bottom_vendors = df[df["TotalSalesDollars"] <= bottom_threshold]["ProfitMargin"].dropna()
+sales_dollars = ctx.column("TotalSalesDollars", 'consistent')
+profit_margin = ctx.column("ProfitMargin", 'consistent')
+top_vendors = profit_margin[sales_dollars >= top_threshold].dropna()
+bottom_vendors = profit_margin[sales_dollars <= bottom_threshold].dropna()
 
 print("Top Vendors Profit Margin:")
 print(top_vendors)